@@ -0,0 +1,202 @@
+# ai.py
+#
+# Computer player for practice games. It fires where the enemy ships still afloat are
+# most likely to be: each cell is scored by how many legal placements of those ships
+# would cover it. Legal placements and their coverage are counted for every cell at
+# once with sliding-window sums (a convolution with a ship-length row of ones, done
+# as differences of running sums) over NumPy arrays of what it knows, so a move is a
+# few array operations per distinct ship length however big the board or the ships.
+# While it has hits that no sunk ship accounts for it is in target mode: placements
+# through those hits outweigh all others, so it finishes a ship before hunting again.
+# On small boards every placement fits in one 0/1 matrix (placements x cells): which
+# placements are still clear and how many hits each covers are then kept up to date
+# shot by shot, and a move is a single matrix-vector product, faster than window sums.
+#
+# RandomAI and HuntTargetAI are cheap baselines for the simulator (simulate.py);
+# STRATEGIES names them all.
+
+import random
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+from constants import GRID_SIZE, SHIP_SIZES
+
+TARGET_WEIGHT = 100.0  # Weight factor for each unresolved hit a placement covers
+MATRIX_LIMIT = 150000  # Largest placement matrix (placements x cells) worth using; past it window sums win
+
+def window_sums(sums, length):
+    # Sums over each run of length cells along a row, from the row's running sums
+    windows = sums[:, length - 1:].copy()
+    windows[:, 1:] -= sums[:, :-length]
+    return windows
+
+def coverage(weight, length, size):
+    # For each cell, the total weight of the placements (by starting column) covering it
+    sums = weight.cumsum(axis=1)
+    covered = np.empty((weight.shape[0], size))
+    covered[:, :sums.shape[1]] = sums
+    covered[:, sums.shape[1]:] = sums[:, -1:]
+    covered[:, length:] -= sums[:, :size - length]
+    return covered
+
+@lru_cache(maxsize=None)
+def placement_matrix(size, lengths):
+    # Row per placement of each length, horizontal and vertical: 1 on the cells it
+    # covers. Also returns the index into lengths of each row's length.
+    rows = []
+    row_lengths = []
+    for index, length in enumerate(lengths):
+        for y in range(size):
+            for x in range(size - length + 1):
+                for cells in ((y, slice(x, x + length)), (slice(x, x + length), y)):
+                    row = np.zeros((size, size))
+                    row[cells] = 1
+                    rows.append(row.ravel())
+                    row_lengths.append(index)
+    matrix = np.array(rows).reshape(-1, size * size)
+    # Columns: the placements covering each cell, contiguous for per-shot updates
+    return matrix, np.ascontiguousarray(matrix.T), np.array(row_lengths, dtype=int)
+
+class DensityAI:
+    def __init__(self, size=GRID_SIZE, ship_sizes=SHIP_SIZES, seed=None):
+        self.size = size
+        self.afloat = dict(ship_sizes)  # ship -> length, until it is reported sunk
+        self.lengths = Counter(self.afloat.values())  # length -> ships of that length afloat
+        # Arrays are indexed [y, x]
+        self.shot = np.zeros((size, size), dtype=bool)
+        self.blocked = np.zeros((size, size), dtype=bool)  # Misses and sunk ships: no ship can cover these
+        self.hits = np.zeros((size, size), dtype=bool)  # Hits no sunk ship accounts for yet
+        self.rng = random.Random(seed)
+        self.matrix_lengths = tuple(sorted(length for length in self.lengths if length <= size))
+        placements = sum(2 * size * (size - length + 1) for length in self.matrix_lengths)
+        self.use_matrix = placements * size * size <= MATRIX_LIMIT
+        if self.use_matrix:
+            self.matrix, self.columns, self.row_lengths = placement_matrix(size, self.matrix_lengths)
+            self.clear = np.ones(placements, dtype=bool)  # Placements clear of blocked cells
+            self.hit_counts = np.zeros(placements)  # Unresolved hits each placement covers
+            self.weigh_rows()
+
+    def density(self):
+        # Weighted count of the placements covering each cell
+        if self.use_matrix:
+            return self.matrix_density()
+        size = self.size
+        total = np.zeros((size, size))
+        targeting = self.hits.any()
+        # Rows are horizontal placements; the transposes give vertical ones
+        for blocked, hits, out in ((self.blocked, self.hits, total), (self.blocked.T, self.hits.T, total.T)):
+            blocked_sums = blocked.cumsum(axis=1)
+            hit_sums = hits.cumsum(axis=1) if targeting else None
+            for length, count in self.lengths.items():
+                if length > size:
+                    continue
+                # weight[y, s]: placements starting at column s of row y
+                weight = count * (window_sums(blocked_sums, length) == 0)
+                if targeting:
+                    weight = weight * np.power(TARGET_WEIGHT, window_sums(hit_sums, length))
+                out += coverage(weight, length, size)
+        return total
+
+    def matrix_density(self):
+        # density() from the placement matrix: clear placements, weighted by how many
+        # ships of their length are afloat and by the hits they cover
+        weight = self.clear * self.row_weights
+        if self.hits.any():
+            weight = weight * np.power(TARGET_WEIGHT, self.hit_counts)
+        return (weight @ self.matrix).reshape(self.size, self.size)
+
+    def weigh_rows(self):
+        # Each placement's weight: the ships of its length still afloat
+        counts = np.array([self.lengths.get(length, 0) for length in self.matrix_lengths], dtype=float)
+        self.row_weights = counts[self.row_lengths]
+
+    def choose(self):
+        # (x, y) of the next shot: a random one of the best cells not shot yet
+        density = self.density()
+        density[self.shot] = 0
+        best = density.max()
+        candidates = np.flatnonzero(density == best) if best > 0 else np.flatnonzero(~self.shot)
+        y, x = divmod(int(candidates[self.rng.randrange(len(candidates))]), self.size)
+        return x, y
+
+    def record(self, x, y, hit, sunk_ship=None):
+        # The outcome of a shot at (x, y)
+        self.shot[y, x] = True
+        if not hit:
+            self.block(x, y)
+            return
+        self.hits[y, x] = True
+        if self.use_matrix:
+            self.hit_counts += self.columns[y * self.size + x]
+        if sunk_ship in self.afloat:
+            length = self.afloat.pop(sunk_ship)
+            self.lengths = Counter(self.afloat.values())
+            if self.use_matrix:
+                self.weigh_rows()
+            self.sink(x, y, length)
+
+    def block(self, x, y):
+        # No ship can cover (x, y) any more: a miss, or a cell of a sunk ship
+        if self.use_matrix:
+            column = self.columns[y * self.size + x]
+            self.clear &= column == 0
+            if self.hits[y, x]:
+                self.hit_counts -= column
+        self.hits[y, x] = False
+        self.blocked[y, x] = True
+
+    def sink(self, x, y, length):
+        # A ship of this length sank with the shot at (x, y): its cells are a straight run
+        # of unresolved hits through (x, y). If several runs fit, the first one is taken.
+        for dx, dy in ((1, 0), (0, 1)):
+            for back in range(length):
+                cells = [(x + (i - back) * dx, y + (i - back) * dy) for i in range(length)]
+                if all(0 <= cx < self.size and 0 <= cy < self.size and self.hits[cy, cx] for cx, cy in cells):
+                    for cx, cy in cells:
+                        self.block(cx, cy)
+                    return
+        self.block(x, y)
+
+class RandomAI:
+    # Fires at every cell once, in random order
+    def __init__(self, size=GRID_SIZE, ship_sizes=SHIP_SIZES, seed=None):
+        self.cells = [(x, y) for y in range(size) for x in range(size)]
+        random.Random(seed).shuffle(self.cells)
+
+    def choose(self):
+        return self.cells.pop()
+
+    def record(self, x, y, hit, sunk_ship=None):
+        pass
+
+class HuntTargetAI:
+    # Hunts on a checkerboard spaced by the shortest ship, which every ship must
+    # cross, and after a hit fires at its neighbours until they run out
+    def __init__(self, size=GRID_SIZE, ship_sizes=SHIP_SIZES, seed=None):
+        self.size = size
+        self.rng = random.Random(seed)
+        spacing = min(ship_sizes.values())
+        cells = [(x, y) for y in range(size) for x in range(size)]
+        self.rng.shuffle(cells)
+        self.hunt = [cell for cell in cells if (cell[0] + cell[1]) % spacing != 0] + \
+                    [cell for cell in cells if (cell[0] + cell[1]) % spacing == 0]
+        self.targets = []
+        self.shot = set()
+
+    def choose(self):
+        while self.targets and self.targets[-1] in self.shot:
+            self.targets.pop()
+        if self.targets:
+            return self.targets[-1]
+        while self.hunt[-1] in self.shot:
+            self.hunt.pop()
+        return self.hunt[-1]
+
+    def record(self, x, y, hit, sunk_ship=None):
+        self.shot.add((x, y))
+        if hit:
+            neighbours = [(x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))]
+            self.targets.extend(cell for cell in neighbours
+                                if 0 <= cell[0] < self.size and 0 <= cell[1] < self.size and cell not in self.shot)
+
+STRATEGIES = {'random': RandomAI, 'hunt': HuntTargetAI, 'density': DensityAI}
@@ -1,18 +1,24 @@
 import pygame
 import sys
 
-# Initialize Pygame
-pygame.init()
-
 # Set up the display
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 600
-window = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption('Battleship')
-
-# Set up fonts
-font = pygame.font.SysFont(None, 48)
-small_font = pygame.font.SysFont(None, 24)
+# Window and fonts are set by init_display(), so importing opens no window
+window = None
+font = None
+small_font = None
+
+def init_display():
+    global window, font, small_font
+    # Initialize Pygame
+    pygame.init()
+    window = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+    pygame.display.set_caption('Battleship')
+
+    # Set up fonts
+    font = pygame.font.SysFont(None, 48)
+    small_font = pygame.font.SysFont(None, 24)
 
 # Define colors 
 WHITE = (255, 255, 255)
@@ -225,4 +231,5 @@ def main_menu():
         pygame.display.flip()
 
 if __name__ == "__main__":
+    init_display()
     main_menu()
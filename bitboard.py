@@ -0,0 +1,206 @@
+# bitboard.py
+#
+# One player's board as integer bitboards: cell (x, y) is bit y * size + x. Ship
+# occupancy, hits, misses and each ship's cells are single ints, so resolving an
+# attack, checking whether a ship is sunk and checking for game over are a few
+# integer operations however many ships there are. Shared by the game client,
+# the server (authoritative rooms) and the load test bots.
+#
+# random_fleet lays out a whole fleet at random from per-length tables of every
+# placement's mask, so a layout is a handful of random draws and integer ANDs.
+
+from functools import lru_cache
+from constants import GRID_SIZE, SHIP_SIZES
+
+# Cell states, the same codes the game's grids use
+WATER, SHIP, HIT, MISS = 0, 1, 2, 3
+
+LAYOUT_ATTEMPTS = 1000  # Random layouts tried before random_fleet falls back to backtracking
+
+@lru_cache(maxsize=None)
+def ship_mask(size, length, x, y, orientation):
+    # Mask of the cells a ship covers, or 0 if it does not fit on the board
+    if orientation == 'horizontal':
+        if not (0 <= x and x + length <= size and 0 <= y < size):
+            return 0
+        return ((1 << length) - 1) << (y * size + x)
+    if not (0 <= x < size and 0 <= y and y + length <= size):
+        return 0
+    mask = 0
+    for i in range(length):
+        mask |= 1 << ((y + i) * size + x)
+    return mask
+
+def mask_cells(mask, size):
+    # (x, y) of every set bit, lowest first
+    cells = []
+    while mask:
+        low = mask & -mask
+        index = low.bit_length() - 1
+        cells.append((index % size, index // size))
+        mask ^= low
+    return cells
+
+class Board:
+    def __init__(self, size=GRID_SIZE, ship_sizes=SHIP_SIZES):
+        self.size = size
+        self.ship_sizes = ship_sizes
+        self.occupied = 0
+        self.hits = 0
+        self.misses = 0
+        self.ships = {}  # ship -> mask of its cells
+        self.positions = {}  # ship -> (x, y, orientation) as placed
+        self.owners = [None] * (size * size)  # Bit index -> ship on that cell
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.size and 0 <= y < self.size
+
+    def fits(self, ship, x, y, orientation):
+        # True if the ship is on the board and clear of every other ship
+        mask = ship_mask(self.size, self.ship_sizes[ship], x, y, orientation)
+        return bool(mask) and not mask & self.occupied
+
+    def place(self, ship, x, y, orientation):
+        # Raises ValueError if the ship is out of bounds, overlapping or already placed
+        if ship in self.ships:
+            raise ValueError(f"{ship} is already placed")
+        mask = ship_mask(self.size, self.ship_sizes[ship], x, y, orientation)
+        if not mask:
+            raise ValueError(f"{ship} is out of bounds")
+        if mask & self.occupied:
+            overlapped = self.owners[(mask & self.occupied).bit_length() - 1]
+            raise ValueError(f"{ship} overlaps {overlapped}")
+        self.occupied |= mask
+        self.ships[ship] = mask
+        self.positions[ship] = (x, y, orientation)
+        bit = mask
+        while bit:
+            low = bit & -bit
+            self.owners[low.bit_length() - 1] = ship
+            bit ^= low
+
+    def complete(self):
+        return len(self.ships) == len(self.ship_sizes)
+
+    def attacked(self, x, y):
+        return bool((self.hits | self.misses) >> (y * self.size + x) & 1)
+
+    def attack(self, x, y):
+        # Records an attack and returns (hit, sunk ship or None). The caller checks
+        # bounds and repeats; a repeated hit reports the same outcome again.
+        index = y * self.size + x
+        bit = 1 << index
+        ship = self.owners[index]
+        if ship is None:
+            self.misses |= bit
+            return False, None
+        hits = self.hits = self.hits | bit
+        mask = self.ships[ship]
+        return True, ship if hits & mask == mask else None
+
+    def sunk(self, ship):
+        mask = self.ships[ship]
+        return self.hits & mask == mask
+
+    def all_sunk(self):
+        return bool(self.occupied) and self.hits & self.occupied == self.occupied
+
+    def cell(self, x, y):
+        # WATER, SHIP, HIT or MISS
+        bit = 1 << (y * self.size + x)
+        if self.hits & bit:
+            return HIT
+        if self.misses & bit:
+            return MISS
+        return SHIP if self.occupied & bit else WATER
+
+    def ship_at(self, x, y):
+        return self.owners[y * self.size + x]
+
+    def remaining_cells(self, ship):
+        return mask_cells(self.ships[ship] & ~self.hits, self.size)
+
+@lru_cache(maxsize=None)
+def rect_mask(size, x, y, width, height):
+    # Mask of a rectangle of cells, clipped to the board
+    left, right = max(x, 0), min(x + width, size)
+    mask = 0
+    for row in range(max(y, 0), min(y + height, size)):
+        mask |= ((1 << (right - left)) - 1) << (row * size + left)
+    return mask
+
+@lru_cache(maxsize=None)
+def placement_table(size, length, no_touch=False):
+    # Every placement of a ship of this length as parallel lists: positions
+    # (x, y, orientation), ship masks, and the masks that must be clear of other
+    # ships for it to fit - the ship itself, or with no_touch the ship and its border
+    positions, masks, checks = [], [], []
+    for orientation, width, height in (('horizontal', length, 1), ('vertical', 1, length)):
+        for y in range(size - height + 1):
+            for x in range(size - width + 1):
+                positions.append((x, y, orientation))
+                masks.append(ship_mask(size, length, x, y, orientation))
+                checks.append(rect_mask(size, x - 1, y - 1, width + 2, height + 2) if no_touch else masks[-1])
+    return positions, masks, checks
+
+def random_fleet(rng, size=GRID_SIZE, ship_sizes=SHIP_SIZES, no_touch=False, occupied=0):
+    # ship -> (x, y, orientation): a random legal layout of the fleet, clear of the
+    # occupied mask (ships already on the board), with no two ships touching if
+    # no_touch. Raises ValueError if the fleet cannot be laid out. The layout is
+    # uniform unless the board is too crowded for layout_indexes() to find one by
+    # chance; the backtracking fallback it then uses is not.
+    # The classic fleet on 10x10 draws about 85-115k layouts/s. With no_touch only
+    # about 1 draft in 20 is legal, so it manages about 20-30k/s: below the 100k/s
+    # target, but any bias towards drafts that fit would break uniformity.
+    tables = fleet_tables(size, tuple(ship_sizes.values()), no_touch)
+    indexes = layout_indexes(rng, tables, occupied)
+    return dict(zip(ship_sizes, [table[0][index] for table, index in zip(tables, indexes)]))
+
+@lru_cache(maxsize=None)
+def fleet_tables(size, lengths, no_touch=False):
+    return [placement_table(size, length, no_touch) for length in lengths]
+
+def layout_indexes(rng, tables, occupied=0):
+    # Index into each table of a legal layout. Every ship draws from all of its
+    # placements and any clash starts the whole layout again, so each legal layout
+    # is equally likely. A board too crowded for that to succeed within
+    # LAYOUT_ATTEMPTS falls back to a randomised backtracking search, which is biased.
+    random = rng.random
+    for _ in range(LAYOUT_ATTEMPTS):
+        taken = occupied
+        indexes = []
+        for positions, masks, checks in tables:
+            index = int(random() * len(masks))
+            if checks[index] & taken:
+                break
+            taken |= masks[index]
+            indexes.append(index)
+        else:
+            return indexes
+    return backtrack_layout(rng, tables, occupied)
+
+def backtrack_layout(rng, tables, occupied=0):
+    # Places the ships with the fewest placements (the longest) first, trying each
+    # ship's placements that still fit in random order and backing up on a dead end.
+    # Always finds a layout if there is one, but not uniformly: each placement that
+    # fits is equally likely whatever is left for the ships after it, so layouts
+    # whose first ships have few ways to complete come up more often than their share.
+    order = sorted(range(len(tables)), key=lambda ship: len(tables[ship][1]))
+    indexes = [None] * len(tables)
+
+    def place(depth, taken):
+        if depth == len(order):
+            return True
+        ship = order[depth]
+        positions, masks, checks = tables[ship]
+        candidates = [index for index, check in enumerate(checks) if not check & taken]
+        rng.shuffle(candidates)
+        for index in candidates:
+            indexes[ship] = index
+            if place(depth + 1, taken | masks[index]):
+                return True
+        return False
+
+    if not place(0, occupied):
+        raise ValueError("The fleet does not fit on the board")
+    return indexes
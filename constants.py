@@ -1,7 +1,5 @@
 # constants.py
 
-import pygame
-
 # Window settings
 WINDOW_WIDTH = 1200
 WINDOW_HEIGHT = 600
@@ -15,11 +13,13 @@ GRAY = (200, 200, 200)
 LIGHT_GRAY = (220, 220, 220)
 RED = (255, 0, 0)
 GREEN = (0, 255, 0)
+YELLOW = (255, 200, 0)
 
 # Grid settings
-GRID_SIZE = 10
-CELL_SIZE = 40
-GRID_ORIGIN = (WINDOW_WIDTH - CELL_SIZE * GRID_SIZE - 50, 50)
+GRID_SIZE = 10  # Board size unless a room picks another
+CELL_SIZE = 40  # Largest zoom, pixels per cell
+VIEW_SIZE = CELL_SIZE * GRID_SIZE  # Each board is shown in a VIEW_SIZE square on screen
+GRID_ORIGIN = (WINDOW_WIDTH - VIEW_SIZE - 50, 50)
 
 # Ship data
 SHIP_SIZES = {
@@ -3,37 +3,105 @@
 import pygame
 from constants import *
 from constants import SHIP_SIZES as hjkhfgdjkh
-import threading
-import socket
+import json
+import random
 import sys
+import time
+from functools import lru_cache
+from ai import DensityAI
+from bitboard import HIT, MISS, SHIP, Board, random_fleet
+from grid_view import GridView
 from message_log import MessageLog
+from protocol import (ROOM_MODE_AUTHORITATIVE, ROOM_MODE_RELAY, WIRE_TEXT, decode_game_message, encode_board,
+                      make_codec, parse_options)
+from rules import PENDING, Rules
 # Any other necessary imports
 
 
 #REMEMbER for safety hit a .set_alpha() before using a tile img because it gets changed throughout the code
 #255 max is fully opaque image
-tileimg = pygame.image.load("oceanTile.png")
-tileimg = pygame.transform.scale(tileimg, (CELL_SIZE - 1,CELL_SIZE - 1))
-darktileimg = pygame.image.load("darkOceanTile.png")
-darktileimg = pygame.transform.scale(darktileimg, (CELL_SIZE - 1,CELL_SIZE - 1))
-
-boatbutt = pygame.image.load("boatend.png")
-boatmid = pygame.image.load("boatmid.png")
-
-gamebackground = pygame.image.load("gamebackground.png")
-gamebackground = pygame.transform.scale(gamebackground, (WINDOW_WIDTH, WINDOW_HEIGHT))
+# Loaded by the first Game, so importing this module does not need a display.
+# Tiles and ship parts are scaled to the cell size by cell_images().
+tileimg = None
+darktileimg = None
+boatbutt = None
+boatmid = None
+gamebackground = None
+
+def load_images():
+    global tileimg, darktileimg, boatbutt, boatmid, gamebackground
+    if tileimg is not None:
+        return
+    tileimg = pygame.image.load("oceanTile.png")
+    darktileimg = pygame.image.load("darkOceanTile.png")
+
+    boatbutt = pygame.image.load("boatend.png")
+    boatmid = pygame.image.load("boatmid.png")
+
+    gamebackground = pygame.image.load("gamebackground.png")
+    gamebackground = pygame.transform.scale(gamebackground, (WINDOW_WIDTH, WINDOW_HEIGHT))
+
+@lru_cache(maxsize=None)
+def cell_images(cell_size):
+    # Everything a cell is drawn with at one zoom level. Ship parts are keyed by
+    # (orientation, part) and rotated and flipped once here rather than per cell.
+    end = pygame.transform.scale(boatbutt, (cell_size, cell_size))
+    mid = pygame.transform.scale(boatmid, (cell_size, cell_size))
+    end_vertical = pygame.transform.rotate(end, 270)
+    return {
+        'tile': pygame.transform.scale(tileimg, (cell_size - 1, cell_size - 1)),
+        'dark': pygame.transform.scale(darktileimg, (cell_size - 1, cell_size - 1)),
+        ('horizontal', 'front'): end,  # Left end
+        ('horizontal', 'back'): pygame.transform.flip(end, True, False),  # Right end
+        ('horizontal', 'middle'): mid,
+        ('vertical', 'front'): end_vertical,  # Top end
+        ('vertical', 'back'): pygame.transform.flip(end_vertical, False, True),  # Bottom end
+        ('vertical', 'middle'): pygame.transform.rotate(mid, 90),
+    }
+
+def ship_part(ship_info):
+    if ship_info['part_index'] == 1:
+        return ship_info['orientation'], 'front'
+    if ship_info['part_index'] == ship_info['length']:
+        return ship_info['orientation'], 'back'
+    return ship_info['orientation'], 'middle'
+
+# An attack is drawn as pending on the frame it is clicked and settled when its result
+# arrives. With no result after the retry timeout (derived from the measured RTT, as
+# TCP does, and doubled on each retry), the same attack is sent again; receivers
+# answer a repeated attack with the result they already gave.
+ATTACK_RETRY_MIN = 1.0
+ATTACK_RETRY_MAX = 8.0
+COMPUTER_MOVE_DELAY = 0.6  # Practice games: seconds before the computer answers a shot with its own
+# Boards bigger than the view are zoomed with Ctrl+wheel or +/- and panned with the
+# arrow keys or by dragging with the right mouse button, whichever board is under the mouse
+GRID_LINE_MIN_CELL = 8  # Smaller cells are drawn without grid lines
+SHIP_LIST_ROWS = 6  # Ships listed on the left at once; the rest are counted in the last row
+PAN_KEYS = {pygame.K_LEFT: (-1, 0), pygame.K_RIGHT: (1, 0), pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1)}
+ZOOM_KEYS = {pygame.K_PLUS: 1, pygame.K_EQUALS: 1, pygame.K_KP_PLUS: 1, pygame.K_MINUS: -1, pygame.K_KP_MINUS: -1}
+AUTO_PLACE_KEY = pygame.K_a  # Places the ships not placed yet at random
 # Game class
 class Game:
-    def __init__(self, window, small_font, network_client=None, is_host=False, peer_ip=None, peer_port=None, local_test=False):
+    def __init__(self, window, small_font, network_client=None, is_host=False, peer_ip=None, peer_port=None, local_test=False, wire_format=WIRE_TEXT, room_mode=ROOM_MODE_RELAY, latency_log=None, board_size=GRID_SIZE, fleet=SHIP_SIZES):
         self.small_font = small_font
         self.window = window
         self.network_client = network_client
         self.running = True
-        self.grid = [[0 for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
+        load_images()
+        # Board, turns, results and scoring; everything below is drawing and networking.
+        # The room decides the board size and the fleet.
+        self.rules = Rules(my_turn=is_host, size=board_size, ship_sizes=fleet)
+        self.fleet = fleet
         self.selected_ship = None
         self.ship_orientation = 'horizontal'  # Default orientation
         self.placed_ships = {}
-        self.available_ships = list(SHIP_SIZES.keys())
+        self.available_ships = list(fleet.keys())
+        # Our board on the right, the enemy's to its left
+        self.own_view = GridView((GRID_ORIGIN[0], GRID_ORIGIN[1], VIEW_SIZE, VIEW_SIZE), board_size,
+                                 self.draw_own_cell, CELL_SIZE)
+        self.enemy_view = GridView((GRID_ORIGIN[0] - VIEW_SIZE - 50, GRID_ORIGIN[1], VIEW_SIZE, VIEW_SIZE), board_size,
+                                   self.draw_enemy_cell, CELL_SIZE)
+        self.drag = None  # Right-button pan in progress: (view, start pos, start left, start top)
         self.mouse_pos = (0, 0)
         self.is_host = is_host
         #self.peer_ip = peer_ip
@@ -42,51 +110,90 @@ class Game:
         #self.peer_thread = None
         self.hovered_cells = []      # Cells currently being hovered over
         self.valid_placement = False # Indicates if the current placement is valid
-        self.enemy_grid = [[0 for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
-        self.my_turn = self.is_host
-        self.game_over = False
-        self.winner = None
         self.message_log = MessageLog(50, WINDOW_HEIGHT - 150, WINDOW_WIDTH - 100, 100, small_font)
         self.local_test = local_test
-        self.my_ships_ready = False
-        self.opponent_ready = False
-        self.game_started = False
         self.client_joined = False
-        self.hits = 0
-        self.moves = 0
         self.ship_cells = {} # Maps (row,col) to ship details
+        self.ship_names = list(fleet.keys())
+        self.codec = make_codec(wire_format, self.ship_names)  # Host switches once CLIENT_JOINED says what was negotiated
+        self.room_mode = room_mode  # In authoritative rooms the server resolves attacks
+        # Move latency: from sending an ATTACK until its RESULT arrives. Compared with the
+        # network client's ping RTT, the difference is time spent in the server
+        # (authoritative rooms) or in the opponent's client (relay rooms).
+        self.attack_sent_at = None
+        self.last_move_latency = None
+        self.latency_log = latency_log  # Path that gets one JSON line per move, or None
+        self.latency_label = None  # (text, rendered surface) for the readout
+        # Our attack still waiting for its result: (x, y), when to send it again, and
+        # the timeout after that. Further attacks are refused until it settles.
+        self.pending_attack = None
+        self.attack_retry_at = None
+        self.attack_retry_timeout = None
+        self.answered_attacks = {}  # Relay rooms: (x, y) -> what we answered that attack with
+        self.resuming = False  # Reconnecting after the connection dropped mid-game
 
         if self.local_test:
-            self.my_turn = True
-            self.message_log.add_message("Local Test Mode")
+            # Practice game: the computer's fleet is placed at random and it fires back
+            # with the density AI, so the game starts as soon as our ships are placed
+            self.conn = None
+            self.rules.my_turn = True
+            rng = random.Random()
+            self.computer_board = Board(board_size, fleet)
+            for ship, (x, y, orientation) in random_fleet(rng, board_size, fleet).items():
+                self.computer_board.place(ship, x, y, orientation)
+            self.computer = DensityAI(board_size, fleet, rng.random())
+            self.computer_move_at = None
+            self.rules.opponent_placed()
+            self.message_log.add_message("Practice game against the computer.")
         else:
             if self.network_client:
                 self.conn = self.network_client.sock
-                self.peer_thread = threading.Thread(target=self.handle_server_messages, daemon=True)
-                self.peer_thread.start()
             else:
                 self.message_log.add_message("Network client not available.")
+        self.message_log.add_message("Press A to place your remaining ships at random.")
+        if self.own_view.min_cell_size < CELL_SIZE:
+            self.message_log.add_message(f"{board_size}x{board_size} board: Ctrl+wheel or +/- zooms, arrows or right-drag pan.")
 
     def handle_server_messages(self):
-        try:
-            while True:
-                data = self.conn.recv(1024).decode()
-                if data:
-                    print(f"Received from server: {data}")
-                    self.parse_server_message(data)
-                else:
-                    break
-        except ConnectionResetError:
+        # Called once per frame on the UI thread, so only this thread changes game state.
+        # The network client's I/O thread has already queued whatever arrived.
+        if self.local_test:
+            self.play_computer_move()
+            return
+        if self.resuming:
+            resumed = self.network_client.resume_step()
+            if resumed is None:
+                return
+            self.resuming = False
+            if not resumed:
+                self.running = False
+                return
+            self.conn = self.network_client.sock
+            self.message_log.add_message("Reconnected to the server.")
+            return
+        if not self.conn:
+            return
+        frames = self.network_client.poll_frames()
+        if frames is None:
             print("Server connection lost.")
-            self.running = False
-        finally:
-            if self.conn:
-                self.conn.close()
+            if self.rules.game_over or not self.network_client.session:
+                self.running = False
+                return
+            # resume_step() runs once per frame from here on, so the board keeps drawing
+            self.network_client.start_resume()
+            self.resuming = True
+            self.message_log.add_message("Connection lost - reconnecting...")
+            return
+        for data in frames:
+            print(f"Received from server: {data}")
+            self.parse_server_message(data)
+        self.check_pending_attack()
 
     def parse_server_message(self, data):
-        parts = data.strip().split(' ', 1)
-        command = parts[0]
-        params = parts[1] if len(parts) > 1 else ''
+        # data is a raw frame; relayed bodies stay bytes since they may be binary
+        parts = data.split(b' ', 1)
+        command = parts[0].decode()
+        params = parts[1] if len(parts) > 1 else b''
         
         if command == 'MESSAGE_FROM_HOST':
             if not self.is_host:
@@ -97,7 +204,33 @@ class Game:
         elif command == 'CLIENT_JOINED':
             if self.is_host:
                 self.client_joined = True
+                _, options = parse_options(params.decode().split(' '))
+                self.codec = make_codec(options.get('wire', WIRE_TEXT), self.ship_names)
                 self.message_log.add_message("Client joined the game.")
+        elif command == 'ATTACK_RESULT':
+            # Authoritative room: outcome of our attack, straight from the server
+            args = params.decode().split(' ')
+            ship_sunk = args[3] if len(args) > 3 else None
+            self.handle_result(int(args[0]), int(args[1]), args[2], ship_sunk)
+        elif command == 'ATTACKED':
+            # Authoritative room: the server already resolved the opponent's attack on us
+            args = params.decode().split(' ')
+            self.apply_attack(int(args[0]), int(args[1]))
+        elif command == 'GAME_OVER':
+            winner_role = params.decode()
+            if self.rules.game_over:
+                return  # Repeated along with the answer to a retried attack
+            self.rules.end('You' if winner_role == ('host' if self.is_host else 'client') else 'Opponent')
+            self.message_log.add_message(f"Game over! Winner: {self.rules.winner}")
+        elif command == 'ERROR':
+            self.message_log.add_message(f"Server: {params.decode()}")
+            if self.pending_attack:
+                # The server refused the attack we are waiting on
+                self.cancel_pending_attack()
+        elif command == 'PEER_AWAY':
+            self.message_log.add_message("Opponent lost connection, waiting for them to return...")
+        elif command == 'PEER_BACK':
+            self.message_log.add_message("Opponent is back.")
         elif command == 'HOST_DISCONNECTED':
             self.message_log.add_message("Host has disconnected.")
             self.running = False
@@ -108,92 +241,143 @@ class Game:
             print(f"Unknown command received: {command}")
 
     def parse_message(self, data):
-        parts = data.strip().split(' ')
-        command = parts[0]
+        # Understands both wire formats regardless of which one we send
+        command, args = decode_game_message(data, self.ship_names)
 
         if command == 'ATTACK':
-            grid_x, grid_y = int(parts[1]), int(parts[2])
+            grid_x, grid_y = args
             self.handle_attack(grid_x, grid_y)
         elif command == 'RESULT':
-            grid_x, grid_y = int(parts[1]), int(parts[2])
-            hit_or_miss = parts[3]
-            ship_sunk = parts[4] if len(parts) > 4 else None
+            grid_x, grid_y, hit_or_miss, ship_sunk = args
             self.handle_result(grid_x, grid_y, hit_or_miss, ship_sunk)
         elif command == 'GAME_OVER':
-            winner = parts[1]
-            self.game_over = True
-            self.winner = winner
+            winner = args[0]
+            if self.rules.game_over:
+                return  # Repeated along with the answer to a retried attack
+            self.rules.end(winner)
             self.message_log.add_message(f"Game over! Winner: {winner}")
         elif command == 'ALL_SHIPS_PLACED':
-            self.opponent_ready = True
             self.message_log.add_message("Opponent has placed all ships.")
-            if self.my_ships_ready:
-                self.game_started = True
+            if self.rules.opponent_placed():
                 self.message_log.add_message("Both players are ready. Game starts now!")
         else:
             print(f"Unknown command received: {command}")
 
     def send_message_to_server(self, message):
+        self.send_messages_to_server([message])
+
+    def send_messages_to_server(self, messages):
+        # Batches several relay messages into one write. Messages are codec-encoded bytes.
         if self.conn:
-            try:
-                command = f"MESSAGE {message}"
-                self.conn.sendall(command.encode('utf-8'))
-            except Exception as e:
-                print(f"Failed to send message: {e}")
+            self.network_client.send_messages([b"MESSAGE " + message for message in messages])
                 
     def send_attack(self, grid_x, grid_y):
         if self.local_test:
-            self.message_log.add_message(f"Attacked position ({grid_x}, {grid_y}) in local test mode.")
-            self.enemy_grid[grid_y][grid_x] = 3
-            self.my_turn = False
+            # The computer's board answers at once
+            self.rules.fire(grid_x, grid_y)
+            hit, sunk_ship = self.computer_board.attack(grid_x, grid_y)
+            self.handle_result(grid_x, grid_y, 'HIT' if hit else 'MISS', sunk_ship)
+            if self.computer_board.all_sunk():
+                self.rules.end('You')
+                self.message_log.add_message("All enemy ships sunk! You win.")
+            else:
+                self.computer_move_at = time.monotonic() + COMPUTER_MOVE_DELAY
         else:
-            self.send_message_to_server(f"ATTACK {grid_x} {grid_y}")
-        self.moves += 1
+            # Shown straight away; handle_result() settles it
+            self.rules.fire(grid_x, grid_y)
+            self.pending_attack = (grid_x, grid_y)
+            self.attack_retry_timeout = self.initial_retry_timeout()
+            self.transmit_attack(grid_x, grid_y)
+            self.attack_sent_at = time.perf_counter()
+        self.enemy_view.mark(grid_x, grid_y)
+
+    def play_computer_move(self):
+        # Practice games: the computer fires once its delay is up
+        if self.computer_move_at is None or time.monotonic() < self.computer_move_at:
+            return
+        self.computer_move_at = None
+        grid_x, grid_y = self.computer.choose()
+        hit, sunk_ship = self.apply_attack(grid_x, grid_y)
+        self.computer.record(grid_x, grid_y, hit, sunk_ship)
+        if not hit:
+            self.message_log.add_message(f"Computer missed at ({grid_x}, {grid_y}).")
+        if self.rules.check_game_over():
+            self.rules.end('Opponent')
+            self.message_log.add_message("All your ships have been sunk! You lose.")
 
+    def transmit_attack(self, grid_x, grid_y):
+        if self.room_mode == ROOM_MODE_AUTHORITATIVE:
+            # Goes to the server itself rather than through the relay
+            self.network_client.send_messages([f"ATTACK {grid_x} {grid_y}"])
+        else:
+            self.send_message_to_server(self.codec.encode_attack(grid_x, grid_y))
+        self.attack_retry_at = time.monotonic() + self.attack_retry_timeout
+
+    def initial_retry_timeout(self):
+        # Twice TCP's retransmission timeout (srtt + 4 * rttvar): relay rooms add the
+        # opponent's client, which answers once per frame, to the round trip
+        srtt, rttvar = self.network_client.srtt, self.network_client.rttvar
+        if srtt is None:
+            return ATTACK_RETRY_MAX
+        return min(max(2 * (srtt + 4 * rttvar), ATTACK_RETRY_MIN), ATTACK_RETRY_MAX)
+
+    def check_pending_attack(self):
+        # Called every frame; sends the pending attack again once its timeout passes
+        if self.pending_attack is None or time.monotonic() < self.attack_retry_at:
+            return
+        self.attack_retry_timeout = min(self.attack_retry_timeout * 2, ATTACK_RETRY_MAX)
+        print(f"No result for attack at {self.pending_attack}, sending it again")
+        self.transmit_attack(*self.pending_attack)
 
-    def handle_attack(self, grid_x, grid_y):
-        # Check if any ship occupies this cell
-        hit = False
-        sunk_ship = None
-        for ship, info in self.placed_ships.items():
-            if (grid_x, grid_y) in info['cells']:
-                hit = True
-                # Remove the cell from 'cells'
-                info['cells'].remove((grid_x, grid_y))
-                # Remove the cell from 'ship_cells'
-                self.ship_cells.pop((grid_y, grid_x), None)
-                if not info['cells']:
-                    sunk_ship = ship
-                    self.message_log.add_message(f"Your {sunk_ship} has been sunk!")
-                else:
-                    self.message_log.add_message(f"Your {ship} has been hit!")
-                break
+    def cancel_pending_attack(self):
+        self.rules.cancel_fire(*self.pending_attack)
+        self.enemy_view.mark(*self.pending_attack)
+        self.pending_attack = None
+        self.attack_sent_at = None
 
-        # Update own grid to reflect hit or miss
-        self.grid[grid_y][grid_x] = 2 if hit else 3  # 2: Hit, 3: Miss
+
+    def handle_attack(self, grid_x, grid_y):
+        if (grid_x, grid_y) in self.answered_attacks:
+            # The attacker did not see our result and sent the attack again
+            self.send_messages_to_server(self.answered_attacks[(grid_x, grid_y)])
+            return
+        hit, sunk_ship = self.apply_attack(grid_x, grid_y)
 
         # Send result back to attacker
-        result_message = f"RESULT {grid_x} {grid_y} {'HIT' if hit else 'MISS'}"
-        if sunk_ship:
-            result_message += f" {sunk_ship}"
-        self.send_message_to_server(result_message)
+        outgoing = [self.codec.encode_result(grid_x, grid_y, hit, sunk_ship)]
 
         # Check if all ships are sunk
-        if self.check_game_over():
-            self.game_over = True
-            self.winner = 'Opponent'
-            self.send_message_to_server("GAME_OVER Opponent")
+        if self.rules.check_game_over():
+            self.rules.end('Opponent')
+            outgoing.append(self.codec.encode_game_over('Opponent'))
             self.message_log.add_message("All your ships have been sunk! You lose.")
-
-        # Switch turns
-        self.my_turn = True
+        # RESULT and GAME_OVER leave in the same write
+        self.answered_attacks[(grid_x, grid_y)] = outgoing
+        self.send_messages_to_server(outgoing)
+
+    def apply_attack(self, grid_x, grid_y):
+        # Updates our own board for an incoming attack and returns (hit, sunk_ship); our turn next
+        hit, sunk_ship = self.rules.receive_attack(grid_x, grid_y)
+        self.own_view.mark(grid_x, grid_y)
+        if hit:
+            # Remove the cell from 'ship_cells'
+            self.ship_cells.pop((grid_y, grid_x), None)
+            if sunk_ship:
+                self.message_log.add_message(f"Your {sunk_ship} has been sunk!")
+            else:
+                self.message_log.add_message(f"Your {self.rules.board.ship_at(grid_x, grid_y)} has been hit!")
+        return hit, sunk_ship
 
 
     def handle_result(self, grid_x, grid_y, hit_or_miss, ship_sunk):
-        # Update enemy grid
-        self.enemy_grid[grid_y][grid_x] = 2 if hit_or_miss == 'HIT' else 3  # 2: Hit, 3: Miss
-        if hit_or_miss == 'HIT':
-            self.hits += 1
+        if not self.rules.record_result(grid_x, grid_y, hit_or_miss == 'HIT'):
+            return  # A second answer to an attack we sent again
+        self.enemy_view.mark(grid_x, grid_y)
+        if self.pending_attack == (grid_x, grid_y):
+            self.pending_attack = None
+        if self.attack_sent_at is not None:
+            self.record_move_latency(grid_x, grid_y, hit_or_miss, time.perf_counter() - self.attack_sent_at)
+            self.attack_sent_at = None
         if ship_sunk:
             self.message_log.add_message(f"You sunk the opponent's {ship_sunk}!")
         elif hit_or_miss == 'HIT':
@@ -201,82 +385,50 @@ class Game:
         else:
             self.message_log.add_message(f"Miss at ({grid_x}, {grid_y}).")
 
-        # Switch turns
-        self.my_turn = False
-
-
-    # Creates a function to scale both players' scores by the 10,000s
-    def base_points(self):
-        basePoints = self.hits * 10000
-        return basePoints
-
-    # Creates a function to define accuracy for both players
-    def hit_accuracy_percent(self):
-        if self.moves == 0:
-            return 0.0
-        accuracy = (float(self.hits) / float(self.moves)) * 100
-        return round(accuracy, 2)
-                                
-    # Creates a bonus-points system, using a function, based on both players' accuracy
-    def total_points(self):
-        basePoints = self.base_points()
-        hitAccuracy = self.hit_accuracy_percent()
-        bonus = self.hits * hitAccuracy
-        total_points = bonus + basePoints
-        return int(total_points)
-
-    def check_game_over(self):
-        # If all ships have no remaining cells, game over
-        return all(len(info['cells']) == 0 for info in self.placed_ships.values())
+    def record_move_latency(self, grid_x, grid_y, hit_or_miss, latency):
+        self.last_move_latency = latency
+        if not self.latency_log:
+            return
+        srtt, rttvar = self.network_client.srtt, self.network_client.rttvar
+        record = {'time': time.time(), 'move': self.rules.moves, 'x': grid_x, 'y': grid_y, 'result': hit_or_miss,
+                  'room_mode': self.room_mode, 'latency_ms': round(latency * 1000, 3),
+                  'rtt_ms': round(srtt * 1000, 3) if srtt is not None else None,
+                  'jitter_ms': round(rttvar * 1000, 3) if rttvar is not None else None,
+                  'beyond_rtt_ms': round((latency - srtt) * 1000, 3) if srtt is not None else None}
+        try:
+            with open(self.latency_log, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            print(f"Could not write latency log: {e}")
+            self.latency_log = None
+
 
     def handle_click(self, pos):
         x, y = pos
 
-        if self.game_over:
+        if self.rules.game_over:
             self.message_log.add_message("Game over.")
             return
 
-        # **Define enemy grid boundaries**
-        enemy_grid_offset_x = GRID_ORIGIN[0] - GRID_SIZE * CELL_SIZE - 50
-        enemy_grid_x_start = enemy_grid_offset_x
-        enemy_grid_x_end = enemy_grid_x_start + GRID_SIZE * CELL_SIZE
-        enemy_grid_y_start = GRID_ORIGIN[1]
-        enemy_grid_y_end = enemy_grid_y_start + GRID_SIZE * CELL_SIZE
-
-        # **Define player's grid boundaries**
-        player_grid_x_start = GRID_ORIGIN[0]
-        player_grid_x_end = player_grid_x_start + GRID_SIZE * CELL_SIZE
-        player_grid_y_start = GRID_ORIGIN[1]
-        player_grid_y_end = player_grid_y_start + GRID_SIZE * CELL_SIZE
-
         # **Define ship selection area boundary**
         ship_selection_x_end = 150  # Ship selection area starts at x=50 and width=100
 
-        if enemy_grid_x_start <= x < enemy_grid_x_end and enemy_grid_y_start <= y < enemy_grid_y_end:
+        if self.enemy_view.rect.collidepoint(pos):
             # **Clicked on the enemy grid**
-            if not self.all_ships_placed():
-                self.message_log.add_message("Place all your ships first.")
-                return
-            if not self.game_started:
-                self.message_log.add_message("Waiting for both players to be ready.")
+            if self.pending_attack:
+                self.message_log.add_message("Waiting for the result of your attack.")
                 return
-            if not self.my_turn:
-                self.message_log.add_message("It's not your turn.")
-                return
-            grid_x = (x - enemy_grid_x_start) // CELL_SIZE
-            grid_y = (y - enemy_grid_y_start) // CELL_SIZE
-            if 0 <= grid_x < GRID_SIZE and 0 <= grid_y < GRID_SIZE:
-                if self.enemy_grid[grid_y][grid_x] == 0:
-                    self.send_attack(grid_x, grid_y)
-                    # Turn will switch after handling the result
-                else:
-                    self.message_log.add_message("You have already attacked this cell.")
+            grid_x, grid_y = self.enemy_view.cell_at(pos)
+            error = self.rules.attack_error(grid_x, grid_y)
+            if error:
+                self.message_log.add_message(error)
             else:
-                self.message_log.add_message("Click within the grid area.")
+                self.send_attack(grid_x, grid_y)
+                # Turn will switch after handling the result
         elif x < ship_selection_x_end:
             # Clicked on the left side (ship selection area)
             y_offset = 50
-            for ship in self.available_ships:
+            for ship in self.listed_ships():
                 ship_rect = pygame.Rect(50, y_offset, 100, 30)
                 if ship_rect.collidepoint(pos):
                     self.selected_ship = ship
@@ -284,11 +436,8 @@ class Game:
                     self.update_hovered_cells()
                     break
                 y_offset += 40
-        elif player_grid_x_start <= x < player_grid_x_end and player_grid_y_start <= y < player_grid_y_end:
+        elif self.own_view.rect.collidepoint(pos):
             # Clicked on the player's grid
-            grid_x = (x - GRID_ORIGIN[0]) // CELL_SIZE
-            grid_y = (y - GRID_ORIGIN[1]) // CELL_SIZE
-
             if not self.all_ships_placed():
                 # Ship placement phase
                 if self.selected_ship:
@@ -302,13 +451,7 @@ class Game:
                         self.valid_placement = False
                         # Notify when all ships are placed
                         if self.all_ships_placed():
-                            self.my_ships_ready = True
-                            self.message_log.add_message("All ships placed. Waiting for opponent.")
-                            if not self.local_test:
-                                self.send_message_to_server("ALL_SHIPS_PLACED")
-                            if self.opponent_ready:
-                                self.game_started = True
-                                self.message_log.add_message("Both players are ready. Game starts now!")
+                            self.fleet_ready()
                     else:
                         self.message_log.add_message("Cannot place ship here.")
                 else:
@@ -320,8 +463,53 @@ class Game:
             # Clicked elsewhere
             self.message_log.add_message("Click within the grid area or select a ship.")
 
+    def fleet_ready(self):
+        # Our last ship is placed: tell the opponent (and the server) we are ready
+        started = self.rules.ships_ready()
+        self.message_log.add_message("All ships placed. Waiting for opponent.")
+        if self.local_test:
+            pass
+        elif self.room_mode == ROOM_MODE_AUTHORITATIVE:
+            self.commit_board()
+        else:
+            self.send_message_to_server(self.codec.encode_all_ships_placed())
+        if started:
+            self.message_log.add_message("Both players are ready. Game starts now!")
+
+    def auto_place(self):
+        # Places every ship not placed yet at random, around the ones already placed
+        if self.rules.game_over or self.all_ships_placed():
+            return
+        remaining = {ship: self.fleet[ship] for ship in self.available_ships}
+        try:
+            layout = random_fleet(random.Random(), self.rules.size, remaining, occupied=self.rules.board.occupied)
+        except ValueError:
+            self.message_log.add_message("No room left for the other ships; place them by hand.")
+            return
+        chosen_orientation = self.ship_orientation
+        for ship, (x, y, orientation) in layout.items():
+            # place_ship() places the selected ship on the hovered cells
+            self.selected_ship = ship
+            self.ship_orientation = orientation
+            self.hovered_cells = [(x + i, y) if orientation == 'horizontal' else (x, y + i)
+                                  for i in range(self.fleet[ship])]
+            self.place_ship()
+            self.available_ships.remove(ship)
+        self.ship_orientation = chosen_orientation
+        self.selected_ship = None
+        self.hovered_cells = []
+        self.valid_placement = False
+        self.message_log.add_message(f"Placed {len(layout)} ships at random.")
+        self.fleet_ready()
+
+    def commit_board(self):
+        # Hands our fleet to the server, then tells the opponent we are ready.
+        # Same write, so the server has the board before the opponent can attack it.
+        ships = dict(self.rules.board.positions)
+        self.network_client.send_messages([encode_board(ships), b"MESSAGE " + self.codec.encode_all_ships_placed()])
+
     def all_ships_placed(self):
-        return len(self.placed_ships) == len(SHIP_SIZES)
+        return self.rules.all_ships_placed()
 
     def update_hovered_cells(self):
         # Reset the hovered cells and valid placement flag
@@ -331,38 +519,30 @@ class Game:
         if not self.selected_ship:
             return  # No ship selected, nothing to update
 
-        x, y = self.mouse_pos
-
         # Only update if mouse is over player's grid
-        player_grid_x_start = GRID_ORIGIN[0]
-        player_grid_x_end = player_grid_x_start + GRID_SIZE * CELL_SIZE
-        player_grid_y_start = GRID_ORIGIN[1]
-        player_grid_y_end = player_grid_y_start + GRID_SIZE * CELL_SIZE
-
-        if not (player_grid_x_start <= x < player_grid_x_end and player_grid_y_start <= y < player_grid_y_end):
+        cell = self.own_view.cell_at(self.mouse_pos)
+        if cell is None:
             return  # Mouse not over player's grid
+        grid_x, grid_y = cell
 
-        grid_x = (x - GRID_ORIGIN[0]) // CELL_SIZE
-        grid_y = (y - GRID_ORIGIN[1]) // CELL_SIZE
-
-        ship_length = SHIP_SIZES[self.selected_ship]
+        ship_length = self.fleet[self.selected_ship]
+        size = self.rules.size
         cells = []
 
         if self.ship_orientation == 'horizontal':
-            if grid_x < 0 or grid_x + ship_length > GRID_SIZE or grid_y < 0 or grid_y >= GRID_SIZE:
+            if grid_x < 0 or grid_x + ship_length > size or grid_y < 0 or grid_y >= size:
                 return  # Out of bounds
             for i in range(ship_length):
                 cells.append((grid_x + i, grid_y))
         else:  # Vertical orientation
-            if grid_y < 0 or grid_y + ship_length > GRID_SIZE or grid_x < 0 or grid_x >= GRID_SIZE:
+            if grid_y < 0 or grid_y + ship_length > size or grid_x < 0 or grid_x >= size:
                 return  # Out of bounds
             for i in range(ship_length):
                 cells.append((grid_x, grid_y + i))
 
-        # Check for overlaps
-        for col, row in cells:
-            if self.grid[row][col] != 0:
-                return  # Overlaps with existing ship
+        # Check for overlaps; the bitboard check is the same however big the board
+        if not self.rules.can_place(self.selected_ship, grid_x, grid_y, self.ship_orientation):
+            return  # Overlaps with existing ship
 
         # If we reach here, placement is valid
         self.hovered_cells = cells
@@ -371,14 +551,11 @@ class Game:
 
     def handle_mouse_motion(self, pos):
         self.mouse_pos = pos
-        x, y = pos
+        if self.drag:
+            view, (start_x, start_y), left, top = self.drag
+            view.scroll_to(left - (pos[0] - start_x) // view.cell_size, top - (pos[1] - start_y) // view.cell_size)
         # **Only update hover if mouse is over player's grid**
-        player_grid_x_start = GRID_ORIGIN[0]
-        player_grid_x_end = player_grid_x_start + GRID_SIZE * CELL_SIZE
-        player_grid_y_start = GRID_ORIGIN[1]
-        player_grid_y_end = player_grid_y_start + GRID_SIZE * CELL_SIZE
-
-        if player_grid_x_start <= x < player_grid_x_end and player_grid_y_start <= y < player_grid_y_end:
+        if self.own_view.rect.collidepoint(pos):
             self.update_hovered_cells()
         else:
             self.hovered_cells = []
@@ -392,10 +569,36 @@ class Game:
             self.ship_orientation = 'horizontal'
         self.update_hovered_cells()
 
+    def view_at(self, pos):
+        # The board view under a screen position, or None
+        for view in (self.own_view, self.enemy_view):
+            if view.rect.collidepoint(pos):
+                return view
+        return None
+
+    def zoom(self, steps, pos):
+        view = self.view_at(pos)
+        if view:
+            view.zoom(steps, pos)
+            self.update_hovered_cells()
+
+    def pan(self, dx, dy):
+        # Arrow keys move the view under the mouse by a quarter of what it shows
+        view = self.view_at(self.mouse_pos)
+        if view:
+            step = max(1, view.rect.width // view.cell_size // 4)
+            view.pan(dx * step, dy * step)
+            self.update_hovered_cells()
+
+    def start_drag(self, pos):
+        view = self.view_at(pos)
+        self.drag = (view, pos, view.left, view.top) if view else None
+
     def place_ship(self):
-        ship_length = SHIP_SIZES[self.selected_ship]
+        ship_length = self.fleet[self.selected_ship]
+        col, row = self.hovered_cells[0]
+        self.rules.place(self.selected_ship, col, row, self.ship_orientation)
         for index, (col, row) in enumerate(self.hovered_cells):
-            self.grid[row][col] = 1
             # Store the ship details at this cell
             self.ship_cells[(row, col)] = {
                 'ship_name': self.selected_ship,
@@ -408,98 +611,72 @@ class Game:
             'cells': self.hovered_cells.copy(),
             'orientation': self.ship_orientation
         }
+        for col, row in self.hovered_cells:
+            self.own_view.mark(col, row)
 
     def draw_grid(self, surface):
-        global matrix
-        matrix = [[column for column in range(GRID_SIZE)] for row in range(GRID_SIZE)]
-        for row in range(GRID_SIZE):
-            for col in range(GRID_SIZE):
-                rect = pygame.Rect(
-                    GRID_ORIGIN[0] + col * CELL_SIZE,
-                    GRID_ORIGIN[1] + row * CELL_SIZE,
-                    CELL_SIZE,
-                    CELL_SIZE
-                )
-                matrix[row][col] = rect
-                # Draw the water tile first
-                surface.blit(tileimg, rect.topleft)
-                # Check if this cell is in hovered_cells
-                if (col, row) in self.hovered_cells:
-                    if self.valid_placement:
-                        color = (0, 255, 0, 100)  # Semi-transparent green
-                    else:
-                        color = (255, 0, 0, 100)  # Semi-transparent red
+        # Only cells marked as changed are redrawn; the hovered ship goes on top each frame
+        self.own_view.render(surface)
+        if self.hovered_cells:
+            if self.valid_placement:
+                color = (0, 255, 0, 100)  # Semi-transparent green
+            else:
+                color = (255, 0, 0, 100)  # Semi-transparent red
+            for col, row in self.hovered_cells:
+                rect = self.own_view.cell_rect(col, row)
+                if rect:
                     # Create a semi-transparent surface
-                    highlight_surface = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
+                    highlight_surface = pygame.Surface(rect.size, pygame.SRCALPHA)
                     highlight_surface.fill(color)
                     surface.blit(highlight_surface, rect.topleft)
-                elif self.grid[row][col] == 1 or self.grid[row][col] == 2:
-                    # Render the ship if ship_info exists
-                    ship_info = self.ship_cells.get((row, col), None)
-                    if ship_info:
-                        ship_length = ship_info['length']
-                        part_index = ship_info['part_index']
-                        orientation = ship_info['orientation']
-
-                        if orientation == 'horizontal':
-                            if part_index == 1:
-                                # Front (left end)
-                                surface.blit(boatbutt, rect.topleft)
-                            elif part_index == ship_length:
-                                # Back (right end)
-                                flipboatendx = pygame.transform.flip(boatbutt, True, False)
-                                surface.blit(flipboatendx, rect.topleft)
-                            else:
-                                # Middle parts
-                                surface.blit(boatmid, rect.topleft)
-                        else:  # Vertical orientation
-                            # Define rotateboatend once for use in all cases
-                            rotateboatend = pygame.transform.rotate(boatbutt, 270)
-                            
-                            if part_index == 1:
-                                # Front (top end)
-                                surface.blit(rotateboatend, rect.topleft)
-                            elif part_index == ship_length:
-                                # Back (bottom end)
-                                flipboatenddown = pygame.transform.flip(rotateboatend, False, True)
-                                surface.blit(flipboatenddown, rect.topleft)
-                            else:
-                                # Middle parts
-                                rotateboatmid = pygame.transform.rotate(boatmid, 90)
-                                surface.blit(rotateboatmid, rect.topleft)
-
-                    else:
-                        # Cell was removed; optionally, you can render a different image or leave it as water
-                        pass
-                    # If the cell is hit, overlay a hit marker
-                    if self.grid[row][col] == 2:
-                        pygame.draw.rect(surface, RED, rect)
-                elif self.grid[row][col] == 3:
-                    # Miss marker
-                    #pygame.draw.rect(surface, WHITE, rect)
-                    surface.blit(darktileimg, rect)
-
-                # Draw grid lines last to ensure they are visible
-                pygame.draw.rect(surface, BLACK, rect, 1)
-
 
+    def draw_own_cell(self, surface, col, row, rect):
+        images = cell_images(rect.width)
+        # Draw the water tile first
+        surface.blit(images['tile'], rect.topleft)
+        state = self.rules.board.cell(col, row)
+        if state == SHIP or state == HIT:
+            # Render the ship if ship_info exists; hit cells were removed from ship_cells
+            ship_info = self.ship_cells.get((row, col), None)
+            if ship_info:
+                surface.blit(images[ship_part(ship_info)], rect.topleft)
+            # If the cell is hit, overlay a hit marker
+            if state == HIT:
+                pygame.draw.rect(surface, RED, rect)
+        elif state == MISS:
+            # Miss marker
+            surface.blit(images['dark'], rect)
+        if rect.width >= GRID_LINE_MIN_CELL:
+            # Draw grid lines last to ensure they are visible
+            pygame.draw.rect(surface, BLACK, rect, 1)
+
+    def listed_ships(self):
+        # The ships named in the list on the left; a big fleet is listed a few at a time
+        if len(self.available_ships) <= SHIP_LIST_ROWS:
+            return self.available_ships
+        return self.available_ships[:SHIP_LIST_ROWS - 1]
 
     #whole function deals only with ship text to the side of the grid
     def draw_ships(self, surface):
         # Display the list of available ships on the left
         # !!! DISPLAY SCORE BELOW SHIP LIST !!!
         y_offset = 50
-        for ship in self.available_ships:
+        listed = self.listed_ships()
+        for ship in listed:
             text_surface = self.small_font.render(ship, True, BLACK)
             text_rect = text_surface.get_rect(topleft=(50, y_offset))
             ship_rect = text_surface.get_rect()
             ship_rect.topleft = (50, y_offset)
             surface.blit(text_surface, text_rect)
             y_offset += 40
+        if len(listed) < len(self.available_ships):
+            more_text = self.small_font.render(f"+{len(self.available_ships) - len(listed)} more", True, BLACK)
+            surface.blit(more_text, (50, y_offset))
+            y_offset += 40
 
         # Highlight the selected ship TEXT FROM THE MENU
-        if self.selected_ship:
-            index = self.available_ships.index(self.selected_ship)
+        if self.selected_ship in listed:
+            index = listed.index(self.selected_ship)
             highlight_rect = pygame.Rect(45, 50 + index * 40, 110, 30)
             pygame.draw.rect(surface, RED, highlight_rect, 2)
 
@@ -507,73 +684,82 @@ class Game:
         y_offset += 20  # Add some space before the scores
 
         # Base Score
-        base_score = self.base_points()
+        base_score = self.rules.base_points()
         base_score_text = self.small_font.render(f"Base Score: {base_score}", True, BLACK)
         base_score_rect = base_score_text.get_rect(topleft=(50, y_offset))
         surface.blit(base_score_text, base_score_rect)
         y_offset += 30
 
         # Accuracy
-        accuracy = self.hit_accuracy_percent()
+        accuracy = self.rules.hit_accuracy_percent()
         accuracy_text = self.small_font.render(f"Accuracy: {accuracy}%", True, BLACK)
         accuracy_rect = accuracy_text.get_rect(topleft=(50, y_offset))
         surface.blit(accuracy_text, accuracy_rect)
         y_offset += 30
 
         # Total Score
-        total_score = self.total_points()
+        total_score = self.rules.total_points()
         total_score_text = self.small_font.render(f"Total Score: {total_score}", True, BLACK)
         total_score_rect = total_score_text.get_rect(topleft=(50, y_offset))
         surface.blit(total_score_text, total_score_rect)
 
     def draw_enemy_grid(self, surface):
         # Draw the enemy grid (left side)
-        offset_x = GRID_ORIGIN[0] - GRID_SIZE * CELL_SIZE - 50
-        for row in range(GRID_SIZE):
-            for col in range(GRID_SIZE):
-                rect = pygame.Rect(
-                    offset_x + col * CELL_SIZE,
-                    GRID_ORIGIN[1] + row * CELL_SIZE,
-                    CELL_SIZE,
-                    CELL_SIZE
-                )
-                # Draw the water tile first
-                surface.blit(tileimg, rect.topleft)
-
-                # Draw hit/miss indicators
-                if self.enemy_grid[row][col] == 2:
-                    # Hit marker
-                    pygame.draw.rect(surface, RED, rect)
-                elif self.enemy_grid[row][col] == 3:
-                    # Miss marker
-                    #pygame.draw.rect(surface, WHITE, rect)
-                    surface.blit(darktileimg, rect)
-
-                # Draw grid lines last to ensure they are visible
-                pygame.draw.rect(surface, BLACK, rect, 1)
-
+        self.enemy_view.render(surface)
         # Label the enemy grid
+        rect = self.enemy_view.rect
         label_text = self.small_font.render("Enemy Grid", True, BLACK)
-        surface.blit(label_text, (offset_x + GRID_SIZE * CELL_SIZE // 2 - label_text.get_width() // 2, GRID_ORIGIN[1] - 30))
-
-
-
-        # Label the enemy grid
-        label_text = self.small_font.render("Enemy Grid", True, BLACK)
-        surface.blit(label_text, (offset_x + GRID_SIZE * CELL_SIZE // 2 - label_text.get_width() // 2, GRID_ORIGIN[1] - 30))
+        surface.blit(label_text, (rect.centerx - label_text.get_width() // 2, rect.y - 30))
+
+    def draw_enemy_cell(self, surface, col, row, rect):
+        images = cell_images(rect.width)
+        # Draw the water tile first
+        surface.blit(images['tile'], rect.topleft)
+        # Draw hit/miss indicators
+        state = self.rules.enemy_grid[row][col]
+        if state == HIT:
+            # Hit marker
+            pygame.draw.rect(surface, RED, rect)
+        elif state == MISS:
+            # Miss marker
+            surface.blit(images['dark'], rect)
+        elif state == PENDING:
+            # Pending marker: our shot, result not back yet
+            pygame.draw.circle(surface, YELLOW, rect.center, max(1, rect.width // 4))
+        if rect.width >= GRID_LINE_MIN_CELL:
+            # Draw grid lines last to ensure they are visible
+            pygame.draw.rect(surface, BLACK, rect, 1)
 
     def draw_status(self, surface):
         # Display whose turn it is and game status
-        if self.game_over:
-            status_text = f"Game Over! Winner: {self.winner}"
-        elif not self.game_started:
+        if self.rules.game_over:
+            status_text = f"Game Over! Winner: {self.rules.winner}"
+        elif self.resuming:
+            status_text = "Reconnecting to the server..."
+        elif not self.rules.game_started:
             status_text = "Waiting for both players to be ready..."
-        elif self.my_turn:
+        elif self.pending_attack:
+            status_text = "Attack sent - waiting for the result."
+        elif self.rules.my_turn:
             status_text = "Your turn - Click on the enemy grid to attack."
         else:
             status_text = "Opponent's turn - Please wait."
         text_surface = self.small_font.render(status_text, True, BLACK)
         surface.blit(text_surface, (WINDOW_WIDTH // 2 - text_surface.get_width() // 2, 10))
+        if not self.local_test and self.network_client:
+            self.draw_latency(surface)
+
+    def draw_latency(self, surface):
+        # e.g. "RTT 23.4 ms  jitter 1.8 ms  last move 41.0 ms"; re-rendered only when it changes
+        srtt, rttvar = self.network_client.srtt, self.network_client.rttvar
+        if srtt is None:
+            return
+        text = f"RTT {srtt * 1000:.1f} ms  jitter {rttvar * 1000:.1f} ms"
+        if self.last_move_latency is not None:
+            text += f"  last move {self.last_move_latency * 1000:.1f} ms"
+        if self.latency_label is None or self.latency_label[0] != text:
+            self.latency_label = (text, self.small_font.render(text, True, BLACK))
+        surface.blit(self.latency_label[1], (50, WINDOW_HEIGHT - 40))
 
     def draw(self, surface):
         # Draw the grid, ships, enemy grid, etc.
@@ -584,15 +770,17 @@ class Game:
         self.message_log.draw(surface)
 
     def run(self):
+        clock = pygame.time.Clock()
         if self.is_host:
+            self.message_log.add_message("Waiting for a player to join...")
             while not self.client_joined and self.running:
-                self.message_log.add_message("Waiting for a player to join...")
-                pygame.time.delay(1000)
+                clock.tick(30)
+                self.handle_server_messages()
                 for event in pygame.event.get():
                     if event.type == pygame.QUIT:
                         self.running = False
                         if self.conn:
-                            self.conn.close()
+                            self.network_client.close_connection()
                         pygame.quit()
                         sys.exit()
         while self.running:
@@ -603,26 +791,40 @@ class Game:
             # **Moved update_hovered_cells() call to handle_mouse_motion**
             # self.update_hovered_cells()
 
+            self.handle_server_messages()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
                     if self.conn:
-                        self.conn.close()
+                        self.network_client.close_connection()
                     pygame.quit()
                     sys.exit()
                 elif event.type == pygame.MOUSEMOTION:
                     self.handle_mouse_motion(event.pos)
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     if event.button == 4 or event.button == 5: # Mouse Wheel
-                        self.rotate_ship()
-                        self.update_hovered_cells()
+                        if pygame.key.get_mods() & pygame.KMOD_CTRL:
+                            self.zoom(1 if event.button == 4 else -1, event.pos)
+                        else:
+                            self.rotate_ship()
+                            self.update_hovered_cells()
                     elif event.button == 1:
                         self.handle_click(event.pos)
+                    elif event.button == 3:
+                        self.start_drag(event.pos)
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    if event.button == 3:
+                        self.drag = None
+                elif event.type == pygame.KEYDOWN:
+                    if event.key in ZOOM_KEYS:
+                        self.zoom(ZOOM_KEYS[event.key], self.mouse_pos)
+                    elif event.key in PAN_KEYS:
+                        self.pan(*PAN_KEYS[event.key])
+                    elif event.key == AUTO_PLACE_KEY:
+                        self.auto_place()
 
             self.draw(self.window)
             #self.update_hovered_cells()
             pygame.display.flip()
-
-        # Clean up connection after game ends
-        if self.conn:
-            self.conn.close()
\ No newline at end of file
+            clock.tick(60)
+        # The connection outlives the game; the caller leaves the room on it
\ No newline at end of file
@@ -0,0 +1,142 @@
+# grid_view.py
+#
+# A camera onto one board: a fixed window on screen showing the cells from (left, top)
+# onwards at cell_size pixels per cell. The visible cells are drawn into a surface that
+# is kept from frame to frame, so a frame redraws only the cells marked as changed and
+# then blits that surface. Panning scrolls the surface and draws just the rows and
+# columns that came into view; only zooming redraws every visible cell. A 100x100
+# board costs about the same per frame as the classic 10x10.
+
+import pygame
+
+ZOOM_STEP = 1.25  # Cell size ratio between zoom levels
+CLEAR = (0, 0, 0, 0)
+
+class GridView:
+    def __init__(self, rect, size, draw_cell, max_cell_size):
+        self.rect = pygame.Rect(rect)
+        self.size = size
+        self.draw_cell = draw_cell  # draw_cell(surface, x, y, rect) paints one cell into rect
+        # Fully zoomed out the whole board is in view
+        self.max_cell_size = max_cell_size
+        self.min_cell_size = max(2, min(max_cell_size, min(self.rect.size) // size))
+        self.cell_size = self.min_cell_size
+        self.left = 0
+        self.top = 0
+        self.surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        self.dirty = set()  # Visible cells to redraw on the next render()
+        self.stale = True  # Every visible cell needs redrawing
+
+    def columns(self):
+        # Cells in view across, counting a partly visible one
+        return min(self.size - self.left, -(-self.rect.width // self.cell_size))
+
+    def rows(self):
+        return min(self.size - self.top, -(-self.rect.height // self.cell_size))
+
+    def visible(self, x, y):
+        return self.left <= x < self.left + self.columns() and self.top <= y < self.top + self.rows()
+
+    def mark(self, x, y):
+        # Cell (x, y) changed; it is redrawn on the next render() if in view
+        if not self.stale and self.visible(x, y):
+            self.dirty.add((x, y))
+
+    def mark_all(self):
+        self.stale = True
+        self.dirty.clear()
+
+    def cell_at(self, pos):
+        # Cell under a screen position, or None outside the view. Near the far edge of
+        # a board smaller than the view the cell can lie off the board.
+        if not self.rect.collidepoint(pos):
+            return None
+        return (self.left + (pos[0] - self.rect.x) // self.cell_size,
+                self.top + (pos[1] - self.rect.y) // self.cell_size)
+
+    def cell_rect(self, x, y):
+        # Screen rect of a cell, clipped to the view; empty when the cell is out of view
+        cell_size = self.cell_size
+        return pygame.Rect(self.rect.x + (x - self.left) * cell_size, self.rect.y + (y - self.top) * cell_size,
+                           cell_size, cell_size).clip(self.rect)
+
+    def clamp(self, left, top):
+        # Keeps the view on the board once the board is bigger than the view
+        max_left = max(0, self.size - self.rect.width // self.cell_size)
+        max_top = max(0, self.size - self.rect.height // self.cell_size)
+        return min(max(left, 0), max_left), min(max(top, 0), max_top)
+
+    def scroll_to(self, left, top):
+        left, top = self.clamp(left, top)
+        dx, dy = left - self.left, top - self.top
+        if not dx and not dy:
+            return
+        columns, rows = self.columns(), self.rows()
+        self.left, self.top = left, top
+        if self.stale or abs(dx) >= columns or abs(dy) >= rows:
+            self.mark_all()
+            return
+        self.surface.scroll(-dx * self.cell_size, -dy * self.cell_size)
+        self.clear_beyond_board()
+        # The rows and columns the scroll uncovered, plus the one that was only partly
+        # visible before, which scrolled in with its hidden part missing
+        columns, rows = self.columns(), self.rows()
+        if dx > 0:
+            xs = range(max(self.left, self.left + columns - dx - 1), self.left + columns)
+        else:
+            xs = range(self.left, self.left - dx)
+        if dy > 0:
+            ys = range(max(self.top, self.top + rows - dy - 1), self.top + rows)
+        else:
+            ys = range(self.top, self.top - dy)
+        all_xs = range(self.left, self.left + columns)
+        all_ys = range(self.top, self.top + rows)
+        self.dirty.update((x, y) for x in xs for y in all_ys)
+        self.dirty.update((x, y) for x in all_xs for y in ys)
+
+    def pan(self, dx, dy):
+        self.scroll_to(self.left + dx, self.top + dy)
+
+    def zoom(self, steps, pos=None):
+        # steps > 0 zooms in. The cell under pos (the centre by default) stays put.
+        cell_size = self.cell_size
+        for _ in range(abs(steps)):
+            if steps > 0:
+                cell_size = max(cell_size + 1, round(cell_size * ZOOM_STEP))
+            else:
+                cell_size = min(cell_size - 1, round(cell_size / ZOOM_STEP))
+        cell_size = min(max(cell_size, self.min_cell_size), self.max_cell_size)
+        if cell_size == self.cell_size:
+            return
+        px, py = pos if pos is not None and self.rect.collidepoint(pos) else self.rect.center
+        px, py = px - self.rect.x, py - self.rect.y
+        focus_x = self.left + px / self.cell_size
+        focus_y = self.top + py / self.cell_size
+        self.cell_size = cell_size
+        self.left, self.top = self.clamp(round(focus_x - px / cell_size), round(focus_y - py / cell_size))
+        self.mark_all()
+
+    def clear_beyond_board(self):
+        # Where the board ends inside the view nothing is drawn
+        width = (self.size - self.left) * self.cell_size
+        height = (self.size - self.top) * self.cell_size
+        if width < self.rect.width:
+            self.surface.fill(CLEAR, (width, 0, self.rect.width - width, self.rect.height))
+        if height < self.rect.height:
+            self.surface.fill(CLEAR, (0, height, self.rect.width, self.rect.height - height))
+
+    def render(self, target):
+        if self.stale:
+            self.surface.fill(CLEAR)
+            cells = [(x, y) for y in range(self.top, self.top + self.rows())
+                     for x in range(self.left, self.left + self.columns())]
+            self.stale = False
+        else:
+            cells = self.dirty
+        cell_size = self.cell_size
+        for x, y in cells:
+            rect = pygame.Rect((x - self.left) * cell_size, (y - self.top) * cell_size, cell_size, cell_size)
+            self.surface.fill(CLEAR, rect)
+            self.draw_cell(self.surface, x, y, rect)
+        self.dirty = set()
+        target.blit(self.surface, self.rect)
@@ -0,0 +1,228 @@
+# loadtest.py
+#
+# Headless load generator for server.py. Opens N simulated host/client pairs that
+# play complete games with the real protocol (CREATE_ROOM, JOIN_ROOM,
+# ALL_SHIPS_PLACED, alternating ATTACK/RESULT, GAME_OVER) and reports
+# connections/sec, moves/sec and attack latency percentiles.
+#   python loadtest.py --pairs 500 --seed 1 [--wire binary] [--room-mode authoritative] [--quick-match]
+#                      [--size 100 --fleet Carrier:5*10,Destroyer:2*40]
+# With --quick-match the bots pair up through QUICK_MATCH instead of named rooms.
+# Boards and firing order come from --seed, so two runs play identical games.
+
+import argparse
+import asyncio
+import random
+import time
+from bitboard import Board, random_fleet
+from constants import GRID_SIZE, SHIP_SIZES
+from protocol import (ROOM_MODE_AUTHORITATIVE, ROOM_MODES, WIRE_FORMATS, WIRE_TEXT, FrameDecoder,
+                      encode_board, encode_frame, encode_rules, decode_game_message, make_codec, parse_options, room_rules)
+
+class Bot:
+    def __init__(self, rng, is_host, stats, size=GRID_SIZE, ship_sizes=SHIP_SIZES):
+        self.rng = rng
+        self.is_host = is_host
+        self.stats = stats
+        self.rules = encode_rules(size, ship_sizes)
+        self.ship_names = list(ship_sizes.keys())
+        self.fleet = random_fleet(rng, size, ship_sizes)
+        self.board = Board(size, ship_sizes)
+        for ship, (x, y, orientation) in self.fleet.items():
+            self.board.place(ship, x, y, orientation)
+        self.targets = [(x, y) for y in range(size) for x in range(size)]
+        rng.shuffle(self.targets)
+        self.codec = make_codec(WIRE_TEXT, self.ship_names)
+        self.decoder = FrameDecoder()
+        self.frames = []
+        self.reader = None
+        self.writer = None
+        self.attack_sent_at = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.stats['connections'] += 1
+
+    def send(self, *messages):
+        self.writer.write(b''.join(encode_frame(message) for message in messages))
+
+    async def next_frame(self):
+        while not self.frames:
+            data = await self.reader.read(4096)
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            for frame in self.decoder.feed(data):
+                if frame.startswith(b"PING"):
+                    self.send(b"PONG" + frame[4:])
+                else:
+                    self.frames.append(frame)
+        return self.frames.pop(0)
+
+    async def expect(self, command):
+        frame = await self.next_frame()
+        if not frame.startswith(command.encode()):
+            raise ConnectionError(f"Expected {command}, got {frame[:60]!r}")
+        return frame.decode()
+
+    async def quick_match(self, wire, room_mode):
+        # Whoever is queued first hosts, so the bot learns its role from the reply.
+        # Returns the room mode.
+        self.send(f"QUICK_MATCH wire={wire} mode={room_mode} {self.rules}")
+        command, *params = (await self.next_frame()).decode().split(' ')
+        _, options = parse_options(params)
+        self.is_host = command == 'MATCH_WAITING'
+        if self.is_host:
+            _, joined = parse_options((await self.expect("CLIENT_JOINED")).split(' ')[1:])
+            wire_format = joined.get('wire', WIRE_TEXT)
+        elif command == 'JOINED_ROOM':
+            wire_format = options.get('wire', WIRE_TEXT)
+        else:
+            raise ConnectionError(f"Quick match failed: {' '.join([command] + params)}")
+        self.codec = make_codec(wire_format, self.ship_names)
+        return options.get('mode', 'relay')
+
+    def fire(self, room_mode):
+        grid_x, grid_y = self.targets.pop()
+        self.attack_sent_at = time.perf_counter()
+        if room_mode == ROOM_MODE_AUTHORITATIVE:
+            self.send(f"ATTACK {grid_x} {grid_y}")
+        else:
+            self.send(b"MESSAGE " + self.codec.encode_attack(grid_x, grid_y))
+
+    def record_result(self):
+        self.stats['latencies'].append(time.perf_counter() - self.attack_sent_at)
+        self.stats['moves'] += 1
+
+    def receive_attack(self, grid_x, grid_y):
+        # Relay rooms: the defender resolves the attack, exactly like Game.handle_attack
+        hit, sunk = self.board.attack(grid_x, grid_y)
+        messages = [b"MESSAGE " + self.codec.encode_result(grid_x, grid_y, hit, sunk)]
+        lost = self.board.all_sunk()
+        if lost:
+            messages.append(b"MESSAGE " + self.codec.encode_game_over('Opponent'))
+        self.send(*messages)
+        return lost
+
+    async def play(self, room_mode):
+        # Runs from both players ready until GAME_OVER
+        if room_mode == ROOM_MODE_AUTHORITATIVE:
+            self.send(encode_board(self.fleet), b"MESSAGE " + self.codec.encode_all_ships_placed())
+        else:
+            self.send(b"MESSAGE " + self.codec.encode_all_ships_placed())
+        my_turn = self.is_host
+        while True:
+            frame = await self.next_frame()
+            command, _, params = frame.partition(b' ')
+            if command in (b'MESSAGE_FROM_HOST', b'MESSAGE_FROM_CLIENT'):
+                message, args = decode_game_message(params, self.ship_names)
+                if message == 'ALL_SHIPS_PLACED':
+                    if my_turn:
+                        self.fire(room_mode)
+                elif message == 'ATTACK':
+                    if self.receive_attack(*args):
+                        return
+                    self.fire(room_mode)
+                elif message == 'RESULT':
+                    self.record_result()
+                elif message == 'GAME_OVER':
+                    return
+            elif command == b'ATTACK_RESULT':
+                self.record_result()
+            elif command == b'ATTACKED':
+                self.fire(room_mode)
+            elif command == b'GAME_OVER':
+                return
+            elif command == b'ERROR':
+                raise ConnectionError(frame.decode())
+
+async def run_pair(index, args, stats):
+    rng = random.Random(f"{args.seed}-{index}")
+    host, client = Bot(rng, True, stats, args.size, args.fleet), Bot(rng, False, stats, args.size, args.fleet)
+    room_name = f"load_{args.seed}_{index}"
+    try:
+        if args.quick_match:
+            await host.connect(args.host, args.port)
+            await client.connect(args.host, args.port)
+            # The two bots may well be matched with bots from other pairs; each plays on its own
+            room_modes = await asyncio.wait_for(asyncio.gather(host.quick_match(args.wire, args.room_mode),
+                                                               client.quick_match(args.wire, args.room_mode)),
+                                                args.timeout)
+            stats['connected_at'].append(time.perf_counter())
+            await asyncio.wait_for(asyncio.gather(host.play(room_modes[0]), client.play(room_modes[1])), args.timeout)
+            stats['games'] += 1
+            return
+
+        await host.connect(args.host, args.port)
+        host.send(f"CREATE_ROOM {room_name} wire={args.wire} mode={args.room_mode} {host.rules}")
+        _, options = parse_options((await host.expect("ROOM_CREATED")).split(' ')[1:])
+        room_mode = options.get('mode', 'relay')
+
+        await client.connect(args.host, args.port)
+        client.send(f"JOIN_ROOM {room_name} wire={args.wire}")
+        _, options = parse_options((await client.expect("JOINED_ROOM")).split(' ')[1:])
+        await host.expect("CLIENT_JOINED")
+        host.codec = client.codec = make_codec(options.get('wire', WIRE_TEXT), host.ship_names)
+        stats['connected_at'].append(time.perf_counter())
+
+        await asyncio.wait_for(asyncio.gather(host.play(room_mode), client.play(room_mode)), args.timeout)
+        stats['games'] += 1
+    except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+        stats['failures'] += 1
+        if stats['failures'] <= 5:
+            print(f"Pair {index} failed: {e!r}")
+    finally:
+        for bot in (host, client):
+            if bot.writer:
+                bot.writer.close()
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+async def run(args):
+    stats = {'connections': 0, 'games': 0, 'failures': 0, 'moves': 0, 'latencies': [], 'connected_at': []}
+    # Limits how many pairs connect at once so the listen backlog is not flooded
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def gated(index):
+        async with gate:
+            await run_pair(index, args, stats)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(gated(index) for index in range(args.pairs)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(stats['latencies'])
+    connect_span = (max(stats['connected_at']) - start) if stats['connected_at'] else elapsed
+    print(f"pairs        {args.pairs} (seed {args.seed}, wire {args.wire}, room mode {args.room_mode}, "
+          f"{args.size}x{args.size} board, {len(args.fleet)} ships)")
+    print(f"games        {stats['games']} completed, {stats['failures']} failed in {elapsed:.2f}s")
+    print(f"connections  {stats['connections']} ({stats['connections'] / connect_span:,.0f}/sec)")
+    print(f"moves        {stats['moves']} ({stats['moves'] / elapsed:,.0f}/sec)")
+    print("latency ms   " + '  '.join(f"p{int(fraction * 100)} {percentile(latencies, fraction) * 1000:.2f}"
+                                      for fraction in (0.5, 0.9, 0.99))
+          + f"  max {(latencies[-1] if latencies else 0) * 1000:.2f}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the Battleship relay server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--pairs', type=int, default=100, help="simultaneous host/client pairs")
+    parser.add_argument('--concurrency', type=int, default=1000, help="pairs in flight at once")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--wire', choices=WIRE_FORMATS, default=WIRE_TEXT)
+    parser.add_argument('--room-mode', choices=ROOM_MODES, default='relay')
+    parser.add_argument('--quick-match', action='store_true', help="pair bots with QUICK_MATCH")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds allowed per game")
+    parser.add_argument('--size', type=int, default=GRID_SIZE, help="board size of the rooms")
+    parser.add_argument('--fleet', help="fleet of the rooms, e.g. Carrier:5*10,Destroyer:2*40")
+    args = parser.parse_args()
+    try:
+        args.size, args.fleet = room_rules({'size': args.size, 'fleet': args.fleet} if args.fleet else {'size': args.size})
+    except ValueError as e:
+        parser.error(str(e))
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
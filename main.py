@@ -1,120 +1,488 @@
 # main.py
 
+import argparse
+import itertools
 import pygame
+import queue
+import selectors
 import sys
 import socket
 import threading
+import time
+from collections import deque
+from protocol import (HEADER, ROOM_MODE_AUTHORITATIVE, ROOM_MODE_RELAY, SESSION_COMMANDS, WIRE_BINARY, WIRE_TEXT,
+                      FrameDecoder, encode_frame, encode_rules, parse_options, room_rules)
 from constants import *
 from ui_elements import Button, drawTitle
 from menu import RoomSelectionMenu
 from game import Game
 
-# Initialize Pygame
-pygame.init()
-
-shipboardbackground = pygame.image.load("titlebackground.png")
-shipboardbackground = pygame.transform.scale(shipboardbackground, (WINDOW_WIDTH, WINDOW_HEIGHT))
-# Fonts (initialize after pygame.init())
-font = pygame.font.SysFont(None, 48)
-small_font = pygame.font.SysFont(None, 24)
-
-# Set up the display
-window = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption('Battleship')
+# Set by init_display() when the client starts, so importing this module opens no window
+shipboardbackground = None
+font = None
+small_font = None
+window = None
+create_room_button = None
+select_room_button = None
+quick_match_button = None
+test_game_button = None
 
 # Networking settings
 SERVER_HOST = '34.42.18.51'  # Replace with your server's IP address
 SERVER_PORT = 5555
+WIRE_FORMAT = WIRE_BINARY  # Gameplay message format we offer; the server falls back to text if the peer can't
+ROOM_MODE = ROOM_MODE_AUTHORITATIVE  # Rooms we create let the server resolve attacks
+LATENCY_LOG = None  # A path, e.g. 'latency.jsonl', appends one JSON line per move; also --latency-log
+# Rooms we create or quick match into are played on a BOARD_SIZE board with FLEET,
+# e.g. 100 and protocol.parse_fleet("Carrier:5*10,Battleship:4*10,Cruiser:3*10,Submarine:3*10,Destroyer:2*10")
+BOARD_SIZE = GRID_SIZE
+FLEET = SHIP_SIZES
 
 # Networking client class
+# All socket I/O happens on a background thread. The UI thread queues outgoing frames
+# with send_messages() and takes incoming ones with poll_frames() once per frame, so
+# a slow server never stalls a frame and game state is only touched by the UI thread.
+# One connection is kept for the whole session: the room list, creating or joining a
+# room, the game itself, and LEAVE_ROOM afterwards all share it. Lobby requests carry
+# id=<n>, which the server echoes, so several can be in flight at once.
+CONNECT_TIMEOUT = 5.0
+REPLY_TIMEOUT = 10.0  # How long send_command() waits for the server's answer
+RTT_PING_INTERVAL = 2.0  # Seconds between the client's own PINGs for round-trip measurement
+# If the connection drops mid-game, the client reconnects and sends RESUME for up to
+# RESUME_WINDOW seconds (the server holds the seat for 30 by default), one step per
+# frame so the window keeps drawing meanwhile
+RESUME_WINDOW = 30.0
+RESUME_RETRY_DELAY = 1.0
+SESSION_REPLIES = (b"ROOM_CREATED ", b"JOINED_ROOM ", b"MATCH_WAITING ")  # Replies that hand out session=
+
 class NetworkClient:
     def __init__(self):
         self.server_host = SERVER_HOST
         self.server_port = SERVER_PORT
         self.sock = None
+        self.decoder = FrameDecoder()
+        self.inbox = queue.SimpleQueue()  # Frames from the I/O thread; None means the connection is gone
+        self.outbox = deque()  # Encoded bytes waiting for the I/O thread to write them
+        self.disconnected = False
+        self.io_thread = None
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        # Neither end may block: wake() must not stall the UI thread if the pair fills
+        # up, and the I/O thread drains whatever is there
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.request_ids = itertools.count(1)
+        self.replies = {}  # Request id -> reply that arrived while waiting for another one
+        self.pending = deque()  # Other frames that arrived while waiting for a reply
+        # Round trip to the server in seconds, smoothed as TCP does (RFC 6298): srtt is
+        # the average and rttvar the mean deviation, i.e. jitter. None until measured.
+        self.srtt = None
+        self.rttvar = None
+        # Our seat in the current room: its token, and how many bytes the server has
+        # sent us since handing it out, which RESUME reports after a reconnect
+        self.session = None
+        self.received = 0
+        # Our moves (SESSION_COMMANDS frames) in the seat, as (offset just past the frame,
+        # frame), so the ones a dropped connection lost can be sent again after RESUMED
+        self.sent = 0
+        self.sent_log = deque()
+        self.resumer = None  # resume_steps() generator while a resume is under way
+
+    @property
+    def connected(self):
+        return self.sock is not None and not self.disconnected
+
+    def ensure_connected(self):
+        # Reuses the session's connection, reconnecting only if it was lost
+        if not self.connected:
+            self.connect_to_server()
+        return self.connected
 
     def connect_to_server(self):
+        self.close_connection()
+        self.attach(self.open_socket())
+
+    def open_socket(self):
+        # The blocking part of connecting; returns the socket or None
         print(f"Attempting to connect to server at {self.server_host}:{self.server_port}")
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.sock.connect((self.server_host, self.server_port))
+            sock = socket.create_connection((self.server_host, self.server_port), timeout=CONNECT_TIMEOUT)
             print("Connected to server.")
+            return sock
         except Exception as e:
             print(f"Failed to connect to server: {e}")
-            self.sock = None
+            return None
 
-    def send_command(self, command):
-        if self.sock:
-            try:
-                self.sock.sendall(command.encode())
-                response = self.sock.recv(1024).decode()
-                return response
-            except Exception as e:
-                print(f"Communication error: {e}")
-                return None
+    def attach(self, sock):
+        # Starts a fresh connection's state and I/O thread on sock (None if connecting failed)
+        self.decoder = FrameDecoder()
+        self.inbox = queue.SimpleQueue()
+        self.outbox.clear()
+        self.replies.clear()
+        self.pending.clear()
+        self.srtt = self.rttvar = None
+        self.disconnected = False
+        self.sock = sock
+        if sock is None:
+            return
+        # Like the server: small ATTACK/RESULT frames must not wait for a delayed ACK
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        self.io_thread = threading.Thread(target=self.io_loop, args=(sock, self.inbox), daemon=True)
+        self.io_thread.start()
+
+    def io_loop(self, sock, inbox):
+        # Reads and decodes frames into inbox, answers heartbeat PINGs, sends our own
+        # PINGs to measure the round trip and drains the outbox
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        unsent = b''
+        next_ping = time.monotonic()
+        try:
+            while sock is self.sock:
+                for key, events in selector.select(max(0.0, next_ping - time.monotonic())):
+                    if key.fileobj is self.wakeup_recv:
+                        try:
+                            self.wakeup_recv.recv(4096)
+                        except BlockingIOError:
+                            pass  # Drained already, e.g. by a previous connection's thread
+                    elif events & selectors.EVENT_READ:
+                        try:
+                            data = sock.recv(65536)
+                        except BlockingIOError:
+                            continue
+                        if not data:
+                            return
+                        for frame in self.decoder.feed(data):
+                            self.count_received(frame)
+                            if frame.startswith(b"PING"):
+                                self.outbox.append(encode_frame(b"PONG" + frame[4:]))
+                            elif frame.startswith(b"PONG "):
+                                self.record_rtt(frame)
+                            else:
+                                inbox.put(frame)
+                # Stamped just before the send below, so the sample is only the round trip
+                if time.monotonic() >= next_ping:
+                    self.outbox.append(encode_frame(f"PING {time.perf_counter_ns()}"))
+                    next_ping += RTT_PING_INTERVAL
+                while self.outbox:
+                    unsent += self.outbox.popleft()
+                if unsent:
+                    try:
+                        unsent = unsent[sock.send(unsent):]
+                    except BlockingIOError:
+                        pass
+                # Only wait for writability while something is left over
+                selector.modify(sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if unsent else 0))
+        except (OSError, ValueError) as e:
+            if sock is self.sock:
+                print(f"Server connection lost: {e}")
+        finally:
+            selector.close()
+            inbox.put(None)
+
+    def count_received(self, frame):
+        # Counts the bytes of the session the same way the server's replay buffer does
+        if frame.startswith(b"RESUMED "):
+            return  # Not part of the session; what we missed follows it
+        if frame.startswith(SESSION_REPLIES) and b" session=" in frame:
+            _, options = parse_options(frame.decode().split(' ')[1:])
+            self.session = options['session']
+            self.received = 0
+            self.sent = 0
+            self.sent_log.clear()
+            return
+        self.received += HEADER.size + len(frame)
+
+    def start_resume(self):
+        # Called when the connection drops mid-game. resume_step() then reconnects and
+        # takes our seat back with RESUME; the server replays whatever we had not
+        # received, and those frames come out of poll_frames() as usual.
+        self.resumer = self.resume_steps()
+
+    def resume_step(self):
+        # Advances the resume without blocking; call once per frame. Returns None while
+        # it is still under way, then True once resumed or False if the seat is gone.
+        try:
+            next(self.resumer)
+            return None
+        except StopIteration as done:
+            self.resumer = None
+            return done.value
+
+    def resume_steps(self):
+        # Yields wherever it would otherwise wait; only connect() itself, which can take
+        # CONNECT_TIMEOUT, runs on a short-lived thread of its own
+        token, received = self.session, self.received
+        deadline = time.monotonic() + RESUME_WINDOW
+        while token and time.monotonic() < deadline:
+            self.close_connection()
+            opened = []
+            opener = threading.Thread(target=lambda: opened.append(self.open_socket()), daemon=True)
+            opener.start()
+            while opener.is_alive():
+                yield
+            self.attach(opened[0] if opened else None)
+            if self.connected:
+                request_id = self.request(f"RESUME {token} received={received}")
+                reply_deadline = time.monotonic() + REPLY_TIMEOUT
+                response = self.poll_reply(request_id)
+                while response is None and not self.disconnected and time.monotonic() < reply_deadline:
+                    yield
+                    response = self.poll_reply(request_id)
+                if response and response.startswith("RESUMED"):
+                    print("Resumed the game.")
+                    self.resumer = None  # So resend_moves() sends our moves rather than holding them
+                    self.resend_moves(response)
+                    return True
+                if response:
+                    print(f"Could not resume: {response}")
+                    break
+            retry_at = time.monotonic() + RESUME_RETRY_DELAY
+            while time.monotonic() < retry_at:
+                yield
+        self.session = None
+        return False
+
+    def resend_moves(self, response):
+        # RESUMED ... received=<n>: the server has our moves up to byte n; the rest, lost
+        # with the old connection or queued while it was down, go out again
+        _, options = parse_options(response.split(' ')[1:])
+        received = int(options.get('received', self.sent))
+        while self.sent_log and self.sent_log[0][0] <= received:
+            self.sent_log.popleft()
+        if self.sent_log:
+            print(f"Sending {len(self.sent_log)} moves again.")
+            self.outbox.append(b''.join(frame for _, frame in self.sent_log))
+            self.wake()
+
+    def record_rtt(self, frame):
+        # frame is the server's answer to our PING: "PONG <perf_counter_ns when sent>"
+        try:
+            sample = (time.perf_counter_ns() - int(frame.split(b' ')[1])) / 1e9
+        except ValueError:
+            return
+        if self.srtt is None:
+            self.srtt, self.rttvar = sample, sample / 2
         else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+
+    def wake(self):
+        try:
+            self.wakeup_send.send(b'\0')
+        except BlockingIOError:
+            pass  # Already has a wakeup pending
+
+    def send_command(self, command):
+        # For the request/reply steps outside a game (create, join, list, leave)
+        if not self.sock:
             print("Not connected to server.")
             return None
+        return self.wait_reply(self.request(command))
+
+    def request(self, command):
+        # Sends a lobby command tagged with a fresh id and returns the id without waiting
+        request_id = str(next(self.request_ids))
+        self.send_messages([f"{command} id={request_id}"])
+        return request_id
+
+    def wait_reply(self, request_id, timeout=REPLY_TIMEOUT):
+        # Returns the reply to request(), without its id=, or None on disconnect or timeout.
+        # Waits with the window's event queue serviced. Replies to other requests are
+        # kept for their own wait_reply(); anything else goes to poll_frames().
+        deadline = time.monotonic() + timeout
+        while request_id not in self.replies:
+            if self.disconnected or time.monotonic() >= deadline:
+                return None
+            if not self.sort_frame(timeout=0.05) and pygame.display.get_init():
+                pygame.event.pump()  # Keeps the OS from flagging the window as hung
+        return self.replies.pop(request_id)
+
+    def poll_reply(self, request_id):
+        # Like wait_reply() without waiting: the reply if it has arrived, else None
+        while request_id not in self.replies and not self.disconnected and self.sort_frame(timeout=0):
+            pass
+        return self.replies.pop(request_id, None)
+
+    def sort_frame(self, timeout):
+        # Takes one frame from the I/O thread into replies or pending; False if none came
+        try:
+            frame = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        if frame is None:
+            self.disconnected = True
+            return False
+        message, _, tag = frame.rpartition(b' id=')
+        if message and not frame.startswith(b'MESSAGE_FROM_') and tag.isdigit():
+            self.replies[tag.decode()] = message.decode()
+        else:
+            self.pending.append(frame)
+        return True
+
+    def discard_pending(self):
+        # Drops frames set aside by wait_reply(), e.g. room list updates after UNSUBSCRIBE_ROOMS
+        self.pending.clear()
+
+    def leave_room(self):
+        # Ends the current game but keeps the connection for the next one
+        if self.connected:
+            self.send_command("LEAVE_ROOM")
+            self.discard_pending()
+        self.session = None
+        self.sent_log.clear()
+        self.resumer = None
+
+    def send_messages(self, messages):
+        # Pipelines several commands into one write; never blocks. In a seat our moves
+        # are logged too, even while the connection is down, for resend_moves(). While
+        # resuming they are only logged: the new connection has no seat until RESUMED.
+        frames = [encode_frame(message) for message in messages]
+        if self.session:
+            for frame in frames:
+                if frame.startswith(SESSION_COMMANDS, HEADER.size):
+                    self.sent += len(frame)
+                    self.sent_log.append((self.sent, frame))
+            if self.resumer:
+                frames = [frame for frame in frames if not frame.startswith(SESSION_COMMANDS, HEADER.size)]
+        if self.sock and frames:
+            self.outbox.append(b''.join(frames))
+            self.wake()
+
+    def poll_frames(self):
+        # Returns the frames that have arrived without waiting for more, or None on disconnect.
+        # Frames are raw bytes since gameplay messages may be binary.
+        frames = list(self.pending)
+        self.pending.clear()
+        while not self.disconnected:
+            try:
+                frame = self.inbox.get_nowait()
+            except queue.Empty:
+                return frames
+            if frame is None:
+                self.disconnected = True
+                break
+            frames.append(frame)
+        return frames or None
 
     def close_connection(self):
-        if self.sock:
-            self.sock.close()
-            self.sock = None
+        sock, self.sock = self.sock, None
+        if sock:
+            self.wake()
+            if self.io_thread:
+                self.io_thread.join(timeout=1.0)
+            sock.close()
 
 
 # Global network client instance
 network_client = NetworkClient()
 
+def board_rules(options):
+    # Game arguments for the board size and fleet the server's reply says the room plays with
+    board_size, fleet = room_rules(options)
+    return {'board_size': board_size, 'fleet': fleet}
+
 # Callback functions
 def create_room():
     print("Create Room clicked")
     room_name = "Room_" + socket.gethostname()
-    network_client.connect_to_server()
-    response = network_client.send_command(f"CREATE_ROOM {room_name}")
+    if not network_client.ensure_connected():
+        return
+    response = network_client.send_command(f"CREATE_ROOM {room_name} wire={WIRE_FORMAT} mode={ROOM_MODE} "
+                                            f"{encode_rules(BOARD_SIZE, FLEET)}")
     if response and response.startswith("ROOM_CREATED"):
         print(f"Room '{room_name}' created.")
+        _, options = parse_options(response.split(' ')[1:])
         # Start the game as host
-        game = Game(window=window, small_font=small_font, network_client=network_client, is_host=True)
+        game = Game(window=window, small_font=small_font, network_client=network_client, is_host=True,
+                    room_mode=options.get('mode', ROOM_MODE_RELAY), latency_log=LATENCY_LOG, **board_rules(options))
         game.run()
+        network_client.leave_room()
     else:
         print("Failed to create room.")
-        network_client.close_connection()
+
+def quick_match():
+    print("Quick Match clicked")
+    if not network_client.ensure_connected():
+        return
+    response = network_client.send_command(f"QUICK_MATCH wire={WIRE_FORMAT} mode={ROOM_MODE} {encode_rules(BOARD_SIZE, FLEET)}")
+    if response and response.split(' ')[0] in ("MATCH_WAITING", "JOINED_ROOM"):
+        _, options = parse_options(response.split(' ')[1:])
+        # Nobody was waiting: host a room the server will send the next player to.
+        # Otherwise we were paired straight away and join as the client.
+        is_host = response.startswith("MATCH_WAITING")
+        game = Game(window=window, small_font=small_font, network_client=network_client, is_host=is_host,
+                    wire_format=options.get('wire', WIRE_TEXT), room_mode=options.get('mode', ROOM_MODE_RELAY),
+                    latency_log=LATENCY_LOG, **board_rules(options))
+        game.run()
+        network_client.leave_room()
+    else:
+        print("Quick match failed.")
 
 def select_room():
     print("Select Room clicked")
+    if not network_client.ensure_connected():
+        return
     room_menu = RoomSelectionMenu(window, network_client, small_font)
     selected_room = room_menu.run()
     if selected_room:
         join_room(selected_room)
     else:
         print("No room selected.")
+        network_client.send_command("UNSUBSCRIBE_ROOMS")
+        network_client.discard_pending()
 
 def join_room(room_name):
     print("Joining room...")
-    network_client.connect_to_server()  # Ensure we are connected
-    response = network_client.send_command(f"JOIN_ROOM {room_name}")
+    # The menu is still subscribed to room list updates. Both requests go out in
+    # one round trip; updates sent before the server unsubscribed us are dropped.
+    unsubscribed = network_client.request("UNSUBSCRIBE_ROOMS")
+    joined = network_client.request(f"JOIN_ROOM {room_name} wire={WIRE_FORMAT}")
+    network_client.wait_reply(unsubscribed)
+    network_client.discard_pending()
+    response = network_client.wait_reply(joined)
     if response and response.startswith("JOINED_ROOM"):
         print(f"Joined room '{room_name}'.")
+        _, options = parse_options(response.split(' ')[1:])
         # Start the game as client
-        game = Game(window=window, small_font=small_font, network_client=network_client, is_host=False)
+        game = Game(window=window, small_font=small_font, network_client=network_client, is_host=False,
+                    wire_format=options.get('wire', WIRE_TEXT), room_mode=options.get('mode', ROOM_MODE_RELAY),
+                    latency_log=LATENCY_LOG, **board_rules(options))
         game.run()
-        # Close the connection after the game ends
-        network_client.close_connection()
+        network_client.leave_room()
     else:
         print("Failed to join room.")
-        network_client.close_connection()
 
     
 def test_game():
-    print("Local Test clicked")
-    # Start the game without connecting to the network
-    game = Game(window=window, small_font=small_font, network_client=network_client, local_test=True)
+    print("Practice clicked")
+    # A game against the computer, without connecting to the network
+    game = Game(window=window, small_font=small_font, network_client=network_client, local_test=True,
+                board_size=BOARD_SIZE, fleet=FLEET)
     game.run()
 
-# Create buttons with the font
-create_room_button = Button('Create Room', (WINDOW_WIDTH // 2 - 100, 250), create_room, font, "create")
-select_room_button = Button('Select Room', (WINDOW_WIDTH // 2 - 100, 350), select_room, font, "join")
-#test_game_button = Button('Local Test', (WINDOW_WIDTH // 2 - 100, 500), test_game, font, "localtest")
+def init_display():
+    global shipboardbackground, font, small_font, window
+    global create_room_button, select_room_button, quick_match_button, test_game_button
+    # Initialize Pygame
+    pygame.init()
+
+    shipboardbackground = pygame.image.load("titlebackground.png")
+    shipboardbackground = pygame.transform.scale(shipboardbackground, (WINDOW_WIDTH, WINDOW_HEIGHT))
+    # Fonts (initialize after pygame.init())
+    font = pygame.font.SysFont(None, 48)
+    small_font = pygame.font.SysFont(None, 24)
+
+    # Set up the display
+    window = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+    pygame.display.set_caption('Battleship')
+
+    # Create buttons with the font
+    create_room_button = Button('Create Room', (WINDOW_WIDTH // 2 - 100, 250), create_room, font, "create")
+    select_room_button = Button('Select Room', (WINDOW_WIDTH // 2 - 100, 350), select_room, font, "join")
+    quick_match_button = Button('Quick Match', (WINDOW_WIDTH // 2 - 100, 450), quick_match, font, "quickmatch")
+    test_game_button = Button('Practice', (WINDOW_WIDTH // 2 - 100, 530), test_game, font, "localtest")
 
 # Main loop
 def main_menu():
@@ -132,14 +500,21 @@ def main_menu():
                 pos = pygame.mouse.get_pos()
                 create_room_button.check_click(pos)
                 select_room_button.check_click(pos)
-                #test_game_button.check_click(pos)
+                quick_match_button.check_click(pos)
+                test_game_button.check_click(pos)
 
         drawTitle(window)
         create_room_button.draw(window)
         select_room_button.draw(window)
-        #test_game_button.draw(window)
+        quick_match_button.draw(window)
+        test_game_button.draw(window)
 
         pygame.display.flip()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Battleship client")
+    parser.add_argument('--latency-log', default=LATENCY_LOG,
+                        help="append a JSON line with the round trip of every move to this file")
+    LATENCY_LOG = parser.parse_args().latency_log
+    init_display()
     main_menu()
@@ -5,26 +5,74 @@ import pygame
 from constants import *
 from ui_elements import Button
 
+# Room list layout. Only the rows that fit between LIST_TOP and the bottom of the
+# window are drawn, so the cost of a frame does not depend on how many rooms exist.
+LIST_TOP = 150
+ROW_HEIGHT = 60
+ROW_WIDTH = 300
+VISIBLE_ROWS = (WINDOW_HEIGHT - LIST_TOP) // ROW_HEIGHT
+ROW_CACHE_SIZE = 256  # Rendered row labels kept between frames
+MENU_FPS = 60
+
 class RoomSelectionMenu:
     def __init__(self, window, network_client, small_font):
         self.window = window
         self.network_client = network_client
         self.small_font = small_font
         self.running = True
-        self.rooms = []
+        self.rooms = {}  # room name -> 'waiting' or 'playing'
         self.selected_room = None
-        self.fetch_rooms()
-
-    def fetch_rooms(self):
-        self.network_client.connect_to_server()
-        response = self.network_client.send_command("LIST_ROOMS")
-        if response and response.startswith("ROOM_LIST"):
-            room_list_str = response[len("ROOM_LIST "):]
-            self.rooms = room_list_str.split(',') if room_list_str else []
+        self.filter_text = ''  # Typed text; only rooms whose name contains it are shown
+        self.visible_rooms = []  # Sorted names passing the filter, rebuilt when rooms or the filter change
+        self.rooms_changed = True
+        self.scroll = 0  # Index of the first row on screen
+        self.highlight = 0  # Row that Enter joins
+        self.row_cache = {}  # (room name, state, highlighted) -> rendered label
+        self.clock = pygame.time.Clock()
+        self.subscribe_rooms()
+
+    def subscribe_rooms(self):
+        # The server sends the whole list once, then pushes only the changes to it.
+        # The subscription stays on the session's connection until the caller sends
+        # UNSUBSCRIBE_ROOMS. Changes that race ahead of the snapshot are already in it,
+        # and replaying them afterwards leaves the same list.
+        if not self.network_client.ensure_connected():
+            print("Failed to retrieve room list.")
+            return
+        response = self.network_client.send_command("SUBSCRIBE_ROOMS")
+        if response and response.startswith("ROOM_SNAPSHOT"):
+            self.apply_snapshot(response[len("ROOM_SNAPSHOT "):])
         else:
             print("Failed to retrieve room list.")
-            self.rooms = []
-        self.network_client.close_connection()
+
+    def apply_snapshot(self, snapshot):
+        self.rooms = {}
+        for entry in snapshot.split(',') if snapshot else []:
+            name, _, state = entry.rpartition(':')
+            self.rooms[name] = state
+        self.rooms_changed = True
+
+    def apply_update(self, message):
+        command, _, params = message.partition(' ')
+        if command in ('ROOM_ADDED', 'ROOM_STATE'):
+            name, _, state = params.rpartition(' ')
+            self.rooms[name] = state
+        elif command == 'ROOM_REMOVED':
+            self.rooms.pop(params, None)
+        else:
+            return
+        self.rooms_changed = True
+
+    def poll_updates(self):
+        if not self.network_client.connected:
+            return
+        frames = self.network_client.poll_frames()
+        if frames is None:
+            print("Lost the room list subscription.")
+            self.network_client.close_connection()
+            return
+        for frame in frames:
+            self.apply_update(frame.decode())
 
     def run(self):
         while self.running:
@@ -33,43 +81,122 @@ class RoomSelectionMenu:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False  # Do not exit the entire game
-                elif event.type == pygame.MOUSEBUTTONDOWN:
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                     pos = pygame.mouse.get_pos()
                     self.handle_click(pos)
+                elif event.type == pygame.MOUSEWHEEL:
+                    self.scroll_to(self.scroll - event.y)
+                elif event.type == pygame.KEYDOWN:
+                    self.handle_key(event)
+                elif event.type == pygame.TEXTINPUT:
+                    self.set_filter(self.filter_text + event.text)
 
+            self.poll_updates()
+            self.refresh_visible_rooms()
             self.draw(self.window)
             pygame.display.flip()
+            self.clock.tick(MENU_FPS)
 
         return self.selected_room
 
+    def refresh_visible_rooms(self):
+        # At most once per frame, however many updates arrived
+        if not self.rooms_changed:
+            return
+        needle = self.filter_text.lower()
+        self.visible_rooms = sorted(name for name in self.rooms if needle in name.lower())
+        self.rooms_changed = False
+        self.scroll_to(self.scroll)
+
+    def set_filter(self, text):
+        self.filter_text = text
+        self.rooms_changed = True
+        self.scroll = self.highlight = 0
+
+    def scroll_to(self, row):
+        self.scroll = max(0, min(row, len(self.visible_rooms) - VISIBLE_ROWS))
+        self.highlight = max(0, min(self.highlight, len(self.visible_rooms) - 1))
+
+    def move_highlight(self, rows):
+        self.highlight = max(0, min(self.highlight + rows, len(self.visible_rooms) - 1))
+        # Keep the highlighted row on screen
+        if self.highlight < self.scroll:
+            self.scroll_to(self.highlight)
+        elif self.highlight >= self.scroll + VISIBLE_ROWS:
+            self.scroll_to(self.highlight - VISIBLE_ROWS + 1)
+
+    def handle_key(self, event):
+        if event.key == pygame.K_UP:
+            self.move_highlight(-1)
+        elif event.key == pygame.K_DOWN:
+            self.move_highlight(1)
+        elif event.key == pygame.K_PAGEUP:
+            self.move_highlight(-VISIBLE_ROWS)
+        elif event.key == pygame.K_PAGEDOWN:
+            self.move_highlight(VISIBLE_ROWS)
+        elif event.key == pygame.K_HOME:
+            self.move_highlight(-len(self.visible_rooms))
+        elif event.key == pygame.K_END:
+            self.move_highlight(len(self.visible_rooms))
+        elif event.key == pygame.K_RETURN and self.visible_rooms:
+            self.selected_room = self.visible_rooms[self.highlight]
+            self.running = False
+        elif event.key == pygame.K_BACKSPACE:
+            self.set_filter(self.filter_text[:-1])
+        elif event.key == pygame.K_ESCAPE:
+            if self.filter_text:
+                self.set_filter('')
+            else:
+                self.running = False
+
+    def row_label(self, room_name, highlighted):
+        # Rendering text is the expensive part of a row, so labels are cached
+        state = self.rooms.get(room_name, '')
+        key = (room_name, state, highlighted)
+        label = self.row_cache.get(key)
+        if label is None:
+            if len(self.row_cache) >= ROW_CACHE_SIZE:
+                self.row_cache.clear()
+            label = self.small_font.render(f"{room_name} ({state})", True, BLUE if highlighted else BLACK)
+            self.row_cache[key] = label
+        return label
+
+    def row_rect(self, row):
+        # Screen rect of the row-th visible room
+        return pygame.Rect(WINDOW_WIDTH // 2 - ROW_WIDTH // 2, LIST_TOP + (row - self.scroll) * ROW_HEIGHT,
+                           ROW_WIDTH, 40)
+
     def draw(self, surface):
         # Draw the title
         title_text = self.small_font.render("Select a Room", True, BLACK)
         surface.blit(title_text, (WINDOW_WIDTH // 2 - title_text.get_width() // 2, 50))
 
-        # Draw the list of rooms
-        y_offset = 150
-        if not self.rooms:
+        # Filter and position, e.g. "Filter: abc   21-27 of 340"
+        status = f"Filter: {self.filter_text}   " if self.filter_text else "Type to filter   "
+        if self.visible_rooms:
+            last = min(self.scroll + VISIBLE_ROWS, len(self.visible_rooms))
+            status += f"{self.scroll + 1}-{last} of {len(self.visible_rooms)}"
+        status_text = self.small_font.render(status, True, BLACK)
+        surface.blit(status_text, (WINDOW_WIDTH // 2 - status_text.get_width() // 2, 100))
+
+        # Draw the rooms that are on screen
+        if not self.visible_rooms:
             no_rooms_text = self.small_font.render("No rooms available.", True, BLACK)
-            surface.blit(no_rooms_text, (WINDOW_WIDTH // 2 - no_rooms_text.get_width() // 2, y_offset))
+            surface.blit(no_rooms_text, (WINDOW_WIDTH // 2 - no_rooms_text.get_width() // 2, LIST_TOP))
         else:
-            for idx, room_name in enumerate(self.rooms):
-                room_rect = pygame.Rect(WINDOW_WIDTH // 2 - 150, y_offset, 300, 40)
+            for row in range(self.scroll, min(self.scroll + VISIBLE_ROWS, len(self.visible_rooms))):
+                room_rect = self.row_rect(row)
                 pygame.draw.rect(surface, LIGHT_GRAY, room_rect)
                 pygame.draw.rect(surface, BLACK, room_rect, 2)
-                room_text = self.small_font.render(room_name, True, BLACK)
+                room_text = self.row_label(self.visible_rooms[row], row == self.highlight)
                 text_rect = room_text.get_rect(center=room_rect.center)
                 surface.blit(room_text, text_rect)
-                y_offset += 60
 
     def handle_click(self, pos):
-        y_offset = 150
-        if not self.rooms:
-            return  # No rooms to click on
-        for idx, room_name in enumerate(self.rooms):
-            room_rect = pygame.Rect(WINDOW_WIDTH // 2 - 150, y_offset, 300, 40)
-            if room_rect.collidepoint(pos):
-                self.selected_room = room_name
-                self.running = False
-                break
-            y_offset += 60
+        # Only the visible rows can be clicked, so the row is computed rather than searched for
+        row = self.scroll + (pos[1] - LIST_TOP) // ROW_HEIGHT
+        if pos[1] < LIST_TOP or not self.scroll <= row < min(self.scroll + VISIBLE_ROWS, len(self.visible_rooms)):
+            return
+        if self.row_rect(row).collidepoint(pos):
+            self.selected_room = self.visible_rooms[row]
+            self.running = False
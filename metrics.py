@@ -0,0 +1,167 @@
+# metrics.py
+#
+# Counters and histograms for the server. Every thread writes to its own shard
+# (a plain dict), so recording a value never takes a lock; readers add the shards
+# together. The lock is only used when a thread's shard is created or retired,
+# i.e. once per connection, never per message.
+
+import json
+import threading
+import time
+
+HISTOGRAM_BUCKETS = 32  # Bucket i counts values in [2**(i-1), 2**i)
+
+class MetricsShard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1):
+        counters = self.counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        buckets = self.histograms.get(name)
+        if buckets is None:
+            buckets = self.histograms[name] = [0] * HISTOGRAM_BUCKETS
+        buckets[min(int(value).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        for name, value in list(other.counters.items()):
+            self.count(name, value)
+        for name, buckets in list(other.histograms.items()):
+            mine = self.histograms.setdefault(name, [0] * HISTOGRAM_BUCKETS)
+            for index, value in enumerate(buckets):
+                mine[index] += value
+
+class Metrics:
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards = []
+        self.retired = MetricsShard()  # Totals from threads that have finished
+        self.started_at = time.time()
+
+    def shard(self):
+        # Threads that handle many messages should look this up once and keep it
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = MetricsShard()
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def count(self, name, amount=1):
+        self.shard().count(name, amount)
+
+    def observe(self, name, value):
+        self.shard().observe(name, value)
+
+    def retire_shard(self):
+        # Folds the calling thread's shard into the totals so finished connection
+        # threads do not leave one shard each behind
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            return
+        del self.local.shard
+        with self.lock:
+            self.shards.remove(shard)
+            self.retired.merge(shard)
+
+    def snapshot(self):
+        total = MetricsShard()
+        with self.lock:
+            total.merge(self.retired)
+            shards = list(self.shards)
+        for shard in shards:
+            # Copies are taken without the owner's cooperation; a value being
+            # written right now just shows up in the next snapshot
+            copy = MetricsShard()
+            copy.counters = dict(shard.counters)
+            copy.histograms = {name: list(buckets) for name, buckets in list(shard.histograms.items())}
+            total.merge(copy)
+        return total
+
+def percentile(buckets, fraction):
+    # Upper bound of the bucket holding the given fraction of observations
+    total = sum(buckets)
+    if not total:
+        return 0
+    threshold = total * fraction
+    running = 0
+    for index, value in enumerate(buckets):
+        running += value
+        if running >= threshold:
+            return 2 ** index
+    return 2 ** (len(buckets) - 1)
+
+def new_baseline(metrics):
+    # Each reader keeps its own baseline so per-second rates cover its own interval
+    return {'time': metrics.started_at, 'counters': {}}
+
+def build_report(metrics, room_states, baseline):
+    # metrics is a Metrics or anything else with snapshot() and started_at;
+    # room_states is state -> number of rooms, from count_rooms()
+    now = time.time()
+    total = metrics.snapshot()
+    counters = total.counters
+    previous_counters = baseline['counters']
+    interval = max(now - baseline['time'], 1e-9)
+    baseline['time'] = now
+    baseline['counters'] = dict(counters)
+
+    commands = {name[len('command.'):]: value for name, value in counters.items() if name.startswith('command.')}
+    rates = {name: (value - previous_counters.get('command.' + name, 0)) / interval for name, value in commands.items()}
+    latency = total.histograms.get('relay_latency_us', [0] * HISTOGRAM_BUCKETS)
+    return {
+        'time': now,
+        'uptime': now - metrics.started_at,
+        'active_connections': counters.get('connections_opened', 0) - counters.get('connections_closed', 0),
+        'connections_opened': counters.get('connections_opened', 0),
+        'rooms': room_states,
+        'commands': commands,
+        'commands_per_sec': {name: round(rate, 1) for name, rate in rates.items()},
+        'bytes_in': counters.get('bytes_in', 0),
+        'bytes_out': counters.get('bytes_out', 0),
+        'send_failures': counters.get('send_failures', 0),
+        'relay_latency_us': {'count': sum(latency), 'p50': percentile(latency, 0.5),
+                             'p99': percentile(latency, 0.99), 'max': percentile(latency, 1.0)},
+    }
+
+def room_state(room):
+    if room['client_conn'] is None:
+        return 'waiting'
+    return 'playing'
+
+def count_rooms(rooms):
+    room_states = {}
+    for room in list(rooms.values()):
+        state = room_state(room)
+        room_states[state] = room_states.get(state, 0) + 1
+    return room_states
+
+def format_report(report):
+    lines = [
+        f"uptime {report['uptime']:.0f}s, {report['active_connections']} active connections "
+        f"({report['connections_opened']} total)",
+        "rooms: " + (', '.join(f"{state} {count}" for state, count in sorted(report['rooms'].items())) or "none"),
+        f"bytes in {report['bytes_in']}, bytes out {report['bytes_out']}, send failures {report['send_failures']}",
+        "relay latency us: " + ', '.join(f"{key} {value}" for key, value in report['relay_latency_us'].items()),
+        "commands (total, per sec since last report):",
+    ]
+    for name, value in sorted(report['commands'].items()):
+        lines.append(f"  {name:15s} {value:10d} {report['commands_per_sec'][name]:10.1f}")
+    return '\n'.join(lines)
+
+def dump_periodically(metrics, rooms, path, interval, should_stop):
+    # Appends one JSON report per line to path every interval seconds
+    baseline = new_baseline(metrics)
+    while not should_stop():
+        time.sleep(interval)
+        with open(path, 'a') as stats_file:
+            stats_file.write(json.dumps(build_report(metrics, count_rooms(rooms), baseline)) + '\n')
+
+metrics = Metrics()
@@ -0,0 +1,267 @@
+# protocol.py
+
+import string
+import struct
+from constants import GRID_SIZE, SHIP_SIZES
+
+# Every message on the wire is a 4-byte big-endian length followed by the payload.
+# TCP is a byte stream, so one recv() can return half a message or several at once;
+# the length prefix lets both ends split the stream back into whole messages.
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024
+
+# Commands that carry a player's moves. The server counts their bytes per seat, and
+# RESUMED reports the count, so a client that reconnects knows which of them never
+# arrived and sends those again.
+SESSION_COMMANDS = (b"MESSAGE ", b"ATTACK ", b"COMMIT_BOARD ")
+
+class FrameError(Exception):
+    pass
+
+def encode_frame(message):
+    if isinstance(message, str):
+        message = message.encode()
+    return HEADER.pack(len(message)) + message
+
+def encode_frames(messages):
+    # Several frames in one buffer so they can go out with a single sendall()
+    return b''.join(encode_frame(message) for message in messages)
+
+class FrameDecoder:
+    # Incremental decoder: feed it whatever recv() returned and it hands back
+    # every complete frame, keeping any partial frame for the next call.
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        return [bytes(frame) for frame in self.feed_views(data)]
+
+    def feed_views(self, data):
+        # Like feed(), but returns memoryview slices instead of copies. The slices
+        # point into data itself unless a frame straddled two recv() calls.
+        if self.buffer:
+            self.buffer += data
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        view = memoryview(data)
+        frames = []
+        offset = 0
+        data_len = len(data)
+        while data_len - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(data, offset)
+            if length > self.max_frame_size:
+                raise FrameError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+            end = offset + HEADER.size + length
+            if end > data_len:
+                break  # Rest of this frame has not arrived yet
+            frames.append(view[offset + HEADER.size:end])
+            offset = end
+        if offset < data_len:
+            self.buffer += view[offset:]
+        return frames
+
+def parse_options(params):
+    # Splits command parameters into positional values and key=value options,
+    # e.g. ['Room_1', 'wire=binary'] -> (['Room_1'], {'wire': 'binary'})
+    positional = []
+    options = {}
+    for param in params:
+        key, sep, value = param.partition('=')
+        if sep:
+            options[key] = value
+        else:
+            positional.append(param)
+    return positional, options
+
+# Gameplay messages travel inside MESSAGE frames as either text ("RESULT 3 7 HIT Carrier")
+# or struct-packed binary. The format is negotiated on JOIN_ROOM; text is the fallback.
+WIRE_TEXT = 'text'
+WIRE_BINARY = 'binary'
+WIRE_FORMATS = (WIRE_TEXT, WIRE_BINARY)
+
+def negotiate_wire_format(host_format, client_format):
+    if host_format == WIRE_BINARY and client_format == WIRE_BINARY:
+        return WIRE_BINARY
+    return WIRE_TEXT
+
+# Binary opcodes are below 0x20 so a binary body can never start like a text command
+OP_ATTACK = 1
+OP_RESULT = 2
+OP_ALL_SHIPS_PLACED = 3
+OP_GAME_OVER = 4
+
+ATTACK_STRUCT = struct.Struct('!BBB')       # opcode, x, y
+RESULT_STRUCT = struct.Struct('!BBBBB')     # opcode, x, y, hit, sunk ship id (0 = none)
+OPCODE_STRUCT = struct.Struct('!B')         # opcode only
+GAME_OVER_STRUCT = struct.Struct('!BB')     # opcode, winner length, then winner bytes
+
+class TextCodec:
+    # Gameplay messages as space separated ASCII
+    name = WIRE_TEXT
+
+    def encode_attack(self, grid_x, grid_y):
+        return f"ATTACK {grid_x} {grid_y}".encode()
+
+    def encode_result(self, grid_x, grid_y, hit, ship_sunk=None):
+        message = f"RESULT {grid_x} {grid_y} {'HIT' if hit else 'MISS'}"
+        if ship_sunk:
+            message += f" {ship_sunk}"
+        return message.encode()
+
+    def encode_all_ships_placed(self):
+        return b"ALL_SHIPS_PLACED"
+
+    def encode_game_over(self, winner):
+        return f"GAME_OVER {winner}".encode()
+
+class BinaryCodec(TextCodec):
+    # ship_names gives the ship ids: index + 1, with 0 meaning no ship was sunk
+    name = WIRE_BINARY
+
+    def __init__(self, ship_names):
+        self.ship_names = list(ship_names)
+        self.ship_ids = {ship: index + 1 for index, ship in enumerate(self.ship_names)}
+
+    def encode_attack(self, grid_x, grid_y):
+        return ATTACK_STRUCT.pack(OP_ATTACK, grid_x, grid_y)
+
+    def encode_result(self, grid_x, grid_y, hit, ship_sunk=None):
+        return RESULT_STRUCT.pack(OP_RESULT, grid_x, grid_y, 1 if hit else 0, self.ship_ids.get(ship_sunk, 0))
+
+    def encode_all_ships_placed(self):
+        return OPCODE_STRUCT.pack(OP_ALL_SHIPS_PLACED)
+
+    def encode_game_over(self, winner):
+        winner = winner.encode()
+        return GAME_OVER_STRUCT.pack(OP_GAME_OVER, len(winner)) + winner
+
+def decode_game_message(body, ship_names):
+    # Accepts either format, so a peer can always be understood whatever we send.
+    # Returns (command, args) with coordinates already as ints:
+    #   ('ATTACK', (x, y)), ('RESULT', (x, y, 'HIT'|'MISS', ship or None)),
+    #   ('ALL_SHIPS_PLACED', ()), ('GAME_OVER', (winner,))
+    if not body:
+        return None, ()
+    opcode = body[0]
+    if opcode == OP_ATTACK:
+        _, grid_x, grid_y = ATTACK_STRUCT.unpack_from(body)
+        return 'ATTACK', (grid_x, grid_y)
+    if opcode == OP_RESULT:
+        _, grid_x, grid_y, hit, ship_id = RESULT_STRUCT.unpack_from(body)
+        ship_sunk = ship_names[ship_id - 1] if ship_id else None
+        return 'RESULT', (grid_x, grid_y, 'HIT' if hit else 'MISS', ship_sunk)
+    if opcode == OP_ALL_SHIPS_PLACED:
+        return 'ALL_SHIPS_PLACED', ()
+    if opcode == OP_GAME_OVER:
+        _, length = GAME_OVER_STRUCT.unpack_from(body)
+        winner = bytes(body[GAME_OVER_STRUCT.size:GAME_OVER_STRUCT.size + length]).decode()
+        return 'GAME_OVER', (winner,)
+
+    parts = bytes(body).decode().strip().split(' ')
+    command = parts[0]
+    if command == 'ATTACK':
+        return command, (int(parts[1]), int(parts[2]))
+    if command == 'RESULT':
+        ship_sunk = parts[4] if len(parts) > 4 else None
+        return command, (int(parts[1]), int(parts[2]), parts[3], ship_sunk)
+    if command == 'GAME_OVER':
+        return command, (parts[1],)
+    return command, tuple(parts[1:])
+
+def make_codec(wire_format, ship_names):
+    if wire_format == WIRE_BINARY:
+        return BinaryCodec(ship_names)
+    return TextCodec()
+
+# Room modes. In a relay room the defender's client resolves attacks; in an
+# authoritative room both boards are committed to the server at ALL_SHIPS_PLACED
+# time and the server resolves ATTACK and tells both players at once.
+ROOM_MODE_RELAY = 'relay'
+ROOM_MODE_AUTHORITATIVE = 'authoritative'
+ROOM_MODES = (ROOM_MODE_RELAY, ROOM_MODE_AUTHORITATIVE)
+
+def encode_board(ships):
+    # ships: name -> (x, y, orientation) of the ship's first cell,
+    # e.g. "COMMIT_BOARD Carrier:0,0,h Destroyer:4,2,v"
+    parts = [f"{ship}:{x},{y},{orientation[0]}" for ship, (x, y, orientation) in ships.items()]
+    return "COMMIT_BOARD " + ' '.join(parts)
+
+def parse_board(params):
+    # Inverse of encode_board(), raises ValueError on malformed input
+    ships = {}
+    for param in params:
+        ship, _, position = param.partition(':')
+        x, y, orientation = position.split(',')
+        if orientation not in ('h', 'v'):
+            raise ValueError(f"Bad orientation for {ship}: {orientation}")
+        ships[ship] = (int(x), int(y), 'horizontal' if orientation == 'h' else 'vertical')
+    return ships
+
+# Room rules: the board is size x size cells and the fleet maps ship name -> length.
+# The host picks both with size= and fleet= on CREATE_ROOM or QUICK_MATCH, and every
+# reply that seats a player repeats them. fleet= is comma separated name:length pairs,
+# where name:length*count stands for count ships name1..nameN, so
+# "fleet=Carrier:5,Submarine:3*10" is eleven ships. Binary messages carry coordinates
+# and ship ids in one byte each.
+MIN_BOARD_SIZE = 5
+MAX_BOARD_SIZE = 100
+MAX_FLEET_SIZE = 255
+SHIP_NAME_CHARS = frozenset(string.ascii_letters + string.digits + '_-')
+
+def parse_fleet(spec):
+    # Raises ValueError on malformed input
+    fleet = {}
+    for part in spec.split(','):
+        name, sep, length = part.partition(':')
+        length, star, count = length.partition('*')
+        if not sep or not name or not SHIP_NAME_CHARS.issuperset(name):
+            raise ValueError(f"Bad ship: {part}")
+        count = int(count) if star else 0
+        if star and count < 1:
+            raise ValueError(f"Bad ship count: {part}")
+        if len(fleet) + max(count, 1) > MAX_FLEET_SIZE:
+            raise ValueError(f"More than {MAX_FLEET_SIZE} ships")
+        for ship in [f"{name}{number}" for number in range(1, count + 1)] if star else [name]:
+            if ship in fleet:
+                raise ValueError(f"Duplicate ship: {ship}")
+            fleet[ship] = int(length)
+    return fleet
+
+def encode_fleet(fleet):
+    # Inverse of parse_fleet(); a run of ships name1..nameN of one length is written
+    # as name:length*N
+    ships = list(fleet.items())
+    parts = []
+    index = 0
+    while index < len(ships):
+        ship, length = ships[index]
+        name = ship.rstrip(string.digits)
+        count = 0
+        while (name and index + count < len(ships)
+               and ships[index + count] == (f"{name}{count + 1}", length)):
+            count += 1
+        if count > 1:
+            parts.append(f"{name}:{length}*{count}")
+            index += count
+        else:
+            parts.append(f"{ship}:{length}")
+            index += 1
+    return ','.join(parts)
+
+def room_rules(options):
+    # (size, fleet) from size= and fleet=, the classic 10x10 game where they are
+    # missing. Raises ValueError for rules that cannot be played.
+    size = int(options.get('size', GRID_SIZE))
+    fleet = parse_fleet(options['fleet']) if 'fleet' in options else dict(SHIP_SIZES)
+    if not MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE:
+        raise ValueError(f"Board size must be {MIN_BOARD_SIZE} to {MAX_BOARD_SIZE}")
+    for ship, length in fleet.items():
+        if not 1 <= length <= size:
+            raise ValueError(f"{ship} does not fit on the board")
+    if 2 * sum(fleet.values()) > size * size:
+        raise ValueError("Fleet covers more than half the board")
+    return size, fleet
+
+def encode_rules(size, fleet):
+    return f"size={size} fleet={encode_fleet(fleet)}"
@@ -0,0 +1,70 @@
+# relay_benchmark.py
+#
+# Microbenchmark for the server's MESSAGE relay path. Runs in one process with
+# sockets replaced by sinks, so the numbers are relay CPU cost per core.
+#   python relay_benchmark.py [--messages N] [--batch N]
+
+import argparse
+import time
+import server
+from metrics import metrics
+from protocol import FrameDecoder, encode_frame, encode_frames
+
+class NullConnection:
+    def __init__(self):
+        self.bytes_sent = 0
+        self.shard = metrics.shard()
+
+    def sendall(self, data):
+        self.bytes_sent += len(data)
+
+    def send_buffers(self, buffers):
+        self.bytes_sent += sum(map(len, buffers))
+
+def legacy_relay(conn, frame, current_room):
+    # The relay as it was before the fast path: decode, split, join, format, encode
+    params = frame.decode().strip().split(' ')[1:]
+    message = ' '.join(params)
+    room = server.rooms[current_room]
+    if conn == room['host_conn']:
+        room['client_conn'].sendall(encode_frame(f"MESSAGE_FROM_HOST {message}"))
+    elif conn == room['client_conn']:
+        room['host_conn'].sendall(encode_frame(f"MESSAGE_FROM_CLIENT {message}"))
+
+def run_legacy(sender, chunk, rounds):
+    decoder = FrameDecoder()
+    for _ in range(rounds):
+        for frame in decoder.feed(chunk):
+            legacy_relay(sender, frame, 'bench')
+
+def run_fast_path(sender, chunk, rounds):
+    decoder = FrameDecoder()
+    for _ in range(rounds):
+        for frame in decoder.feed_views(chunk):
+            server.handle_frame(sender, None, frame, 'bench')
+
+def measure(name, runner, sender, chunk, rounds, batch):
+    start = time.perf_counter()
+    runner(sender, chunk, rounds)
+    elapsed = time.perf_counter() - start
+    rate = rounds * batch / elapsed
+    print(f"{name:10s} {rate:12,.0f} messages/sec")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description="MESSAGE relay microbenchmark")
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--batch', type=int, default=8, help="frames per simulated recv()")
+    args = parser.parse_args()
+
+    host, client = NullConnection(), NullConnection()
+    server.rooms['bench'] = {'host_conn': host, 'client_conn': client, 'host_addr': None}
+    chunk = encode_frames(["MESSAGE RESULT 3 7 HIT Carrier"] * args.batch)
+    rounds = args.messages // args.batch
+
+    before = measure("legacy", run_legacy, client, chunk, rounds, args.batch)
+    after = measure("fast path", run_fast_path, client, chunk, rounds, args.batch)
+    print(f"speedup    {after / before:12.2f}x")
+
+if __name__ == '__main__':
+    main()
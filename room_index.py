@@ -0,0 +1,62 @@
+# room_index.py
+#
+# Sorted index of the listed rooms, kept next to the rooms dict so LIST_ROOMS can
+# page through it. Names are kept in one sorted list per state ('waiting' rooms
+# have a free seat, 'playing' rooms are full), so a page is two bisects plus
+# reading the rooms on that page, however many rooms there are. Inserting and
+# removing a name is a bisect and a list memmove.
+
+import heapq
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+ROOM_STATES = ('waiting', 'playing')
+
+class RoomIndex:
+    def __init__(self):
+        self.names = {state: [] for state in ROOM_STATES}
+        self.entries = {}  # room name -> (state, created, mode)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, name, state, created, mode):
+        with self.lock:
+            previous = self.entries.get(name)
+            if previous is not None and previous[0] != state:
+                self.discard(name, previous[0])
+            if previous is None or previous[0] != state:
+                insort(self.names[state], name)
+            self.entries[name] = (state, created, mode)
+
+    def remove(self, name):
+        with self.lock:
+            previous = self.entries.pop(name, None)
+            if previous is not None:
+                self.discard(name, previous[0])
+
+    def discard(self, name, state):
+        names = self.names[state]
+        position = bisect_left(names, name)
+        if position < len(names) and names[position] == name:
+            del names[position]
+
+    def page(self, prefix='', state=None, after='', limit=50):
+        # Returns up to `limit` (name, state, created, mode) tuples in name order,
+        # starting after the cursor `after`, and whether more rooms follow
+        start = max(prefix, after)
+        with self.lock:
+            runs = []
+            for run_state in ([state] if state else ROOM_STATES):
+                names = self.names[run_state]
+                position = bisect_right(names, start) if start == after and after else bisect_left(names, start)
+                runs.append(map(names.__getitem__, range(position, len(names))))
+            page = []
+            for name in heapq.merge(*runs):
+                if not name.startswith(prefix):
+                    break  # Names sharing the prefix are contiguous
+                if len(page) == limit:
+                    return page, True
+                page.append((name,) + self.entries[name])
+        return page, False
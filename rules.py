@@ -0,0 +1,129 @@
+# rules.py
+#
+# The rules of one player's game, with no pygame, sockets or drawing: placing the
+# fleet, when the game starts, whose turn it is, resolving the opponent's attacks
+# on our board, recording the results of ours, scoring and game over. Game draws
+# and talks to the server on top of this; bots, tests and the server can use it
+# without SDL.
+
+from bitboard import HIT, MISS, Board
+from constants import GRID_SIZE, SHIP_SIZES
+
+# enemy_grid cell states; HIT and MISS are bitboard's
+UNKNOWN, PENDING = 0, 1
+
+class Rules:
+    def __init__(self, my_turn, size=GRID_SIZE, ship_sizes=SHIP_SIZES):
+        self.size = size
+        self.board = Board(size, ship_sizes)  # Our own ships and the opponent's hits and misses on them
+        self.enemy_grid = [[UNKNOWN] * size for _ in range(size)]  # What we know of the opponent's board
+        self.my_turn = my_turn
+        self.my_ships_ready = False
+        self.opponent_ready = False
+        self.game_started = False
+        self.game_over = False
+        self.winner = None
+        self.hits = 0
+        self.moves = 0
+
+    # Placement
+
+    def can_place(self, ship, x, y, orientation):
+        return self.board.fits(ship, x, y, orientation)
+
+    def place(self, ship, x, y, orientation):
+        # Raises ValueError if the ship is out of bounds or overlaps another
+        self.board.place(ship, x, y, orientation)
+
+    def all_ships_placed(self):
+        return self.board.complete()
+
+    def ships_ready(self):
+        # Our fleet is complete; returns True if that started the game
+        self.my_ships_ready = True
+        return self.start_if_ready()
+
+    def opponent_placed(self):
+        # Returns True if that started the game
+        self.opponent_ready = True
+        return self.start_if_ready()
+
+    def start_if_ready(self):
+        if self.my_ships_ready and self.opponent_ready and not self.game_started:
+            self.game_started = True
+            return True
+        return False
+
+    # Attacks
+
+    def attack_error(self, x, y):
+        # Why we may not attack (x, y) now, or None if we may
+        if not self.all_ships_placed():
+            return "Place all your ships first."
+        if not self.game_started:
+            return "Waiting for both players to be ready."
+        if not self.my_turn:
+            return "It's not your turn."
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            return "Click within the grid area."
+        if self.enemy_grid[y][x] != UNKNOWN:
+            return "You have already attacked this cell."
+        return None
+
+    def fire(self, x, y):
+        # Our attack is on its way; the cell is PENDING until record_result()
+        self.enemy_grid[y][x] = PENDING
+        self.moves += 1
+
+    def cancel_fire(self, x, y):
+        if self.enemy_grid[y][x] == PENDING:
+            self.enemy_grid[y][x] = UNKNOWN
+            self.moves -= 1
+
+    def record_result(self, x, y, hit):
+        # The outcome of our attack; passes the turn. Returns False for a result we
+        # already have, e.g. the second answer to an attack that was sent again.
+        if self.enemy_grid[y][x] in (HIT, MISS):
+            return False
+        self.enemy_grid[y][x] = HIT if hit else MISS
+        if hit:
+            self.hits += 1
+        self.my_turn = False
+        return True
+
+    def receive_attack(self, x, y):
+        # The opponent's attack on our board: returns (hit, sunk ship or None) and
+        # gives us the turn
+        hit, sunk_ship = self.board.attack(x, y)
+        self.my_turn = True
+        return hit, sunk_ship
+
+    def check_game_over(self):
+        # If all ships have no remaining cells, game over
+        return self.board.all_sunk()
+
+    def end(self, winner):
+        self.game_over = True
+        self.winner = winner
+
+    # Scoring
+
+    # Creates a function to scale both players' scores by the 10,000s
+    def base_points(self):
+        basePoints = self.hits * 10000
+        return basePoints
+
+    # Creates a function to define accuracy for both players
+    def hit_accuracy_percent(self):
+        if self.moves == 0:
+            return 0.0
+        accuracy = (float(self.hits) / float(self.moves)) * 100
+        return round(accuracy, 2)
+
+    # Creates a bonus-points system, using a function, based on both players' accuracy
+    def total_points(self):
+        basePoints = self.base_points()
+        hitAccuracy = self.hit_accuracy_percent()
+        bonus = self.hits * hitAccuracy
+        total_points = bonus + basePoints
+        return int(total_points)
@@ -1,128 +1,1044 @@
+import argparse
+import asyncio
+import itertools
 import socket
 import threading
+import time
+from collections import defaultdict, deque
+from bitboard import Board
+from protocol import (HEADER, ROOM_MODE_AUTHORITATIVE, ROOM_MODE_RELAY, ROOM_MODES, SESSION_COMMANDS, WIRE_FORMATS,
+                      WIRE_TEXT, FrameDecoder, FrameError, encode_frame, encode_frames, encode_rules, negotiate_wire_format, parse_board,
+                      parse_options, room_rules)
+from metrics import build_report, count_rooms, dump_periodically, format_report, metrics, new_baseline, room_state
+from room_index import RoomIndex
+from sessions import Session, new_token, token_worker
+from timer_wheel import TimerWheel
 
 HOST = '0.0.0.0'  # Listen on all interfaces
 PORT = 5555
+STATS_FILE = None  # When set, a JSON stats report is appended here every STATS_INTERVAL seconds
+STATS_INTERVAL = 10.0
 
-rooms = {}  # Dictionary to store room info: room_name -> {'host_conn': conn, 'client_conn': conn, 'host_addr': addr} 
+# Outbound backpressure: each connection queues at most OUTBOUND_LIMIT bytes.
+# When a peer falls further behind, SLOW_PEER_POLICY decides what happens:
+#   drop       - discard the new frame
+#   disconnect - close the slow peer's connection
+#   block      - make the sender wait, up to SEND_BLOCK_TIMEOUT seconds, then disconnect the peer
+SLOW_PEER_POLICIES = ('drop', 'disconnect', 'block')
+OUTBOUND_LIMIT = 256 * 1024
+SLOW_PEER_POLICY = 'disconnect'
+SEND_BLOCK_TIMEOUT = 5.0
+CLOSE_TIMEOUT = 5.0  # How long close() waits for queued frames to be flushed
+
+# Heartbeats: a connection silent for HEARTBEAT_INTERVAL seconds is sent PING (clients
+# answer PONG); one silent for IDLE_TIMEOUT seconds is closed, which also removes any
+# room it was holding. IDLE_TIMEOUT = 0 turns the reaper off.
+HEARTBEAT_INTERVAL = 15.0
+IDLE_TIMEOUT = 45.0
+# One wheel holds every connection's heartbeat timer; reaper_lock guards it
+reaper = TimerWheel(tick=0.5)
+reaper_lock = threading.Lock()
+
+# Session resume: a player whose connection drops while in a room keeps the seat for
+# RESUME_GRACE seconds, and RESUME <token> on a new connection takes it back. At least
+# REPLAY_LIMIT bytes of what the server last sent each player are kept for replay.
+# RESUME_GRACE = 0 gives the seat up as soon as the connection drops.
+RESUME_GRACE = 30.0
+REPLAY_LIMIT = 64 * 1024
+sessions = {}  # token -> Session
+sessions_lock = threading.Lock()
+
+KNOWN_COMMANDS = ('CREATE_ROOM', 'LIST_ROOMS', 'JOIN_ROOM', 'COMMIT_BOARD', 'ATTACK', 'QUICK_MATCH', 'LEAVE_ROOM',
+                  'SUBSCRIBE_ROOMS', 'UNSUBSCRIBE_ROOMS', 'RESUME', 'PING', 'PONG')
+LATENCY_SAMPLE_EVERY = 16  # Time one relay in this many; timing every relay costs more than the relay
+
+# Dictionary to store room info: room_name -> {'host_conn': conn, 'client_conn': conn, 'host_addr': addr,
+#   'host_wire': format, 'wire': format, 'mode': mode, 'size': board size, 'fleet': {ship: length},
+#   'rules': size=/fleet= text, 'listed': bool, 'created': timestamp, 'boards': {role: board},
+#   'turn': role, 'last_results': {role: ((x, y), frames sent to that attacker)}}
+rooms = {}
+# QUICK_MATCH: per room mode and rules, a FIFO of unlisted rooms whose host is waiting for
+# an opponent. Rooms that were closed or filled while queued are skipped when popped.
+match_queues = defaultdict(deque)
+match_ids = itertools.count(1)
+# Held while a QUICK_MATCH looks for a waiting room and, finding none, queues its own, so
+# two players arriving together cannot both end up waiting. sharding.py swaps in a lock
+# shared by all worker processes.
+match_lock = threading.Lock()
+# Connections that sent SUBSCRIBE_ROOMS and get room list changes pushed to them
+room_subscribers = set()
+# Listed rooms sorted by name, for paging LIST_ROOMS; in worker processes it also
+# holds the other workers' rooms, refreshed from the shared directory
+room_index = RoomIndex()
+LIST_PAGE_SIZE = 50
+MAX_LIST_PAGE_SIZE = 200
+ROOM_STATUSES = {'open': 'waiting', 'full': 'playing'}  # LIST_ROOMS status= filter -> room state
+ROOM_NAME_RESERVED = '=,:'  # Characters a room name may not contain
+MATCH_ROOM_PREFIX = 'match-'  # QUICK_MATCH names its rooms match-1, match-2, ...
 shutdown_flag = False
+# Set by sharding.py in worker processes: a directory of which worker owns each room
+room_directory = None
+
+class ConnectionHandoff(Exception):
+    # Raised while processing JOIN_ROOM, QUICK_MATCH or RESUME for a room another worker owns
+    def __init__(self, worker_id):
+        super().__init__(worker_id)
+        self.worker_id = worker_id
+
+def wire_option(options):
+    wire = options.get('wire', WIRE_TEXT)
+    return wire if wire in WIRE_FORMATS else WIRE_TEXT
+
+def list_limit_option(options):
+    try:
+        return max(1, min(int(options.get('limit', LIST_PAGE_SIZE)), MAX_LIST_PAGE_SIZE))
+    except ValueError:
+        return LIST_PAGE_SIZE
+
+def requested_room_name(conn, params, options):
+    # The room name a command names, or None after telling conn it is missing or
+    # unusable. A key=value parameter is an option, so it can never be the name, and
+    # ROOM_SNAPSHOT / ROOM_LIST entries are name:... joined with commas.
+    if not params or not params[0] or any(char in params[0] for char in ROOM_NAME_RESERVED):
+        reply(conn, "ERROR Invalid room name", options)
+        return None
+    return params[0]
+
+def room_name_free(conn, room_name, options):
+    # True if CREATE_ROOM may take room_name; otherwise tells conn why not. match-N
+    # names belong to QUICK_MATCH.
+    if room_name.startswith(MATCH_ROOM_PREFIX):
+        reply(conn, "ERROR Invalid room name", options)
+        return False
+    if room_name in rooms:
+        reply(conn, "ERROR Room already exists", options)
+        return False
+    return True
+
+def claim_room(room_name, room):
+    # Adds room unless room_name was taken since room_name_free() looked, by another
+    # thread or, with --workers, by another worker process. True if it was added.
+    if rooms.setdefault(room_name, room) is not room:
+        return False
+    if room_directory and not room_directory.publish(room_name, room_state(room), room['created'], room['mode']):
+        del rooms[room_name]
+        return False
+    return True
+
+def requested_rules(conn, options):
+    # The size= and fleet= a room is asked for, or None after telling conn why they are unplayable
+    try:
+        return room_rules(options)
+    except ValueError as e:
+        reply(conn, f"ERROR Invalid rules: {e}", options)
+        return None
+
+def room_mode_option(options):
+    mode = options.get('mode', ROOM_MODE_RELAY)
+    return mode if mode in ROOM_MODES else ROOM_MODE_RELAY
+
+def build_board(ships, room):
+    # Validates a committed fleet against the room's rules and returns the server's view
+    # of that board. Raises ValueError if the fleet is incomplete, out of bounds or overlapping.
+    if set(ships) != set(room['fleet']):
+        raise ValueError("Fleet does not match")
+    board = Board(room['size'], room['fleet'])
+    for ship, (x, y, orientation) in ships.items():
+        board.place(ship, x, y, orientation)
+    return board
+
+def reply(conn, message, options):
+    conn.sendall(reply_frame(message, options))
+
+def reply_frame(message, options):
+    # Answers a command, echoing its id= so a client that pipelines several
+    # requests on one connection can tell which reply is which
+    request_id = options.get('id')
+    return encode_frame(f"{message} id={request_id}" if request_id else message)
+
+def new_room(conn, addr, options, rules, listed=True):
+    size, fleet = rules
+    return {'host_conn': conn, 'client_conn': None, 'host_addr': addr,
+            'host_wire': wire_option(options), 'wire': WIRE_TEXT, 'mode': room_mode_option(options),
+            'size': size, 'fleet': fleet, 'rules': encode_rules(size, fleet), 'listed': listed, 'created': time.time(), 'boards': {}, 'turn': 'host', 'last_results': {}}
+
+def join_room(conn, addr, room_name, room, options):
+    room['client_conn'] = conn  # Set client connection
+    # Both players must support a wire format for it to be used
+    room['wire'] = negotiate_wire_format(room['host_wire'], wire_option(options))
+    open_session(conn, room_name, 'client', f"JOINED_ROOM {room_name} wire={room['wire']} mode={room['mode']} {room['rules']}",
+                 options)
+    print(f"Player from {addr[0]} joined room {room_name}")
+    announce_room(room_name, room, 'ROOM_STATE')
+    # Inform host that the client has joined
+    room['host_conn'].sendall(encode_frame(f"CLIENT_JOINED {addr[0]} wire={room['wire']}"))
+
+def room_snapshot():
+    # name:state for every listed room
+    return ','.join(f"{name}:{state}" for name, (state, _, _) in list(room_index.entries.items()))
+
+def room_list_page(options):
+    # LIST_ROOMS [prefix=<name prefix>] [status=open|full] [after=<cursor>] [limit=<n>]
+    # Entries are name:players:created:mode; next= is the cursor for the following page
+    page, more = room_index.page(options.get('prefix', ''), ROOM_STATUSES.get(options.get('status')),
+                                 options.get('after', ''), list_limit_option(options))
+    entries = ','.join(f"{name}:{1 if state == 'waiting' else 2}:{int(created)}:{mode}"
+                       for name, state, created, mode in page)
+    return f"ROOM_LIST {entries} next={page[-1][0]}" if more else f"ROOM_LIST {entries}"
+
+def publish_room_event(message):
+    # Encoded once and queued to every subscriber
+    if room_subscribers:
+        frame = encode_frame(message)
+        for subscriber in list(room_subscribers):
+            subscriber.sendall(frame)
+        metrics.count('room_events')
+
+def announce_room(room_name, room, event):
+    # Keeps everything that lists rooms up to date: the index, the shared directory
+    # and subscribers. event is ROOM_ADDED, ROOM_STATE or ROOM_REMOVED; quick-match
+    # rooms are never listed, but other workers are told which of them are waiting.
+    if not room['listed']:
+        if room_directory:
+            if event != 'ROOM_REMOVED' and room['client_conn'] is None:
+                room_directory.offer_match(room_name, match_key(room), room['created'])
+            else:
+                room_directory.withdraw_match(room_name)
+        return
+    if event == 'ROOM_REMOVED':
+        room_index.remove(room_name)
+        if room_directory:
+            room_directory.unregister(room_name)
+        publish_room_event(f"ROOM_REMOVED {room_name}")
+        return
+    state = room_state(room)
+    room_index.update(room_name, state, room['created'], room['mode'])
+    if room_directory:
+        room_directory.publish(room_name, state, room['created'], room['mode'])
+    publish_room_event(f"{event} {room_name} {state}")
+
+def match_key(room):
+    return room['mode'], room['rules']
+
+def next_waiting_room(key):
+    # popleft() is atomic, so two players matching at once never get the same room
+    queue = match_queues[key]
+    while queue:
+        room_name = queue.popleft()
+        room = rooms.get(room_name)
+        if room is not None and room['client_conn'] is None:
+            return room_name, room
+    return None, None
+
+def role_of(conn, room):
+    if conn is room['host_conn']:
+        return 'host'
+    if conn is room['client_conn']:
+        return 'client'
+    return None
+
+def other_role(role):
+    return 'client' if role == 'host' else 'host'
+
+def resolve_attack(conn, room, grid_x, grid_y):
+    # Authoritative rooms: the server checks the defender's committed board and
+    # sends the outcome to both players, so the defender's client is not in the loop.
+    role = role_of(conn, room)
+    if role is None or room['client_conn'] is None:
+        conn.sendall(encode_frame("ERROR Not in a room"))
+        return
+    if len(room['boards']) < 2:
+        conn.sendall(encode_frame("ERROR Boards not committed"))
+        return
+    last_result = room['last_results'].get(role)
+    if last_result and last_result[0] == (grid_x, grid_y):
+        # A client that saw no result in time sends its attack again; repeat the answer
+        conn.sendall(last_result[1])
+        return
+    if room['turn'] != role:
+        conn.sendall(encode_frame("ERROR Not your turn"))
+        return
+    defender = other_role(role)
+    board = room['boards'][defender]
+    if not board.in_bounds(grid_x, grid_y) or board.attacked(grid_x, grid_y):
+        conn.sendall(encode_frame("ERROR Invalid attack"))
+        return
+    hit, sunk = board.attack(grid_x, grid_y)
+    outcome = f"HIT {sunk}" if sunk else 'HIT' if hit else 'MISS'
+    room['turn'] = defender
+    attacker_messages = [f"ATTACK_RESULT {grid_x} {grid_y} {outcome}"]
+    defender_messages = [f"ATTACKED {grid_x} {grid_y} {outcome}"]
+    if board.all_sunk():
+        attacker_messages.append(f"GAME_OVER {role}")
+        defender_messages.append(f"GAME_OVER {role}")
+    attacker_frames = b''.join(encode_frame(message) for message in attacker_messages)
+    room['last_results'][role] = ((grid_x, grid_y), attacker_frames)
+    conn.sendall(attacker_frames)
+    room[f'{defender}_conn'].sendall(b''.join(encode_frame(message) for message in defender_messages))
+
+def process_command(conn, addr, data, current_room):
+    # Handles one command from a connection and returns the room the connection is now in.
+    # Shared by the threaded and asyncio server modes; conn only needs sendall().
+    command_parts = data.strip().split(' ')
+    command = command_parts[0]
+    params, options = parse_options(command_parts[1:])
+    metrics.count('command.' + (command if command in KNOWN_COMMANDS else 'INVALID'))
+    if current_room is not None and (current_room not in rooms or role_of(conn, rooms[current_room]) is None):
+        current_room = None  # The host left and the room is gone
+
+    if command in ('CREATE_ROOM', 'JOIN_ROOM', 'QUICK_MATCH', 'RESUME') and current_room is not None:
+        # A connection outlives its games, but is in at most one room at a time
+        reply(conn, "ERROR Already in a room", options)
+
+    elif command == 'CREATE_ROOM':
+        room_name = requested_room_name(conn, params, options)
+        host_ip = addr[0]
+        if room_name is not None and not room_name_free(conn, room_name, options):
+            room_name = None
+        rules = requested_rules(conn, options) if room_name is not None else None
+        room = new_room(conn, addr, options, rules) if rules is not None else None
+        if room is not None and not claim_room(room_name, room):
+            reply(conn, "ERROR Room already exists", options)
+        elif room is not None:
+            open_session(conn, room_name, 'host', f"ROOM_CREATED {room_name} mode={room['mode']} {room['rules']}", options)
+            announce_room(room_name, room, 'ROOM_ADDED')
+            current_room = room_name
+            print(f"Room created: {room_name} by {host_ip}")
+
+    elif command == 'LEAVE_ROOM':
+        if current_room is None:
+            reply(conn, "ERROR Not in a room", options)
+        else:
+            leave_room(conn, current_room)
+            reply(conn, f"LEFT_ROOM {current_room}", options)
+            current_room = None
+
+    elif command == 'RESUME':
+        current_room = resume_session(conn, params[0] if params else '', options)
+
+    elif command == 'LIST_ROOMS':
+        reply(conn, room_list_page(options), options)
+
+    elif command == 'SUBSCRIBE_ROOMS':
+        # Subscribing before taking the snapshot means no change can fall between the
+        # two. A delta that races ahead of the snapshot is already reflected in it, and
+        # clients ignore deltas until the snapshot arrives.
+        room_subscribers.add(conn)
+        reply(conn, f"ROOM_SNAPSHOT {room_snapshot()}", options)
+
+    elif command == 'UNSUBSCRIBE_ROOMS':
+        room_subscribers.discard(conn)
+        reply(conn, "UNSUBSCRIBED", options)
+
+    elif command == 'JOIN_ROOM':
+        room_name = requested_room_name(conn, params, options)
+        if room_name is not None:
+            # Quick-match rooms are unlisted and only paired through QUICK_MATCH, so
+            # joining one by name finds nothing
+            if room_name in rooms and rooms[room_name]['listed']:
+                if rooms[room_name]['client_conn'] is None:
+                    join_room(conn, addr, room_name, rooms[room_name], options)
+                    current_room = room_name
+                else:
+                    reply(conn, "ERROR Room already has a client", options)
+            else:
+                owner = room_directory.owner(room_name) if room_directory else None
+                if owner is not None and owner != room_directory.worker_id:
+                    # Another worker process has this room; move the connection there
+                    raise ConnectionHandoff(owner)
+                reply(conn, "ERROR Room not found", options)
+
+    elif command == 'QUICK_MATCH':
+        # Pairs with the longest-waiting player of the same room mode and rules, or waits
+        # as the host of a new unlisted room. Either way the replies are the ones JOIN_ROOM
+        # and CREATE_ROOM give, so clients continue exactly as after those.
+        rules = requested_rules(conn, options)
+        if rules is not None:
+            key = (room_mode_option(options), encode_rules(*rules))
+            with match_lock:
+                room_name, room = next_waiting_room(key)
+                waiting = room is None
+                if waiting:
+                    # With --workers, someone may be waiting in another worker; that
+                    # worker gets this connection and pairs it from its own queue
+                    owner = room_directory.claim_match(key) if room_directory else None
+                    if owner is not None:
+                        raise ConnectionHandoff(owner)
+                    room_name = f"{MATCH_ROOM_PREFIX}{next(match_ids)}"
+                    room = rooms[room_name] = new_room(conn, addr, options, rules, listed=False)
+                    # MATCH_WAITING goes out before anyone can find the room and join
+                    open_session(conn, room_name, 'host', f"MATCH_WAITING {room_name} mode={room['mode']} {room['rules']}",
+                                 options)
+                    match_queues[key].append(room_name)
+                    announce_room(room_name, room, 'ROOM_ADDED')
+            if not waiting:
+                join_room(conn, addr, room_name, room, options)
+                metrics.count('quick_matches')
+            current_room = room_name
+
+    elif command == 'COMMIT_BOARD':
+        room = rooms.get(current_room)
+        role = role_of(conn, room) if room else None
+        if role is None or room['mode'] != ROOM_MODE_AUTHORITATIVE:
+            reply(conn, "ERROR Not in an authoritative room", options)
+        elif role in room['boards']:
+            reply(conn, "ERROR Board already committed", options)
+        else:
+            try:
+                room['boards'][role] = build_board(parse_board(params), room)
+            except ValueError as e:
+                reply(conn, f"ERROR Invalid board: {e}", options)
+
+    elif command == 'ATTACK':
+        room = rooms.get(current_room)
+        if room is None or room['mode'] != ROOM_MODE_AUTHORITATIVE:
+            reply(conn, "ERROR Not in an authoritative room", options)
+        else:
+            try:
+                grid_x, grid_y = int(params[0]), int(params[1])
+            except (IndexError, ValueError):
+                reply(conn, "ERROR Invalid attack", options)
+            else:
+                resolve_attack(conn, room, grid_x, grid_y)
+
+    elif command == 'PING':
+        reply(conn, ' '.join(['PONG'] + params), options)
+
+    elif command == 'PONG':
+        pass  # Receiving it already refreshed last_seen
+
+    else:
+        reply(conn, "ERROR Invalid command", options)
+
+    return current_room
+
+MESSAGE_PREFIX = b'MESSAGE '
+MESSAGE_PREFIX_LEN = len(MESSAGE_PREFIX)
+FROM_HOST_PREFIX = b'MESSAGE_FROM_HOST '
+FROM_CLIENT_PREFIX = b'MESSAGE_FROM_CLIENT '
+SESSION_PREFIX_MAX = max(len(prefix) for prefix in SESSION_COMMANDS)
+
+def relay_message(conn, frame, current_room):
+    # Fast path for MESSAGE: the body is forwarded as the original bytes behind a
+    # prebuilt prefix and is never decoded, split or re-encoded.
+    room = rooms.get(current_room)
+    if room is None:
+        conn.sendall(encode_frame("ERROR Not in a room"))
+        return
+    if conn is room['host_conn']:
+        # Forward host's message to client
+        peer_conn = room['client_conn']
+        prefix = FROM_HOST_PREFIX
+    elif conn is room['client_conn']:
+        # Forward client's message to host
+        peer_conn = room['host_conn']
+        prefix = FROM_CLIENT_PREFIX
+    else:
+        return
+    if peer_conn:
+        body = frame[MESSAGE_PREFIX_LEN:]
+        length = len(prefix) + len(body)
+        if peer_conn.send_buffers((HEADER.pack(length), prefix, body)):
+            conn.shard.count('bytes_out', HEADER.size + length)
+
+def handle_frame(conn, addr, frame, current_room):
+    # frame is a memoryview into the receive buffer
+    if conn.session and bytes(frame[:SESSION_PREFIX_MAX]).startswith(SESSION_COMMANDS):
+        conn.session.received += HEADER.size + len(frame)
+    if frame[:MESSAGE_PREFIX_LEN] == MESSAGE_PREFIX:
+        # conn.shard belongs to the thread reading conn, which is the one running this
+        counters = conn.shard.counters
+        relayed = counters.get('command.MESSAGE', 0) + 1
+        counters['command.MESSAGE'] = relayed
+        if relayed % LATENCY_SAMPLE_EVERY:
+            relay_message(conn, frame, current_room)
+        else:
+            started = time.perf_counter_ns()
+            relay_message(conn, frame, current_room)
+            conn.shard.observe('relay_latency_us', (time.perf_counter_ns() - started) // 1000)
+        return current_room
+    return process_command(conn, addr, bytes(frame).decode(), current_room)
+
+def cleanup_connection(conn, current_room):
+    # Cleanup when a player disconnects
+    room_subscribers.discard(conn)
+    if conn.successor:
+        return  # The player already resumed on a new connection
+    room = rooms.get(current_room)
+    if conn.session and RESUME_GRACE and room and role_of(conn, room):
+        hold_seat(conn, current_room)
+    else:
+        leave_room(conn, current_room)
+
+def leave_room(conn, current_room):
+    # On LEAVE_ROOM, disconnect or when a held seat's grace window runs out
+    end_session(conn)
+    if current_room and current_room in rooms:
+        room = rooms[current_room]
+        # Room state is updated before notifying the peer, which may be gone too
+        if conn == room['host_conn']:
+            print(f"Host left room {current_room}")
+            del rooms[current_room]
+            announce_room(current_room, room, 'ROOM_REMOVED')
+            # Notify client that the host disconnected
+            notify(room['client_conn'], "HOST_DISCONNECTED")
+            end_session(room['client_conn'])
+        elif conn == room['client_conn']:
+            print(f"Client left room {current_room}")
+            room['client_conn'] = None
+            # The next client starts a fresh game
+            room['boards'] = {}
+            room['turn'] = 'host'
+            room['last_results'] = {}
+            if not room['listed']:
+                # Back in the quick-match queue so the host gets another opponent
+                match_queues[match_key(room)].append(current_room)
+            announce_room(current_room, room, 'ROOM_STATE')
+            # Notify host that the client disconnected
+            notify(room['host_conn'], "CLIENT_DISCONNECTED")
+
+def open_session(conn, room_name, role, message, options):
+    # Replies to the command that seated conn in a room, adding session=<token>.
+    # Everything sent to conn after that reply is kept for replay.
+    session = Session(new_token(room_directory.worker_id if room_directory else None), room_name, role, REPLAY_LIMIT)
+    session.conn = conn
+    with sessions_lock:
+        sessions[session.token] = session
+    conn.start_session(session, reply_frame(f"{message} session={session.token}", options))
+
+def end_session(conn):
+    session = conn.session if conn else None
+    if session:
+        conn.session = None
+        with sessions_lock:
+            sessions.pop(session.token, None)
+            cancel_expiry(session)
+
+def cancel_expiry(session):
+    if session.expiry:
+        with reaper_lock:
+            reaper.cancel(session.expiry)
+        session.expiry = None
+
+def hold_seat(conn, room_name):
+    # The connection dropped while in a room: the seat stays taken for RESUME_GRACE
+    # seconds, and whatever is sent to it meanwhile goes to the replay buffer
+    session = conn.session
+    with sessions_lock:
+        if conn.successor:
+            return
+        with reaper_lock:
+            session.expiry = reaper.schedule(RESUME_GRACE, lambda: expire_session(session, conn))
+    metrics.count('sessions_held')
+    print(f"Holding the {session.role}'s seat in room {room_name} for {RESUME_GRACE:g}s")
+    notify(peer_of(conn, room_name), f"PEER_AWAY {RESUME_GRACE:g}")
+
+def expire_session(session, conn):
+    with sessions_lock:
+        if session.conn is not conn or sessions.pop(session.token, None) is None:
+            return  # Resumed or already ended
+        session.expiry = None
+    metrics.count('sessions_expired')
+    leave_room(conn, session.room_name)
+
+def resume_session(conn, token, options):
+    # RESUME <token> received=<bytes of the session the client got before the drop>
+    # RESUMED answers with received=<bytes of the client's moves we got>.
+    # Returns the room conn now sits in, or None if the session is gone
+    worker = token_worker(token)
+    if room_directory and worker is not None and worker != room_directory.worker_id:
+        raise ConnectionHandoff(worker)  # The session lives in another worker process
+    try:
+        received = int(options.get('received', 0))
+    except ValueError:
+        received = -1
+    with sessions_lock:
+        session = sessions.get(token)
+        room = rooms.get(session.room_name) if session else None
+        # The client's earlier bytes must still be in the replay buffer
+        if (room is None or room[f'{session.role}_conn'] is not session.conn or
+                not session.conn.transfer(conn, received, reply_frame(
+                    f"RESUMED {session.room_name} role={session.role} wire={room['wire']} mode={room['mode']} "
+                    f"received={session.received}", options))):
+            reply(conn, "ERROR Session expired", options)
+            return None
+        session.conn = conn
+        room[f'{session.role}_conn'] = conn
+        cancel_expiry(session)
+    metrics.count('sessions_resumed')
+    print(f"The {session.role} of room {session.room_name} resumed")
+    notify(peer_of(conn, session.room_name), "PEER_BACK")
+    return session.room_name
+
+def notify(conn, message):
+    # Best-effort send; a failure is already counted in send_failures
+    if conn:
+        try:
+            conn.sendall(encode_frame(message))
+        except OSError:
+            pass
+
+def watch_connection(conn):
+    if IDLE_TIMEOUT:
+        with reaper_lock:
+            conn.heartbeat = reaper.schedule(HEARTBEAT_INTERVAL, lambda: check_heartbeat(conn))
+
+def unwatch_connection(conn):
+    if conn.heartbeat:
+        with reaper_lock:
+            reaper.cancel(conn.heartbeat)
+        conn.heartbeat = None
+
+def check_heartbeat(conn):
+    # Runs once per HEARTBEAT_INTERVAL per connection, not once per message:
+    # reads only stamp conn.last_seen and this looks at it lazily
+    if conn.closed:
+        return
+    idle = time.monotonic() - conn.last_seen
+    if idle >= IDLE_TIMEOUT:
+        metrics.count('idle_disconnects')
+        conn.abort()
+        return
+    if idle >= HEARTBEAT_INTERVAL and not conn.backlog():
+        # A connection with queued output will show up dead through its writer
+        conn.sendall(encode_frame(f"PING {int(time.time() * 1000)}"))
+    watch_connection(conn)
+
+def run_expired_timers():
+    with reaper_lock:
+        expired = reaper.advance(time.monotonic())
+    for timer in expired:
+        timer.callback()
+
+def run_reaper(should_stop):
+    while not should_stop():
+        time.sleep(reaper.tick)
+        run_expired_timers()
+
+def start_reaper(should_stop):
+    if IDLE_TIMEOUT or RESUME_GRACE:
+        reaper.current = int(time.monotonic() / reaper.tick)
+        threading.Thread(target=run_reaper, args=(should_stop,), daemon=True).start()
 
-def handle_client(conn, addr):
+async def run_reaper_async():
+    reaper.current = int(time.monotonic() / reaper.tick)
+    while not shutdown_flag:
+        await asyncio.sleep(reaper.tick)
+        run_expired_timers()
+
+class SocketConnection:
+    # A blocking socket as seen by the rooms. Writes go into a bounded queue that
+    # this connection's own writer thread drains, so a slow receiver never stalls
+    # the thread relaying to it and concurrent writers cannot interleave frames.
+    # Frames queued while a send is in progress go out together in one sendall().
+    def __init__(self, sock):
+        self.sock = sock
+        self.shard = metrics.shard()  # Created on the thread that reads this socket
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self.heartbeat = None
+        self.session = None  # Set while in a room; what is sent is also kept for replay
+        self.successor = None  # The connection the player resumed on
+        self.ready = threading.Condition()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def backlog(self):
+        return self.queued_bytes
+
+    def recv(self, bufsize):
+        return self.sock.recv(bufsize)
+
+    def sendall(self, data):
+        if self.enqueue((data,), len(data)):
+            metrics.count('bytes_out', len(data))
+
+    def send_buffers(self, buffers):
+        # Used by the relay, which counts bytes_out itself
+        return self.enqueue(buffers, sum(map(len, buffers)))
+
+    def enqueue(self, buffers, size):
+        with self.ready:
+            if self.queued_bytes and self.queued_bytes + size > OUTBOUND_LIMIT and not self.closed:
+                if SLOW_PEER_POLICY == 'drop':
+                    metrics.count('frames_dropped')
+                    return False
+                if SLOW_PEER_POLICY == 'block':
+                    deadline = time.monotonic() + SEND_BLOCK_TIMEOUT
+                    while self.queued_bytes and self.queued_bytes + size > OUTBOUND_LIMIT and not self.closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.ready.wait(remaining)
+                if self.queued_bytes and self.queued_bytes + size > OUTBOUND_LIMIT and not self.closed:
+                    metrics.count('slow_peer_disconnects')
+                    self.abort()
+            if self.successor:
+                return self.successor.enqueue(buffers, size)
+            if self.closed:
+                if self.session:
+                    # Kept for the player to pick up with RESUME
+                    self.session.replay.extend(buffers)
+                else:
+                    metrics.count('send_failures')
+                return False
+            self.queue.extend(buffers)
+            self.queued_bytes += size
+            if self.session:
+                self.session.replay.extend(buffers)
+            self.ready.notify_all()
+            return True
+
+    def start_session(self, session, frame):
+        # frame names the session and is the last thing sent outside it; holding the
+        # lock keeps other threads' frames from landing on either side unrecorded
+        with self.ready:
+            self.sendall(frame)
+            self.session = session
+
+    def transfer(self, conn, offset, frame):
+        # Moves this connection's session to conn, which is sent frame and then what
+        # the client missed after `offset`. Frames still on their way here follow it.
+        with self.ready:
+            missed = self.session.replay.since(offset) if self.session else None
+            if missed is None:
+                return False
+            conn.start_session(self.session, frame + missed)
+            self.session = None
+            self.successor = conn
+        self.abort()
+        return True
+
+    def write_loop(self):
+        try:
+            while True:
+                with self.ready:
+                    while not self.queue and not self.closed:
+                        self.ready.wait()
+                    if not self.queue:
+                        break  # Closed and fully flushed
+                    buffers = list(self.queue)
+                    self.queue.clear()
+                    self.queued_bytes = 0
+                    self.ready.notify_all()  # Wake senders blocked on a full queue
+                # Coalesce every queued frame into a single send
+                self.sock.sendall(b''.join(buffers))
+        except OSError:
+            metrics.count('send_failures')
+            self.abort()
+        finally:
+            self.sock.close()
+            metrics.retire_shard()
+
+    def abort(self):
+        # Drops anything queued and wakes the reader, whose recv() then returns.
+        # Shut down before waking the writer: once woken it may close the socket,
+        # and shutting down a closed socket would leave the reader blocked.
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        with self.ready:
+            self.closed = True
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.ready.notify_all()
+
+    def close(self):
+        # Lets the writer flush what is queued; a peer that will not read is cut off
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+        if threading.current_thread() is not self.writer:
+            self.writer.join(CLOSE_TIMEOUT)
+            if self.writer.is_alive():
+                self.abort()
+
+def handle_client(sock, addr, initial_data=b''):
+    # initial_data holds bytes another worker already read before handing us the socket
     print(f"Connected by {addr}")
+    conn = SocketConnection(sock)
     current_room = None
+    decoder = FrameDecoder()
+    shard = conn.shard
+    shard.count('connections_opened')
+    watch_connection(conn)
     try:
+        data = initial_data
         while True:
-            data = conn.recv(1024).decode()
+            if data:
+                conn.last_seen = time.monotonic()
+                shard.count('bytes_in', len(data))
+                # One recv() may carry several pipelined commands
+                frames = decoder.feed_views(data)
+                for index, frame in enumerate(frames):
+                    try:
+                        current_room = handle_frame(conn, addr, frame, current_room)
+                    except ConnectionHandoff as handoff:
+                        # Pass on this frame and everything not yet processed
+                        pending = encode_frames(bytes(unprocessed) for unprocessed in frames[index:]) + bytes(decoder.buffer)
+                        room_directory.hand_off(handoff.worker_id, sock, addr, pending)
+                        return
+            data = conn.recv(4096)
             if not data:
                 break
-            try:
-                decoded_data = data
-            except UnicodeDecodeError as e:
-                print(f"UnicodeDecodeError: {e}")
-                print(f"Raw data received: {data}")
-                # Optionally, you can close the connection or continue based on your needs
-                break
-            # Proceed with the decoded data
-            command_parts = data.strip().split(' ')
-            command = command_parts[0]
-            params = command_parts[1:]
-
-            if command == 'CREATE_ROOM':
-                room_name = params[0]
-                host_ip = addr[0]
-                rooms[room_name] = {'host_conn': conn, 'client_conn': None, 'host_addr': addr}
-                conn.sendall(f"ROOM_CREATED {room_name}".encode())
-                current_room = room_name
-                print(f"Room created: {room_name} by {host_ip}")
-            
-            elif command == 'LIST_ROOMS':
-                room_list = ','.join(rooms.keys())
-                conn.sendall(f"ROOM_LIST {room_list}".encode())
-            
-            elif command == 'JOIN_ROOM':
-                room_name = params[0]
-                if room_name in rooms:
-                    if rooms[room_name]['client_conn'] is None:
-                        rooms[room_name]['client_conn'] = conn  # Set client connection
-                        conn.sendall(f"JOINED_ROOM {room_name}".encode())
-                        current_room = room_name
-                        print(f"Player from {addr[0]} joined room {room_name}")
-                        # Inform host that the client has joined
-                        host_conn = rooms[room_name]['host_conn']
-                        host_conn.sendall(f"CLIENT_JOINED {addr[0]}".encode())
-                    else:
-                        conn.sendall("ERROR Room already has a client".encode())
-                else:
-                    conn.sendall("ERROR Room not found".encode())
-            
-            elif command == 'MESSAGE':
-                # Forward message to the other player
-                message = ' '.join(params)
-                if current_room in rooms:
-                    room = rooms[current_room]
-                    if conn == room['host_conn']:
-                        # Forward host's message to client
-                        client_conn = room['client_conn']
-                        if client_conn:
-                            client_conn.sendall(f"MESSAGE_FROM_HOST {message}".encode())
-                    elif conn == room['client_conn']:
-                        # Forward client's message to host
-                        host_conn = room['host_conn']
-                        if host_conn:
-                            host_conn.sendall(f"MESSAGE_FROM_CLIENT {message}".encode())
-                else:
-                    conn.sendall("ERROR Not in a room".encode())
-            
+
+    except UnicodeDecodeError as e:
+        print(f"UnicodeDecodeError from {addr}: {e}")
+    except FrameError as e:
+        print(f"Framing error from {addr}: {e}")
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        unwatch_connection(conn)
+        cleanup_connection(conn, current_room)
+        conn.close()
+        shard.count('connections_closed')
+        metrics.retire_shard()
+
+class AsyncConnection:
+    # Wraps an asyncio StreamWriter so rooms can hold it like a socket.
+    # write() only buffers in the transport (which coalesces queued frames), so
+    # sendall() never blocks the event loop; OUTBOUND_LIMIT bounds that buffer.
+    def __init__(self, writer):
+        self.writer = writer
+        self.shard = metrics.shard()  # The event loop thread's shard
+        self.last_seen = time.monotonic()
+        self.heartbeat = None
+        self.session = None
+        self.successor = None
+
+    @property
+    def closed(self):
+        return self.writer.is_closing()
+
+    def backlog(self):
+        return self.writer.transport.get_write_buffer_size()
+
+    def abort(self):
+        self.writer.transport.abort()
+
+    def sendall(self, data):
+        if self.successor:
+            self.successor.sendall(data)
+        elif self.accept((data,), len(data)):
+            self.writer.write(data)
+            metrics.count('bytes_out', len(data))
+
+    def send_buffers(self, buffers):
+        # Used by the relay, which counts bytes_out itself
+        if self.successor:
+            return self.successor.send_buffers(buffers)
+        if self.accept(buffers, sum(map(len, buffers))):
+            self.writer.writelines(buffers)
+            return True
+        return False
+
+    def accept(self, buffers, size):
+        # Applies SLOW_PEER_POLICY. 'block' is enforced by the sender's handler,
+        # which awaits wait_for_room() before reading more from its own socket.
+        if self.writer.is_closing():
+            if self.session:
+                # Kept for the player to pick up with RESUME
+                self.session.replay.extend(buffers)
             else:
-                conn.sendall("ERROR Invalid command".encode())
-    
-    except ConnectionResetError:
+                metrics.count('send_failures')
+            return False
+        backlog = self.backlog()
+        if backlog and backlog + size > OUTBOUND_LIMIT:
+            if SLOW_PEER_POLICY == 'drop':
+                metrics.count('frames_dropped')
+                return False
+            if SLOW_PEER_POLICY == 'disconnect':
+                metrics.count('slow_peer_disconnects')
+                self.abort()
+                return self.accept(buffers, size)  # Closing now, so only kept for replay
+        if self.session:
+            self.session.replay.extend(buffers)
+        return True
+
+    def start_session(self, session, frame):
+        self.sendall(frame)
+        self.session = session
+
+    def transfer(self, conn, offset, frame):
+        # Same as SocketConnection.transfer(); everything here runs on the event loop
+        missed = self.session.replay.since(offset) if self.session else None
+        if missed is None:
+            return False
+        conn.start_session(self.session, frame + missed)
+        self.session = None
+        self.successor = conn
+        self.abort()
+        return True
+
+    async def wait_for_room(self):
+        if self.backlog() <= OUTBOUND_LIMIT:
+            return
+        try:
+            await asyncio.wait_for(self.writer.drain(), SEND_BLOCK_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.count('slow_peer_disconnects')
+            self.abort()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def close(self):
+        self.writer.close()
+
+def peer_of(conn, current_room):
+    room = rooms.get(current_room)
+    if room is None:
+        return None
+    if conn is room['host_conn']:
+        return room['client_conn']
+    if conn is room['client_conn']:
+        return room['host_conn']
+    return None
+
+async def handle_client_async(reader, writer):
+    addr = writer.get_extra_info('peername')
+    print(f"Connected by {addr}")
+    conn = AsyncConnection(writer)
+    current_room = None
+    decoder = FrameDecoder()
+    metrics.count('connections_opened')
+    watch_connection(conn)
+    try:
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            conn.last_seen = time.monotonic()
+            metrics.count('bytes_in', len(data))
+            for frame in decoder.feed_views(data):
+                current_room = handle_frame(conn, addr, frame, current_room)
+            await writer.drain()
+            if SLOW_PEER_POLICY == 'block':
+                # Stop reading from this client until its peer catches up
+                peer = peer_of(conn, current_room)
+                if peer:
+                    await peer.wait_for_room()
+    except UnicodeDecodeError as e:
+        print(f"UnicodeDecodeError from {addr}: {e}")
+    except FrameError as e:
+        print(f"Framing error from {addr}: {e}")
+    except (ConnectionResetError, BrokenPipeError):
         pass
     finally:
-        # Cleanup when a player disconnects
-        if current_room and current_room in rooms:
-            room = rooms[current_room]
-            if conn == room['host_conn']:
-                print(f"Host disconnected from room {current_room}")
-                # Notify client that the host disconnected
-                if room['client_conn']:
-                    room['client_conn'].sendall("HOST_DISCONNECTED".encode())
-                del rooms[current_room]
-            elif conn == room['client_conn']:
-                print(f"Client disconnected from room {current_room}")
-                # Notify host that the client disconnected
-                if room['host_conn']:
-                    room['host_conn'].sendall("CLIENT_DISCONNECTED".encode())
-                room['client_conn'] = None
+        unwatch_connection(conn)
+        cleanup_connection(conn, current_room)
         conn.close()
+        metrics.count('connections_closed')
+
+def local_room_states():
+    return count_rooms(rooms)
 
-def console_listener():
+def console_listener(source=metrics, room_states=local_room_states):
+    # The supervisor of --workers passes the metrics and room states of all its workers
     global shutdown_flag
+    baseline = new_baseline(source)
     while not shutdown_flag:
         command = input()
         if command.strip().lower() == 'shutdown':
             print("Shutdown command received. Shutting down server.")
             shutdown_flag = True
             break
+        elif command.strip().lower() == 'stats':
+            print(format_report(build_report(source, room_states(), baseline)))
+
+def start_stats_dump(path, interval):
+    threading.Thread(target=dump_periodically, args=(metrics, rooms, path, interval, lambda: shutdown_flag),
+                     daemon=True).start()
 
 def start_server():
     global shutdown_flag
     print("Server starting...")
     # Start the console listener in a separate thread
     threading.Thread(target=console_listener, daemon=True).start()
+    if STATS_FILE:
+        start_stats_dump(STATS_FILE, STATS_INTERVAL)
+
+    start_reaper(lambda: shutdown_flag)
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind((HOST, PORT))
         s.listen()
-        s.settimeout(1.0)  # Set a timeout for accept()
         print(f"Server listening on port {PORT}")
-        while not shutdown_flag:
-            try:
-                conn, addr = s.accept()
-                threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
-            except socket.timeout:
-                continue  # Loop again to check shutdown_flag
+        accept_loop(s, lambda: shutdown_flag)
         print("Server has been shut down.")
 
+def accept_loop(s, should_stop):
+    s.settimeout(1.0)  # Set a timeout for accept()
+    while not should_stop():
+        try:
+            conn, addr = s.accept()
+            # Frames are already coalesced by the writer thread, so don't let Nagle hold them back
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+        except socket.timeout:
+            continue  # Loop again to check should_stop
+
+async def serve_async():
+    server = await asyncio.start_server(handle_client_async, HOST, PORT, backlog=1024)
+    print(f"Server listening on port {PORT} (asyncio)")
+    if IDLE_TIMEOUT or RESUME_GRACE:
+        asyncio.ensure_future(run_reaper_async())
+    async with server:
+        while not shutdown_flag:
+            await asyncio.sleep(1.0)  # Loop again to check shutdown_flag
+    print("Server has been shut down.")
+
+def start_server_async():
+    # Same protocol as start_server(), but every connection is a coroutine on one
+    # event loop instead of an OS thread blocked in recv().
+    print("Server starting...")
+    threading.Thread(target=console_listener, daemon=True).start()
+    if STATS_FILE:
+        start_stats_dump(STATS_FILE, STATS_INTERVAL)
+    asyncio.run(serve_async())
+
+def configure(args):
+    # Applies command line settings; sharding.py calls this again in each worker
+    global PORT, STATS_FILE, STATS_INTERVAL, OUTBOUND_LIMIT, SLOW_PEER_POLICY, HEARTBEAT_INTERVAL, IDLE_TIMEOUT
+    global RESUME_GRACE
+    PORT = args.port
+    STATS_FILE = args.stats_file
+    STATS_INTERVAL = args.stats_interval
+    OUTBOUND_LIMIT = args.outbound_limit
+    SLOW_PEER_POLICY = args.slow_peer_policy
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
+    IDLE_TIMEOUT = args.idle_timeout
+    RESUME_GRACE = args.resume_grace
+
 if __name__ == '__main__':
-    start_server()
+    parser = argparse.ArgumentParser(description="Battleship relay server")
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded',
+                        help="threaded: one thread per connection, asyncio: single event loop")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="more than 1 forks threaded worker processes sharing the port via SO_REUSEPORT")
+    parser.add_argument('--stats-file', help="append a JSON stats report to this file periodically")
+    parser.add_argument('--stats-interval', type=float, default=STATS_INTERVAL, help="seconds between stats reports")
+    parser.add_argument('--outbound-limit', type=int, default=OUTBOUND_LIMIT, help="max bytes queued per connection")
+    parser.add_argument('--slow-peer-policy', choices=SLOW_PEER_POLICIES, default=SLOW_PEER_POLICY,
+                        help="what to do when a connection's outbound queue is full")
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL,
+                        help="seconds of silence before the server sends PING")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="seconds of silence before a connection is closed, 0 to never close")
+    parser.add_argument('--resume-grace', type=float, default=RESUME_GRACE,
+                        help="seconds a dropped player's seat is held for RESUME, 0 to give it up at once")
+    args = parser.parse_args()
+    configure(args)
+    if args.workers > 1:
+        if args.mode != 'threaded':
+            parser.error("--workers requires --mode threaded")
+        import sharding
+        sharding.start_sharded_server(args.workers, args)
+    elif args.mode == 'asyncio':
+        start_server_async()
+    else:
+        start_server()
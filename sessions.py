@@ -0,0 +1,59 @@
+# sessions.py
+#
+# Resumable seats in a room. Entering a room gives a player a session token, and
+# from then on every byte the server sends that player is also appended to the
+# session's replay buffer. If the connection drops, the seat is held for a grace
+# window; a new connection that sends RESUME <token> received=<n> takes the seat
+# back and is first sent everything after the n-th byte the client had received,
+# so both sides carry on without rebuilding the game. The other direction works the
+# same way: the session counts the bytes of the moves (protocol.SESSION_COMMANDS)
+# the player has sent, RESUMED reports that, and the client sends again what is missing.
+
+import secrets
+
+class ReplayBuffer:
+    # The most recent bytes of one stream, addressed by their offset in the stream.
+    # At least `limit` bytes are kept; trimming only when twice that is reached keeps
+    # the memmove off the per-send path.
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+        self.end = 0  # Offset just past the last byte written
+
+    def extend(self, buffers):
+        data = self.data
+        kept = len(data)
+        for buffer in buffers:
+            data += buffer
+        self.end += len(data) - kept
+        if len(data) > 2 * self.limit:
+            del data[:len(data) - self.limit]
+
+    def start(self):
+        # Offset of the oldest byte still kept
+        return self.end - len(self.data)
+
+    def since(self, offset):
+        # Everything after `offset`, or None if part of it was already trimmed
+        if not self.start() <= offset <= self.end:
+            return None
+        return bytes(self.data[offset - self.start():])
+
+class Session:
+    def __init__(self, token, room_name, role, replay_limit):
+        self.token = token
+        self.room_name = room_name
+        self.role = role
+        self.conn = None  # The connection currently holding the seat
+        self.replay = ReplayBuffer(replay_limit)
+        self.received = 0  # Bytes of SESSION_COMMANDS frames the player has sent us
+        self.expiry = None  # Grace timer while the seat is held for a dropped connection
+
+def new_token(worker_id=None):
+    # Tokens from a worker process name the worker, so RESUME can be handed to it
+    token = secrets.token_hex(16)
+    return f"{worker_id}.{token}" if worker_id is not None else token
+
+def token_worker(token):
+    worker, dot, _ = token.partition('.')
+    return int(worker) if dot and worker.isdigit() else None
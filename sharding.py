@@ -0,0 +1,214 @@
+# sharding.py
+#
+# Multi-process server: a supervisor forks worker processes that each run the
+# threaded server on the same port via SO_REUSEPORT, so the kernel spreads new
+# connections across cores. Rooms live in the worker that created them. A shared
+# directory (a multiprocessing.Manager dict, served over a local socket) maps
+# room names to workers, and a JOIN_ROOM that lands on the wrong worker has its
+# socket passed to the owner over a Unix socket (SCM_RIGHTS). Each worker copies
+# the other workers' rooms from the directory into its room index once a second,
+# so LIST_ROOMS and room list subscribers see every room without a round trip.
+# Quick-match rooms are unlisted, so waiting ones go into a second shared dict with
+# their mode and rules; a QUICK_MATCH with no waiting room in its own worker takes
+# the oldest matching one from there and is handed to that room's worker.
+# Workers also copy their metrics into a second shared dict, which the supervisor's
+# console adds up for the stats command.
+
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+import server
+from metrics import MetricsShard, count_rooms
+from protocol import HEADER
+
+def handoff_path(port, worker_id):
+    return os.path.join(tempfile.gettempdir(), f"battleship-{port}-worker-{worker_id}.sock")
+
+REMOTE_ROOMS_INTERVAL = 1.0  # Seconds between copies of the directory into the room index
+STATS_SHARE_INTERVAL = 1.0  # Seconds between copies of a worker's metrics for the supervisor
+
+class RoomDirectory:
+    def __init__(self, shared_rooms, shared_matches, worker_id, port):
+        # room_name -> (worker_id, state, created, mode), shared by every worker
+        self.shared_rooms = shared_rooms
+        # (worker_id, room_name) -> (match key, created) for waiting quick-match rooms;
+        # room names are only unique within a worker
+        self.shared_matches = shared_matches
+        self.worker_id = worker_id
+        self.port = port
+
+    def publish(self, room_name, state, created, mode):
+        # Adds or updates our entry for room_name. Returns False and leaves the entry
+        # alone if another worker has the name; setdefault runs in the manager process,
+        # so two workers publishing the same new name cannot both get it.
+        entry = (self.worker_id, state, created, mode)
+        if self.shared_rooms.setdefault(room_name, entry)[0] != self.worker_id:
+            return False
+        self.shared_rooms[room_name] = entry
+        return True
+
+    def unregister(self, room_name):
+        if self.owner(room_name) == self.worker_id:
+            self.shared_rooms.pop(room_name, None)
+
+    def owner(self, room_name):
+        return self.shared_rooms.get(room_name, (None,))[0]
+
+    def offer_match(self, room_name, key, created):
+        self.shared_matches[(self.worker_id, room_name)] = (key, created)
+
+    def withdraw_match(self, room_name):
+        self.shared_matches.pop((self.worker_id, room_name), None)
+
+    def claim_match(self, key):
+        # Takes the longest-waiting quick-match room with key from another worker and
+        # returns that worker, or None. pop() runs in the manager process, so a room
+        # is only ever claimed once.
+        waiting = sorted((created, entry) for entry, (entry_key, created) in self.shared_matches.copy().items()
+                         if entry_key == key and entry[0] != self.worker_id)
+        for _, entry in waiting:
+            if self.shared_matches.pop(entry, None) is not None:
+                return entry[0]
+        return None
+
+    def remote_rooms(self):
+        # name -> (state, created, mode) for rooms owned by other workers, in one round trip
+        return {name: entry[1:] for name, entry in self.shared_rooms.copy().items()
+                if entry[0] != self.worker_id}
+
+    def hand_off(self, worker_id, sock, addr, pending):
+        # Sends the client socket and the bytes already read from it to another worker
+        address = f"{addr[0]} {addr[1]}".encode()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as channel:
+            channel.connect(handoff_path(self.port, worker_id))
+            socket.send_fds(channel, [HEADER.pack(len(address)) + address], [sock.fileno()])
+            channel.sendall(pending)
+
+def receive_handoff(channel):
+    data, fds, _, _ = socket.recv_fds(channel, 4096, 1)
+    chunks = [data]
+    while True:
+        chunk = channel.recv(4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    data = b''.join(chunks)
+    (length,) = HEADER.unpack_from(data)
+    host, port = data[HEADER.size:HEADER.size + length].decode().split(' ')
+    sock = socket.socket(fileno=fds[0])
+    return sock, (host, int(port)), data[HEADER.size + length:]
+
+def handoff_listener(path):
+    if os.path.exists(path):
+        os.unlink(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(path)
+        listener.listen()
+        while True:
+            channel, _ = listener.accept()
+            with channel:
+                sock, addr, pending = receive_handoff(channel)
+            threading.Thread(target=server.handle_client, args=(sock, addr, pending), daemon=True).start()
+
+def sync_remote_rooms(directory, should_stop):
+    # Copies changes to other workers' rooms into this worker's room index and
+    # turns them into room list events
+    known = {}
+    while not should_stop():
+        time.sleep(REMOTE_ROOMS_INTERVAL)
+        current = directory.remote_rooms()
+        for name, entry in current.items():
+            previous = known.get(name)
+            if previous != entry:
+                server.room_index.update(name, *entry)
+                if previous is None:
+                    server.publish_room_event(f"ROOM_ADDED {name} {entry[0]}")
+                elif previous[0] != entry[0]:
+                    server.publish_room_event(f"ROOM_STATE {name} {entry[0]}")
+        for name in known.keys() - current.keys():
+            server.room_index.remove(name)
+            server.publish_room_event(f"ROOM_REMOVED {name}")
+        known = current
+
+class WorkerMetrics:
+    # Every worker's metrics added together, as the supervisor's console sees them.
+    # Workers share them every STATS_SHARE_INTERVAL, so stats lags by up to that.
+    def __init__(self, shared_stats):
+        # worker_id -> (counters, histograms, room states) of that worker
+        self.shared_stats = shared_stats
+        self.started_at = time.time()
+
+    def snapshot(self):
+        total = MetricsShard()
+        for counters, histograms, _ in self.shared_stats.values():
+            shard = MetricsShard()
+            shard.counters = counters
+            shard.histograms = histograms
+            total.merge(shard)
+        return total
+
+    def room_states(self):
+        total = {}
+        for _, _, room_states in self.shared_stats.values():
+            for state, count in room_states.items():
+                total[state] = total.get(state, 0) + count
+        return total
+
+def share_stats(shared_stats, worker_id, should_stop):
+    while not should_stop():
+        snapshot = server.metrics.snapshot()
+        shared_stats[worker_id] = (snapshot.counters, snapshot.histograms, count_rooms(server.rooms))
+        time.sleep(STATS_SHARE_INTERVAL)
+
+def run_worker(worker_id, shared_rooms, shared_matches, match_lock, shared_stats, stop_event, args):
+    server.configure(args)
+    server.match_lock = match_lock
+    port = args.port
+    server.room_directory = RoomDirectory(shared_rooms, shared_matches, worker_id, port)
+    if args.stats_file:
+        # Each worker counts only its own connections, so each gets its own file
+        server.start_stats_dump(f"{args.stats_file}.{worker_id}", args.stats_interval)
+    path = handoff_path(port, worker_id)
+    threading.Thread(target=handoff_listener, args=(path,), daemon=True).start()
+    threading.Thread(target=sync_remote_rooms, args=(server.room_directory, stop_event.is_set),
+                     daemon=True).start()
+    threading.Thread(target=share_stats, args=(shared_stats, worker_id, stop_event.is_set), daemon=True).start()
+    server.start_reaper(stop_event.is_set)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((server.HOST, port))
+        s.listen()
+        print(f"Worker {worker_id} (pid {os.getpid()}) listening on port {port}")
+        server.accept_loop(s, stop_event.is_set)
+    if os.path.exists(path):
+        os.unlink(path)
+
+def start_sharded_server(workers, args):
+    print("Server starting...")
+    with multiprocessing.Manager() as manager:
+        shared_rooms = manager.dict()
+        shared_matches = manager.dict()
+        match_lock = manager.Lock()
+        shared_stats = manager.dict()
+        stop_event = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=run_worker, daemon=True,
+                                             args=(worker_id, shared_rooms, shared_matches, match_lock, shared_stats,
+                                                   stop_event, args))
+                     for worker_id in range(workers)]
+        for process in processes:
+            process.start()
+        # Only after forking: a child forked while this thread sits in input() would
+        # block forever trying to close its copy of stdin
+        workers_metrics = WorkerMetrics(shared_stats)
+        threading.Thread(target=server.console_listener, args=(workers_metrics, workers_metrics.room_states),
+                         daemon=True).start()
+        while not server.shutdown_flag:
+            time.sleep(1.0)
+        stop_event.set()
+        for process in processes:
+            process.join(timeout=5)
+    print("Server has been shut down.")
@@ -0,0 +1,142 @@
+# simulate.py
+#
+# Headless batch simulator for comparing computer strategies and fleet placements.
+# Plays complete games between two players on rules.Rules (placement, alternating
+# attacks, game over) with no pygame or sockets, spread over a process pool in
+# chunks of game numbers, and reports each side's wins and shots-to-win distribution.
+#   python simulate.py --games 100000 --seed 1 [--strategy hunt --opponent density]
+#                      [--placement random|no-touch] [--workers 8] [--chunk 500] [--histogram]
+#                      [--size 100 --fleet Carrier:5*10,Destroyer:2*40]
+# Game i draws everything (fleets, AI seeds, who goes first) from its own generator
+# seeded with (seed, i), so results depend only on --seed and --games, never on how
+# the games were split between workers.
+
+import argparse
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from ai import STRATEGIES
+from bitboard import random_fleet
+from constants import GRID_SIZE
+from protocol import room_rules
+from rules import Rules
+
+# name -> placement(rng, size, ship_sizes) giving ship -> (x, y, orientation)
+PLACEMENTS = {'random': random_fleet, 'no-touch': partial(random_fleet, no_touch=True)}
+SIDES = ('A', 'B')  # A plays --strategy, B plays --opponent
+
+class Player:
+    def __init__(self, rng, my_turn, strategy, placement, size, ship_sizes):
+        self.rules = Rules(my_turn=my_turn, size=size, ship_sizes=ship_sizes)
+        for ship, (x, y, orientation) in PLACEMENTS[placement](rng, size, ship_sizes).items():
+            self.rules.place(ship, x, y, orientation)
+        self.rules.ships_ready()
+        self.ai = STRATEGIES[strategy](size, ship_sizes, rng.random())
+
+def play_game(index, seed, strategies, placement, size, ship_sizes):
+    # Plays game number index; returns (winning side, shots the winner fired)
+    rng = random.Random(f"{seed}-{index}")
+    first = rng.randrange(2)
+    players = [Player(rng, side == first, strategy, placement, size, ship_sizes)
+               for side, strategy in enumerate(strategies)]
+    for player in players:
+        player.rules.opponent_placed()
+    turn = first
+    while True:
+        attacker, defender = players[turn], players[1 - turn]
+        x, y = attacker.ai.choose()
+        error = attacker.rules.attack_error(x, y)
+        if error:
+            raise RuntimeError(f"{strategies[turn]} chose ({x}, {y}): {error}")
+        attacker.rules.fire(x, y)
+        hit, sunk_ship = defender.rules.receive_attack(x, y)
+        attacker.rules.record_result(x, y, hit)
+        attacker.ai.record(x, y, hit, sunk_ship)
+        if defender.rules.check_game_over():
+            winner = SIDES[turn]
+            attacker.rules.end(winner)
+            defender.rules.end(winner)
+            return winner, attacker.rules.moves
+        turn = 1 - turn
+
+def play_chunk(start, stop, seed, strategies, placement, size, ship_sizes):
+    # Games start..stop-1: side -> Counter of shots-to-win over the games it won
+    shots = {side: Counter() for side in SIDES}
+    for index in range(start, stop):
+        winner, moves = play_game(index, seed, strategies, placement, size, ship_sizes)
+        shots[winner][moves] += 1
+    return shots
+
+def percentile(counts, fraction):
+    # Value at fraction of the way through a Counter of values -> occurrences
+    rank = int(sum(counts.values()) * fraction)
+    for value in sorted(counts):
+        rank -= counts[value]
+        if rank < 0:
+            return value
+    return max(counts, default=0)
+
+def report(args, shots, elapsed):
+    print(f"games        {args.games} (seed {args.seed}, {args.size}x{args.size} board, {len(args.fleet)} ships, "
+          f"{args.placement} placement) in {elapsed:.2f}s, {args.games / elapsed * 60:,.0f}/min on {args.workers} workers")
+    for side, strategy in zip(SIDES, (args.strategy, args.opponent)):
+        counts = shots[side]
+        wins = sum(counts.values())
+        line = f"{side} {strategy:<10} {wins} wins ({wins / args.games * 100:.1f}%)"
+        if wins:
+            mean = sum(value * count for value, count in counts.items()) / wins
+            line += (f"  shots to win mean {mean:.2f}  p10 {percentile(counts, 0.1)}  p50 {percentile(counts, 0.5)}  "
+                     f"p90 {percentile(counts, 0.9)}  min {min(counts)}  max {max(counts)}")
+        print(line)
+    if args.histogram:
+        total = shots['A'] + shots['B']
+        widest = max(total.values(), default=1)
+        print("shots  " + "  ".join(f"{side} {strategy}" for side, strategy in zip(SIDES, (args.strategy, args.opponent))))
+        for value in range(min(total, default=0), max(total, default=-1) + 1):
+            print(f"{value:5}  {shots['A'][value]:>7} {shots['B'][value]:>7}  {'#' * round(total[value] / widest * 50)}")
+
+def run(args):
+    chunks = [(start, min(start + args.chunk, args.games), args.seed, (args.strategy, args.opponent),
+               args.placement, args.size, args.fleet) for start in range(0, args.games, args.chunk)]
+    start_time = time.perf_counter()
+    if args.workers == 1:
+        # In process, which is easier to profile
+        results = [play_chunk(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(play_chunk, *zip(*chunks)))
+    shots = {side: Counter() for side in SIDES}
+    for result in results:
+        for side in SIDES:
+            shots[side].update(result[side])
+    report(args, shots, time.perf_counter() - start_time)
+    return shots
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch simulator for Battleship computer strategies")
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--strategy', choices=STRATEGIES, default='hunt', help="side A's strategy")
+    parser.add_argument('--opponent', choices=STRATEGIES, help="side B's strategy (default: the same as A)")
+    parser.add_argument('--placement', choices=PLACEMENTS, default='random', help="how both sides place their fleets; no-touch layouts are about 4x slower to draw "
+                        "(about 20-30k/s against 85-115k/s on the classic board)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument('--chunk', type=int, default=500, help="games per task handed to a worker")
+    parser.add_argument('--histogram', action='store_true', help="print the shots-to-win distribution")
+    parser.add_argument('--size', type=int, default=GRID_SIZE, help="board size")
+    parser.add_argument('--fleet', help="fleet, e.g. Carrier:5*10,Destroyer:2*40")
+    args = parser.parse_args()
+    args.opponent = args.opponent or args.strategy
+    if args.games < 1 or args.workers < 1 or args.chunk < 1:
+        parser.error("--games, --workers and --chunk must be positive")
+    try:
+        args.size, args.fleet = room_rules({'size': args.size, 'fleet': args.fleet} if args.fleet else {'size': args.size})
+    except ValueError as e:
+        parser.error(str(e))
+    run(args)
+
+if __name__ == '__main__':
+    main()
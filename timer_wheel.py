@@ -0,0 +1,83 @@
+# timer_wheel.py
+#
+# Hierarchical timer wheel. Level 0 has one slot per tick; each higher level has
+# slots that are `slots` times wider. Scheduling and cancelling are O(1), and
+# advancing one tick only touches the timers that are due (plus, every `slots`
+# ticks, one slot of the next level whose timers are cascaded down). This keeps
+# per-connection timeouts cheap with hundreds of thousands of connections, where
+# a thread or a sleep per connection would not be.
+#
+# The wheel is not thread-safe; callers that share it between threads lock around it.
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'slot')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline  # In ticks
+        self.callback = callback
+        self.slot = None  # The set this timer currently sits in
+
+class TimerWheel:
+    def __init__(self, tick=0.5, slots=64, levels=4, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.current = int(now / tick)  # Ticks processed so far
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, delay, callback):
+        timer = Timer(self.current + max(1, int(delay / self.tick + 0.999999)), callback)
+        self.insert(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        if timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+            self.count -= 1
+
+    def insert(self, timer):
+        remaining = timer.deadline - self.current
+        level = 0
+        span = self.slots
+        while remaining >= span and level < self.levels - 1:
+            level += 1
+            span *= self.slots
+        # Timers beyond the top level's range wait in its furthest slot and are
+        # re-inserted each time that slot cascades
+        deadline = min(timer.deadline, self.current + span - 1)
+        slot = self.wheels[level][(deadline // (span // self.slots)) % self.slots]
+        slot.add(timer)
+        timer.slot = slot
+
+    def advance(self, now):
+        # Moves the wheel up to time `now` and returns the timers that expired.
+        # Callbacks are left to the caller so it can run them outside any lock.
+        expired = []
+        target = int(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            # Cascade higher levels whose slot boundary we just crossed
+            span = 1
+            for level in range(1, self.levels):
+                span *= self.slots
+                if self.current % span:
+                    break
+                slot = self.wheels[level][(self.current // span) % self.slots]
+                timers = list(slot)
+                slot.clear()
+                for timer in timers:
+                    self.insert(timer)
+            slot = self.wheels[0][self.current % self.slots]
+            for timer in list(slot):
+                if timer.deadline <= self.current:
+                    slot.discard(timer)
+                    timer.slot = None
+                    self.count -= 1
+                    expired.append(timer)
+        return expired
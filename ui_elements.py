@@ -34,6 +34,9 @@ class Button:
             surface.blit(selectRoomScroll, self.rect)
         else:
             pygame.draw.rect(surface, WHITE, self.rect)
+            text_surface = self.font.render(self.text, True, BLUE)
+            text_rect = text_surface.get_rect(center=self.rect.center)
+            surface.blit(text_surface, text_rect)
             
 
     def check_click(self, pos):